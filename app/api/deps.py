@@ -1,9 +1,12 @@
-from app.db.session import SessionLocal
+from ipaddress import ip_address, ip_network
+
+from app.db.session import AsyncSessionLocal, SessionLocal
 from app.core.token import verify_access_token
+from app.core.token_cache import token_cache
 from app.db.models.user import User
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.crud.user import get_user
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
@@ -17,8 +20,13 @@ def get_db():
         db.close()
 
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_current_user(
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)
 ) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -26,20 +34,54 @@ def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    token = verify_access_token(token, credentials_exception)
-    user = get_user(db, token.id)
+    user = await _user_for_token(token, db, credentials_exception)
     if not user:
         raise credentials_exception
 
     return user
 
 
-def get_user_from_token(
-    token: str , db: Session
+async def get_user_from_token(
+    token: str , db: AsyncSession
 ) -> User | None:
     try:
-        token_data = verify_access_token(token, None)
-        user = get_user(db, token_data.id)
-        return user
+        return await _user_for_token(token, db, None)
     except Exception:
         return None
+
+
+async def _user_for_token(token: str, db: AsyncSession, credentials_exception) -> User | None:
+    """Verify `token` and load its user, served from `token_cache` when possible."""
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+    token_data = verify_access_token(token, credentials_exception)
+    user = await db.run_sync(get_user, token_data.id)
+    if user is not None:
+        token_cache.put(token, user, token_data.exp)
+    return user
+
+
+def allow_clients(allowed: str):
+    """
+    Dependency for operator-only routes: answers 404 to clients whose address
+    is not in `allowed`, a comma-separated list of addresses/networks (empty
+    lets anyone through).
+    """
+    networks = [
+        ip_network(network.strip(), strict=False)
+        for network in allowed.split(",")
+        if network.strip()
+    ]
+
+    def check_client(request: Request) -> None:
+        if not networks:
+            return
+        try:
+            address = ip_address(request.client.host if request.client else None)
+        except ValueError:
+            address = None
+        if address is None or not any(address in network for network in networks):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+    return check_client
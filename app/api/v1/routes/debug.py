@@ -0,0 +1,56 @@
+from anyio import to_thread
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+
+from app.api.deps import allow_clients
+from app.core.config import settings
+from app.utils.profiler import profiler
+from app.utils.tracing import tracer
+
+router = APIRouter(
+    prefix="/debug",
+    include_in_schema=False,
+    dependencies=[Depends(allow_clients(settings.debug_allow))],
+)
+
+
+def _require_enabled():
+    if not settings.debug_endpoints:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+
+@router.get("/tracing")
+async def get_tracing():
+    _require_enabled()
+    return tracer.stats()
+
+
+@router.post("/tracing")
+async def set_tracing(
+    sample_rate: float | None = Query(None, ge=0, le=1),
+    slow_ms: float | None = Query(None, ge=0),
+):
+    """Change the trace sampling rate and slow-op threshold (0 turns either off)."""
+    _require_enabled()
+    tracer.configure(sample_rate=sample_rate, slow_ms=slow_ms)
+    return tracer.stats()
+
+
+@router.get("/profiler")
+async def get_profiler():
+    _require_enabled()
+    return profiler.stats()
+
+
+@router.post("/profiler")
+async def toggle_profiler(
+    enabled: bool,
+    interval: float | None = Query(None, gt=0, le=1),
+):
+    """Start sampling the event loop, or stop and write the folded stacks to `profiler_file`."""
+    _require_enabled()
+    if enabled:
+        # Runs on the event loop thread, which is the one sampled
+        profiler.start(interval=interval)
+        return profiler.stats()
+    # Writes the profile; keep the file I/O off the event loop
+    return await to_thread.run_sync(profiler.stop)
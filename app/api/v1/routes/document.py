@@ -1,44 +1,146 @@
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.api.deps import get_db, get_current_user
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.deps import get_async_db, get_current_user
+from app.core.config import settings
 from app.db.models.user import User
+from app.db.session import AsyncSessionLocal
 
 from app.db.schemas.document import DocCreate
 from app.db.schemas.operation import OperationOut
-from app.db.crud.document import create_document, get_document, get_documents_operations
+from app.db.crud.document import (
+    create_document,
+    document_exists,
+    get_document,
+    get_document_content,
+    get_operations_since,
+    operation_rows_since,
+    split_operation,
+)
+from app.utils.document_state import document_states
+from app.utils.history import diff_versions, rebuild_document
+from app.utils.oplog import oplog
 
 
 router = APIRouter(prefix="/docs", tags=["documents"])
 
 
 @router.post("/")
-def create_doc(
+async def create_doc(
     doc_in: DocCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user),
 ):
-    new_doc = create_document(db, doc_in, current_user)
+    new_doc = await db.run_sync(create_document, doc_in, current_user)
     return new_doc
 
 @router.get("/{doc_id}")
-def get_doc(
+async def get_doc(
     doc_id: str,
-    db: Session = Depends(get_db),
+    version: int | None = Query(None, ge=0, description="Return the document as of this version"),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user),
 ):
-    doc = get_document(db, doc_id)
-    if not doc:
-        raise HTTPException(status_code=404, detail="Document not found")
-    return doc
+    return await _document_at(db, doc_id, version)
+
+@router.get("/{doc_id}/diff")
+async def diff_doc(
+    doc_id: str,
+    from_version: int = Query(..., alias="from", ge=0),
+    to_version: int | None = Query(None, alias="to", ge=0, description="Defaults to the current version"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Unified line diff of a document's content between two versions."""
+    old = await _document_at(db, doc_id, from_version)
+    new = await _document_at(db, doc_id, to_version)
+    diff = await run_in_threadpool(diff_versions, old.content, new.content, old.version, new.version)
+    return {
+        "document_id": doc_id,
+        "from_version": old.version,
+        "to_version": new.version,
+        "diff": diff,
+    }
+
 
 @router.get("/{doc_id}/ops", response_model=List[OperationOut])
-def get_doc_ops(
+async def get_doc_ops(
     doc_id: str,
-    db: Session = Depends(get_db),
+    since: int = Query(0, ge=0, description="Return ops with applied_version > since"),
+    limit: int | None = Query(None, ge=1, le=settings.ops_page_max),
+    stream: bool = Query(False, description="Stream every matching op as NDJSON"),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user),
 ):
-    ops = get_documents_operations(db, doc_id)
-    if not ops:
-        raise HTTPException(status_code=404, detail="No operations found for this document")
-    return ops
\ No newline at end of file
+    """
+    A page of a document's operation history, oldest first. Pass the last
+    `applied_version` received as `since` to get the next page; a page shorter
+    than `limit` is the end. With `stream=true` every op after `since` (up to
+    `limit`, if given) is sent as one JSON object per line, read through a
+    server-side cursor so memory stays flat however long the history is.
+    """
+    # Ops still queued or held in the write-behind log are not in the table yet
+    await oplog.drain()
+    if stream:
+        if not await db.run_sync(document_exists, doc_id):
+            raise HTTPException(status_code=404, detail="Document not found")
+        return StreamingResponse(
+            _stream_ops(doc_id, since, limit), media_type="application/x-ndjson"
+        )
+
+    ops = await db.run_sync(
+        get_operations_since, doc_id, since, limit or settings.ops_page_size
+    )
+    if not ops and not await db.run_sync(document_exists, doc_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+    return ops
+
+
+async def _stream_ops(doc_id: str, since: int, limit: int | None):
+    # The request's session is closed before the body is sent, so the
+    # cursor gets its own.
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(
+            operation_rows_since(doc_id, since, limit).execution_options(
+                yield_per=settings.ops_stream_chunk
+            )
+        )
+        remaining = limit
+        async for rows in result.partitions():
+            # Coalesced rows come out as one op per version
+            ops = [op for row in rows for op in split_operation(row) if op.applied_version > since]
+            if remaining is not None:
+                ops = ops[:remaining]
+                remaining -= len(ops)
+            yield "".join(OperationOut.model_validate(op).model_dump_json() + "\n" for op in ops)
+            if remaining == 0:
+                break
+
+
+async def _document_at(db: AsyncSession, doc_id: str, version: int | None):
+    """The document, with its content as of `version` (default: the latest)."""
+    doc = await db.run_sync(get_document, doc_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    db.expunge(doc)
+    # Documents being edited live in memory; the stored content may lag behind.
+    state = document_states.peek(doc_id)
+    if state is not None:
+        doc.content, doc.version = state.content, state.version
+    if version is None or version == doc.version:
+        if state is None:
+            doc.content = await db.run_sync(get_document_content, doc)
+        return doc
+    if version > doc.version:
+        raise HTTPException(status_code=404, detail="Version not found")
+    content = await db.run_sync(rebuild_document, doc_id, version)
+    if content is None:
+        # Its ops may still be queued in the write-behind log
+        await oplog.drain()
+        content = await db.run_sync(rebuild_document, doc_id, version)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Version cannot be rebuilt")
+    doc.content, doc.version = content, version
+    return doc
@@ -0,0 +1,171 @@
+from anyio import to_thread
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from app.api.deps import allow_clients
+from app.core.config import settings
+from app.core.token_cache import token_cache
+from app.db.session import async_engine, engine
+from app.utils import metrics
+from app.utils.cluster import cluster
+from app.utils.document_state import document_states
+from app.utils.history import history_cache
+from app.utils.oplog import oplog
+from app.utils.websocket import manager
+
+router = APIRouter()
+
+# Read from the owning objects at scrape time
+if settings.metrics_per_document:
+    metrics.Gauge(
+        "collab_connections",
+        "Open WebSocket connections, by document.",
+        ["document"],
+        collect=lambda: [
+            ((doc_id,), len(conns)) for doc_id, conns in manager.active_connections.items()
+        ],
+    )
+else:
+    metrics.Gauge(
+        "collab_connections",
+        "Open WebSocket connections.",
+        collect=lambda: [((), sum(len(conns) for conns in manager.active_connections.values()))],
+    )
+metrics.Gauge(
+    "collab_documents_resident",
+    "Documents held in memory: all of them, and those with connections.",
+    ["state"],
+    collect=lambda: [
+        (("resident",), (stats := document_states.stats())["resident"]),
+        (("active",), stats["active"]),
+    ],
+)
+metrics.Gauge(
+    "collab_documents_bytes",
+    "Approximate memory held by resident documents (content plus op tails).",
+    collect=lambda: [((), document_states.stats()["bytes"])],
+)
+metrics.Counter(
+    "collab_document_evictions_total",
+    "Idle documents dropped from memory.",
+    collect=lambda: [((), document_states.evictions)],
+)
+metrics.Gauge(
+    "collab_send_queue_frames",
+    "Frames waiting in connections' send queues, total and deepest single queue.",
+    ["stat"],
+    collect=lambda: [
+        (("queued",), (stats := manager.queue_stats())["queued_frames"]),
+        (("max_depth",), stats["max_queue_depth"]),
+    ],
+)
+metrics.Counter(
+    "collab_slow_consumer_events_total",
+    "Send-queue overflows and their outcomes (dropped frames, resyncs, disconnects).",
+    ["event"],
+    collect=lambda: [
+        (("overflow",), manager.overflows),
+        (("dropped_frame",), manager.dropped_frames),
+        (("resync",), manager.resyncs),
+        (("disconnect",), manager.slow_disconnects),
+    ],
+)
+
+
+def _threadpool():
+    # The limiter belongs to the running event loop, so this only works in a request
+    limiter = to_thread.current_default_thread_limiter().statistics()
+    return [
+        (("in_use",), limiter.borrowed_tokens),
+        (("limit",), limiter.total_tokens),
+        (("waiting",), limiter.tasks_waiting),
+    ]
+
+
+metrics.Gauge(
+    "collab_threadpool_threads",
+    "Worker threads used for bcrypt, diffs and sync DB calls; waiting tasks mean it is saturated.",
+    ["state"],
+    collect=_threadpool,
+)
+
+
+def _db_pools():
+    for name, pool in (("async", async_engine.pool), ("sync", engine.pool)):
+        yield (name, "checked_out"), pool.checkedout()
+        yield (name, "idle"), pool.checkedin()
+        yield (name, "overflow"), max(pool.overflow(), 0)
+
+
+metrics.Gauge(
+    "collab_db_pool_connections",
+    "Database connections by engine and state.",
+    ["engine", "state"],
+    collect=_db_pools,
+)
+metrics.Gauge(
+    "collab_oplog_pending",
+    "Op rows queued for the next group commit.",
+    collect=lambda: [((), oplog.depth)],
+)
+metrics.Gauge(
+    "collab_oplog_held",
+    "Acknowledged ops held in open coalescing runs (immediate durability), not queued yet.",
+    collect=lambda: [((), oplog.held)],
+)
+metrics.Counter(
+    "collab_oplog_ops_written_total",
+    "Ops made durable by the oplog.",
+    collect=lambda: [((), oplog.ops_written)],
+)
+metrics.Counter(
+    "collab_oplog_rows_written_total",
+    "Op rows inserted by the oplog; lower than ops when typing is coalesced.",
+    collect=lambda: [((), oplog.rows_written)],
+)
+metrics.Counter(
+    "collab_oplog_batches_written_total",
+    "Group commits made by the oplog.",
+    collect=lambda: [((), oplog.batches_written)],
+)
+metrics.Counter(
+    "collab_bus_frames_total",
+    "Frames exchanged with other nodes over the message bus, by direction.",
+    ["direction"],
+    collect=lambda: [(("published",), manager.bus.published), (("received",), manager.bus.received)],
+)
+metrics.Counter(
+    "collab_cluster_handoffs_total",
+    "Documents handed off to another node after a membership change.",
+    collect=lambda: [((), cluster.handoffs)],
+)
+metrics.Counter(
+    "collab_cluster_fenced_total",
+    "Documents discarded because another process took their lease.",
+    collect=lambda: [((), cluster.fenced)],
+)
+metrics.Counter(
+    "collab_cache_lookups_total",
+    "Document, auth token and history cache lookups, by cache and result.",
+    ["cache", "result"],
+    collect=lambda: [
+        (("document", "hit"), document_states.hits),
+        (("document", "miss"), document_states.loads),
+        (("auth", "hit"), token_cache.hits),
+        (("auth", "miss"), token_cache.misses),
+        (("history", "hit"), history_cache.hits),
+        (("history", "miss"), history_cache.misses),
+    ],
+)
+
+
+# Only for scrapers: document ids in the labels are enough to join a document
+@router.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    include_in_schema=False,
+    dependencies=[Depends(allow_clients(settings.metrics_allow))],
+)
+async def get_metrics():
+    """Prometheus scrape endpoint, for clients in `metrics_allow` only."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -2,24 +2,31 @@ import json
 from fastapi import (
     APIRouter,
     WebSocket,
-    WebSocketDisconnect,
     status,
 )
-from fastapi.concurrency import run_in_threadpool
-from sqlalchemy.orm import Session
-from app.db.crud.document import get_document
-from app.db.models.document import Document
-from app.db.models.operation import Operation
-from app.db.schemas.operation import OperationIn
-from app.db.session import SessionLocal
-from app.utils.helper import apply_operation
-from app.utils.transformation import transform_incoming_operation
-from app.utils.websocket import manager
+from app.core.config import settings
+from app.db.models.user import User
+from app.db.session import AsyncSessionLocal
+from app.utils.cluster import cluster, redirect_url
+from app.utils import metrics
+from app.utils.tracing import tracer, mark
+from app.utils.codec import CODECS, OpFrames
+from app.utils.document_state import (
+    DocumentLost,
+    DocumentMoved,
+    DocumentState,
+    StaleBaseVersion,
+    document_states,
+)
+from app.utils.websocket import Connection, manager
 
 from app.api.deps import get_user_from_token
 
 router = APIRouter()
 
+# Ways a client can ask for the initial content (`init` query parameter)
+INIT_MODES = ("full", "chunked", "compressed")
+
 
 @router.websocket("/ws/{doc_id}")
 async def websocket_endpoint(
@@ -33,176 +40,193 @@ async def websocket_endpoint(
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)  # Policy Violation
         return
 
-    # Get the database session
-    db = SessionLocal()
+    # Look the user up, releasing the DB connection before the socket goes long-lived
+    async with AsyncSessionLocal() as db:
+        user = await get_user_from_token(token, db)
+
     try:
-        user = await run_in_threadpool(get_user_from_token, token, db)
         print(user)
         if not user:
             await websocket.close(
                 code=status.WS_1008_POLICY_VIOLATION
             )  # Policy Violation
             return
-        # User is authenticated, proceed with the connection
-        print(f"User {user.id} connected to document {doc_id}")
-        await manager.connect(websocket, doc_id)
-        # Fetch the document from the database
-        doc = await run_in_threadpool(get_document, db, doc_id)
-        # Check if document exists
-        if not doc:
-            # If document does not exist, send an error message and close the connection
+        # Documents are sequenced by the node that owns them; send the client there
+        owner = cluster.owner(doc_id)
+        if owner is not None:
+            await websocket.accept()
             await websocket.send_text(
-                json.dumps({"type": "error", "message": "Document not found"})
+                json.dumps({"type": "redirect", "url": redirect_url(owner, doc_id)})
             )
             await websocket.close()
-            manager.disconnect(websocket, doc_id)
             return
+        # Wire encoding for ops: "json" (default) or the compact "binary"
+        codec = CODECS.get(websocket.query_params.get("codec", "json"))
+        if codec is None:
+            await websocket.accept()
+            await websocket.send_text(json.dumps({"type": "error", "message": "Unknown codec"}))
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        await cluster.claim(doc_id)
 
-        # Send the initial document content and version to the client
-        await websocket.send_text(
-            json.dumps({"type": "init", "content": doc.content, "version": doc.version})
-        )
+        # User is authenticated, proceed with the connection
+        print(f"User {user.id} connected to document {doc_id}")
+        connection = await manager.connect(websocket, doc_id, codec)
+        try:
+            # Fetch the document state, loading it from the database if it is not in memory
+            state = await document_states.acquire(doc_id)
+            # Check if document exists
+            if not state:
+                # If document does not exist, send an error message and close the connection
+                connection.send(json.dumps({"type": "error", "message": "Document not found"}))
+                await connection.drain()
+                return
 
-        while True:
             try:
-                # Receive the raw message from the WebSocket
-                raw = await websocket.receive_text()
-            except WebSocketDisconnect:
-                # Handle disconnection
-                manager.disconnect(websocket, doc_id)
-                break
+                # A client too far behind to keep up is sent the current content instead
+                connection.resync = lambda: sync_needed_frame(state)
+                since = websocket.query_params.get("version")
+                if since is not None and since.isdigit():
+                    # Reconnecting client: send only what it missed
+                    await send_catchup(connection, doc_id, state, int(since))
+                else:
+                    # Send the initial document content and version to the client
+                    mode = websocket.query_params.get("init", "full")
+                    send_init(connection, state, mode if mode in INIT_MODES else "full")
+                await receive_operations(connection, doc_id, user, state)
+            finally:
+                await document_states.release(state)
+        finally:
+            await manager.disconnect(connection)
+    except Exception as e:
+        try:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)  # Policy Violation
+        except RuntimeError:
+            pass  # Already closed
+        return
 
-            try:
-                data = json.loads(raw)
-                json.dumps({"type": "data", "message": data})  # Validate JSON format
-                # parse and validate the incoming message using OperationIn schema
-                op_in = OperationIn(**data)
-            except Exception as e:
-                await websocket.send_text(
-                    json.dumps(
-                        {"type": "error", "message": f"Invalid message format: {e}"}
-                    )
-                )
-                continue
-            # Simple server-authoritative check: client's base_version must match server's current version
-            if op_in.base_version != doc.version:
-                # Ask client to sync (client should request latest ops or snapshot)
-                await websocket.send_text(json.dumps({
-                "type": "sync_needed",
-                "content": doc.content,
-                "version": doc.version,
-                }))
-                continue
 
-            def persist_and_update():
-                session = SessionLocal()
-                try:
-                    doc = (
-                        session.query(Document)
-                        .filter(Document.id == doc_id)
-                        .with_for_update()
-                        .first()
-                    )
-                    if not doc:
-                        session.rollback()
-                        return None, "Document not found"
-
-                    concurrent_ops = (
-                        session.query(Operation)
-                        .filter(
-                            Operation.document_id == doc_id,
-                            Operation.applied_version > op_in.base_version,
-                        )
-                        .order_by(Operation.applied_version.asc())
-                        .all()
-                    )
-
-                    # Transform incoming op against that history
-                    transformed = transform_incoming_operation(op_in, concurrent_ops)
-                    # transformed: position, delete_len, insert_text
-
-                    # 4. Apply the transformed op to d.content
-                    if transformed.delete_len or transformed.insert_text:
-                        doc.content = apply_operation(doc.content, transformed)
-
-                    doc.version += 1  # Increment document version
-                    # Create and add the operation record
-                    session.add(doc)
-                    session.flush()
-
-                    op_record = Operation(
-                        document_id=doc.id,
-                        user_id=user.id,
-                        base_version=op_in.base_version,
-                        position=transformed.position,
-                        insert_text=transformed.insert_text,
-                        delete_len=transformed.delete_len or 0,
-                        applied_version=doc.version,
-                    )
-                    session.add(op_record)
-                    session.commit()
-                    session.refresh(op_record)
-                    return op_record, doc.version
-                except Exception as e:
-                    session.rollback()
-                    raise
-                finally:
-                    session.close()
-
-            # Run the database operation in a thread pool
-            try:
-                op_record, updated_version = await run_in_threadpool(persist_and_update)
-            except Exception as e:
-                await websocket.send_text(
-                    json.dumps(
-                        {
-                            "type": "error",
-                            "message": f"Database error: {e}",
-                        }
-                    )
-                )
+def send_init(connection: Connection, state: DocumentState, mode: str):
+    """
+    Queue the initial content in the requested `init` mode ("full", "chunked"
+    or "compressed"). The frames are encoded once per document version and
+    shared by every connection; all are queued before any later op.
+    """
+    for frame in state.init_frames(mode, connection.codec.name):
+        connection.send(frame)
+
+
+def sync_needed_frame(state: DocumentState) -> str:
+    return json.dumps({
+        "type": "sync_needed",
+        "content": state.content,
+        "version": state.version,
+    })
+
+
+async def send_catchup(connection: Connection, doc_id: str, state: DocumentState, since: int):
+    """Send the ops a client at version `since` is missing; full content only if that is not possible."""
+    ops = await document_states.ops_since(state, since)
+    if ops is None or len(ops) > settings.catchup_max_ops:
+        metrics.SYNC_NEEDED.labels("catchup").inc()
+        connection.send(sync_needed_frame(state))
+        return
+    connection.send(connection.codec.encode_catchup(doc_id, ops, since + len(ops)))
+
+
+async def receive_operations(connection: Connection, doc_id: str, user: User, state: DocumentState):
+    """Receive, sequence and fan out operations until the client disconnects."""
+    websocket, codec = connection.websocket, connection.codec
+    while True:
+        try:
+            # Receive the raw message (text or binary frame) from the WebSocket
+            message = await websocket.receive()
+        except RuntimeError:
+            if connection.closed:
+                # We closed it: the client could not keep up
+                break
+            raise
+        if message["type"] == "websocket.disconnect":
+            # Handle disconnection
+            break
+
+        frame = message.get("text") or message.get("bytes") or ""
+        trace = tracer.start(doc_id, user.id, codec.name, len(frame))
+        try:
+            # parse and validate the incoming message in the connection's encoding
+            kind, payload = codec.decode(message.get("text"), message.get("bytes"))
+            mark("parse")
+            if trace is not None:
+                trace.kind = kind
+            if kind == "sync":
+                # Client asks for the ops it is missing since its version
+                await send_catchup(connection, doc_id, state, payload)
+                mark("catchup")
+                tracer.finish(trace, "sync")
                 continue
-            if not op_record:
-                await websocket.send_text(
-                    json.dumps(
-                        {
-                            "type": "sync_needed",
-                            "content": doc.content,
-                            "version": updated_version,
-                        }
-                    )
+            if kind == "batch" and not 0 < len(payload) <= settings.batch_max_ops:
+                raise ValueError(f"A batch carries 1 to {settings.batch_max_ops} ops")
+        except Exception as e:
+            metrics.OPS_REJECTED.labels("invalid").inc()
+            tracer.finish(trace, "invalid")
+            connection.send(
+                json.dumps(
+                    {"type": "error", "message": f"Invalid message format: {e}"}
                 )
-                continue
-            message = {
-                "type": "op",
-                "op": {
-                    "id": op_record.id,
-                    "doc_id": op_record.document_id,
-                    "user_id": op_record.user_id,
-                    "base_version": op_record.base_version,
-                    "position": op_record.position,
-                    "insert_text": op_record.insert_text,
-                    "delete_len": op_record.delete_len,
-                    "created_at": op_record.created_at.isoformat(),
-                },
-                "updated_version": updated_version,
-            }
-
-            try:
-                # Send ack to the sender with updated version
-                await websocket.send_text(
-                    json.dumps(
-                        {
-                            "type": "ack",
-                            "op": message["op"],
-                            "updated_version": updated_version,
-                        }
-                    )
+            )
+            continue
+
+        # Sequence the op(s) in memory, transforming them if based on an older version
+        try:
+            if kind == "batch":
+                op_records = await document_states.submit_batch(state, payload, user.id)
+            else:
+                op_records = [await document_states.submit(state, payload, user.id)]
+        except StaleBaseVersion:
+            # The gap cannot be bridged; the client has to start over from the full content
+            metrics.OPS_REJECTED.labels("stale").inc()
+            metrics.SYNC_NEEDED.labels("stale").inc()
+            connection.send(sync_needed_frame(state))
+            tracer.finish(trace, "stale")
+            continue
+        except DocumentMoved:
+            # Handed off to another node; the client is being redirected there
+            metrics.OPS_REJECTED.labels("moved").inc()
+            tracer.finish(trace, "moved")
+            continue
+        except DocumentLost:
+            # Its state was discarded; the client is being told to reload
+            metrics.OPS_REJECTED.labels("lost").inc()
+            tracer.finish(trace, "lost")
+            continue
+        except Exception as e:
+            metrics.OPS_REJECTED.labels("error").inc()
+            tracer.finish(trace, "error")
+            connection.send(
+                json.dumps(
+                    {
+                        "type": "error",
+                        "message": f"Database error: {e}",
+                    }
                 )
-                await manager.broadcast(doc_id, message, exclude=websocket)
-            except Exception as e:
-                print(f"Broadcast error: {e}")
-                pass
-    except Exception as e:
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)  # Policy Violation
-        return
+            )
+            continue
+        metrics.OPS_ACCEPTED.inc(len(op_records))
+        updated_version = op_records[-1].applied_version
+
+        try:
+            # Send ack to the sender with updated version; a batch is acked in one frame
+            if kind == "batch":
+                ack = codec.encode_batch("batch_ack", doc_id, op_records, updated_version)
+            else:
+                ack = codec.encode_op("ack", doc_id, op_records[0], updated_version)
+            connection.send(ack)
+            mark("ack")
+            await manager.broadcast(
+                doc_id, OpFrames(doc_id, op_records, updated_version), exclude=connection
+            )
+            mark("broadcast")
+        except Exception as e:
+            print(f"Broadcast error: {e}")
+            pass
+        tracer.finish(trace, "applied", updated_version, len(op_records))
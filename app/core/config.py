@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings
 
 
@@ -10,6 +12,82 @@ class Settings(BaseSettings):
     secret_key: str
     algorithm: str
     access_token_expire_minutes: str
+
+    # Connection pools (see app/db/session.py)
+    db_pool_size: int = 20  # async engine: realtime and document routes
+    db_max_overflow: int = 20
+    db_sync_pool_size: int = 5  # sync engine: user/auth routes
+    db_sync_max_overflow: int = 5
+    db_pool_timeout: float = 30.0  # seconds to wait for a free connection
+    db_pool_recycle: int = 1800  # seconds before a connection is replaced
+
+    # Verified token -> user cache (see app/core/token_cache.py); 0 disables
+    auth_cache_size: int = 10000
+    auth_cache_ttl: float = 60.0  # seconds; never past the token's own expiry
+
+    # In-memory document state (realtime editing)
+    document_tail_size: int = 1000  # recent ops kept per document for transforms
+    document_flush_interval: float = 2.0  # seconds between content flushes to Postgres
+    catchup_max_ops: int = 5000  # beyond this, a lagging client gets the full content instead
+    batch_max_ops: int = 1000  # most ops accepted in one `batch` message
+    # Documents stay resident after their last connection; idle ones are evicted LRU
+    document_cache_max_docs: int = 1000
+    document_cache_max_bytes: int = 256 * 1024 * 1024  # approximate, content plus op tails
+    document_cache_idle_seconds: float = 600.0  # evict after this long unused; 0 = never
+
+    # GET /docs/{id}/ops history paging and NDJSON streaming
+    ops_page_size: int = 1000  # default `limit`
+    ops_page_max: int = 10000  # largest `limit` accepted
+    ops_stream_chunk: int = 1000  # rows fetched from the cursor per chunk
+
+    # Past versions rebuilt for GET /docs/{id}?version= and /diff (see app/utils/history.py)
+    history_cache_chars: int = 50_000_000  # total characters of cached versions
+
+    # Write-behind operation log (see app/utils/oplog.py)
+    oplog_durability: Literal["commit", "group", "immediate"] = "group"
+    oplog_flush_interval: float = 0.005  # seconds to gather ops into one commit
+    oplog_max_batch: int = 500  # max rows per multi-row insert
+    oplog_coalesce_window: float = 1.0  # seconds between typed characters merged into one row; 0 = off
+    oplog_coalesce_max: int = 256  # max versions per coalesced row
+
+    # Stored content is split into chunks of about this many characters (see app/utils/chunks.py)
+    content_chunk_size: int = 16384
+    init_chunk_chars: int = 65536  # characters per init_chunk frame for `init=chunked` clients
+    init_compress_level: int = 1  # zlib level for `init=compressed`; encoded once per version
+
+    # Document snapshots: taken after this many ops, or this long after an edit
+    snapshot_every_ops: int = 1000
+    snapshot_every_seconds: float = 300.0
+
+    # Outbound WebSocket frames (see app/utils/websocket.py)
+    send_queue_size: int = 1000  # frames queued per connection before it counts as slow
+    slow_consumer_policy: Literal["resync", "disconnect"] = "resync"
+
+    # Fan-out between workers/hosts (see app/utils/pubsub.py)
+    pubsub_backend: Literal["local", "redis"] = "local"
+    redis_url: str = "redis://localhost:6379/0"
+
+    # Document ownership across nodes (see app/utils/cluster.py)
+    node_url: str = ""  # how clients reach this node, e.g. ws://10.0.0.5:8000; empty = single node (one process)
+    cluster_nodes: str = ""  # comma-separated node URLs when membership is static
+    cluster_heartbeat_interval: float = 1.0
+    cluster_node_ttl: float = 5.0  # nodes silent this long leave the ring
+    cluster_handoff_grace: float = 3.0  # without Redis: wait before loading a document another node just owned
+
+    # Per-op traces and the sampling profiler (see app/utils/tracing.py, profiler.py);
+    # both can be changed at runtime through /debug when debug_endpoints is on
+    trace_sample_rate: float = 0.0  # fraction of messages traced; 0 = none
+    trace_slow_ms: float = 0.0  # always trace messages taking this long; 0 = off
+    trace_file: str = "op_traces.jsonl"
+    profiler_file: str = "profile.folded"
+    profiler_interval: float = 0.005  # seconds between stack samples
+    debug_endpoints: bool = False
+    debug_allow: str = "127.0.0.1,::1"  # clients allowed to use /debug, as metrics_allow
+
+    # Prometheus scrapes (see app/api/v1/routes/metrics.py)
+    metrics_allow: str = "127.0.0.1,::1"  # comma-separated client addresses/networks; empty = anyone
+    metrics_per_document: bool = False  # label connection counts with document ids
+
     class Config:
         env_file=".env"
     
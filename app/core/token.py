@@ -29,7 +29,7 @@ def verify_access_token(token: str, credentials_exception):
         id: str = payload.get("user_id")
         if id is None:
             raise credentials_exception
-        token_data = TokenData(id=id)
+        token_data = TokenData(id=id, exp=payload.get("exp"))
     except JWTError:
         raise credentials_exception
 
@@ -0,0 +1,107 @@
+"""
+Cache of verified access tokens to the user they belong to.
+
+Every REST request and WebSocket connect used to decode its JWT and load the
+user row. A hit here skips both. Entries live for `auth_cache_ttl` seconds
+but never past the token's own `exp`, the cache holds at most
+`auth_cache_size` tokens (least recently used go first), and any update or
+delete of a user through the ORM drops that user's tokens. Only valid tokens
+for existing users are cached, so junk tokens cannot fill it.
+
+Invalidation is per process: on other workers a changed user is seen at most
+`auth_cache_ttl` seconds later. Bulk `query(User).update()` bypasses the ORM
+events; call `token_cache.invalidate_user` after one.
+"""
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+from app.core.config import settings
+from app.db.models.user import User
+
+
+class TokenCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        # token -> (expires_at, user), oldest use first
+        self._entries: OrderedDict[str, tuple[float, User]] = OrderedDict()
+        self._tokens_by_user: dict[str, set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, token: str) -> User | None:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, user = entry
+        if expires_at <= time.time():
+            self._drop(token)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return user
+
+    def put(self, token: str, user: User, exp: float | None) -> None:
+        """Cache `user` for `token` until the TTL or the token's `exp`, whichever is first."""
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        if expires_at <= time.time():
+            return
+        if token in self._entries:
+            self._drop(token)
+        self._entries[token] = (expires_at, user)
+        self._tokens_by_user.setdefault(user.id, set()).add(token)
+        while len(self._entries) > self.max_size:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate_user(self, user_id: str) -> None:
+        """Forget every cached token of a user whose record changed."""
+        for token in self._tokens_by_user.pop(user_id, ()):
+            self._entries.pop(token, None)
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._tokens_by_user.clear()
+
+    def _drop(self, token: str) -> None:
+        _, user = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(user.id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user.id]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+token_cache = TokenCache(settings.auth_cache_size, settings.auth_cache_ttl)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target: User) -> None:
+    token_cache.invalidate_user(target.id)
@@ -1,5 +1,8 @@
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.sql import Select
 from sqlalchemy.orm import Session
-from app.db.models import Document, User, Operation
+from app.db.models import Document, DocumentChunk, DocumentSnapshot, User, Operation
 from app.db.schemas.document import DocCreate
 
 
@@ -9,6 +12,9 @@ def create_document(db: Session, doc: DocCreate, owner: User) -> Document:
         title=doc.title, content=doc.content, version=0, owner_id=owner.id
     )
     db.add(db_doc)
+    db.flush()
+    # Version 0 is the root every reconstruction replays from
+    create_snapshot(db, db_doc.id, 0, db_doc.content or "")
     db.commit()
     db.refresh(db_doc)
     return db_doc
@@ -19,12 +25,206 @@ def get_document(db: Session, doc_id: str) -> Document | None:
     return db.query(Document).filter(Document.id == doc_id).first()
 
 
-def get_documents_operations(db: Session, doc_id: str):
-    """Retrieve operations associated with a document."""
-    ops = (
+def document_exists(db: Session, doc_id: str) -> bool:
+    """Whether a document exists, without loading its content."""
+    return db.query(Document.id).filter(Document.id == doc_id).first() is not None
+
+
+def split_operation(op) -> list:
+    """
+    The one-version ops a coalesced row stands for: a run of one-character
+    inserts typed left to right, or of one-character backspaces. Works on ORM
+    objects and Core rows alike; a row covering one version comes back as is.
+    The parts are transient `Operation`s sharing the row's id.
+    """
+    count = op.version_count or 1
+    if count == 1:
+        return [op]
+    first = op.applied_version - count + 1
+    parts = []
+    for k in range(count):
+        if op.insert_text:
+            position, insert_text, delete_len = op.position + k, op.insert_text[k], 0
+        else:
+            position, insert_text, delete_len = op.position + count - 1 - k, None, 1
+        parts.append(
+            Operation(
+                id=op.id,
+                document_id=op.document_id,
+                user_id=op.user_id,
+                # Every op after the first was applied on top of the one before it
+                base_version=op.base_version if k == 0 else first + k - 1,
+                position=position,
+                insert_text=insert_text,
+                delete_len=delete_len,
+                applied_version=first + k,
+                version_count=1,
+                created_at=op.created_at,
+            )
+        )
+    return parts
+
+
+def get_operations_since(
+    db: Session, doc_id: str, version: int, limit: int | None = None
+) -> list[Operation]:
+    """
+    Retrieve operations applied after `version`, one per version, oldest
+    first, at most `limit` of them. Paging by the last `applied_version` seen
+    is a keyset seek on (document_id, applied_version), so every page costs
+    the same.
+    """
+    query = (
         db.query(Operation)
-        .filter(Operation.document_id == doc_id)
-        .order_by(Operation.id.asc())
-        .all()
+        .filter(
+            Operation.document_id == doc_id,
+            Operation.applied_version > version,
+        )
+        .order_by(Operation.applied_version.asc())
+    )
+    if limit is not None:
+        # Each row covers at least one version
+        query = query.limit(limit)
+    ops = [part for op in query for part in split_operation(op) if part.applied_version > version]
+    return ops if limit is None else ops[:limit]
+
+
+def operation_rows_since(doc_id: str, version: int, limit: int | None = None) -> Select:
+    """
+    Core SELECT of the operation rows `get_operations_since` reads, for
+    streaming with `AsyncSession.stream` (a server-side cursor) without
+    building ORM objects. Coalesced rows still need `split_operation`.
+    """
+    stmt = (
+        select(Operation.__table__)
+        .where(
+            Operation.document_id == doc_id,
+            Operation.applied_version > version,
+        )
+        .order_by(Operation.applied_version.asc())
     )
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+def get_operations_between(
+    db: Session, doc_id: str, after_version: int, upto_version: int
+) -> list[Operation]:
+    """
+    Retrieve the operations taking a document from `after_version` to
+    `upto_version`, oldest first. Coalesced rows wholly inside the range are
+    returned as they are (applying one has the effect of the whole run);
+    those crossing either end are split and trimmed to it.
+    """
+    rows = (
+        db.query(Operation)
+        .filter(
+            Operation.document_id == doc_id,
+            Operation.applied_version > after_version,
+            Operation.applied_version - Operation.version_count < upto_version,
+        )
+        .order_by(Operation.applied_version.asc())
+    )
+    ops = []
+    for op in rows:
+        if op.applied_version - op.version_count >= after_version and op.applied_version <= upto_version:
+            ops.append(op)
+        else:
+            ops.extend(
+                part
+                for part in split_operation(op)
+                if after_version < part.applied_version <= upto_version
+            )
     return ops
+
+
+def create_operations(db: Session, rows: list[dict]) -> list[int]:
+    """
+    Insert many operation rows with one multi-row INSERT, without committing.
+    Returns the new ids in the same order as `rows`.
+    """
+    if not rows:
+        return []
+    result = db.execute(
+        insert(Operation)
+        .values(rows)
+        .returning(Operation.id, Operation.document_id, Operation.applied_version)
+    )
+    ids = {(r.document_id, r.applied_version): r.id for r in result}
+    return [ids[(row["document_id"], row["applied_version"])] for row in rows]
+
+
+def get_document_chunks(db: Session, doc_id: str) -> list[tuple[int, str]]:
+    """A document's stored content chunks as `(chunk_index, content)`, in order."""
+    return [
+        (row.chunk_index, row.content)
+        for row in db.query(DocumentChunk.chunk_index, DocumentChunk.content)
+        .filter(DocumentChunk.document_id == doc_id)
+        .order_by(DocumentChunk.chunk_index)
+    ]
+
+
+def get_document_content(db: Session, doc: Document) -> str:
+    """
+    A document's stored content: its chunks once it has been edited, otherwise
+    the `content` it was created with.
+    """
+    chunks = get_document_chunks(db, doc.id)
+    if chunks:
+        return "".join(content for _, content in chunks)
+    return doc.content or ""
+
+
+def save_document_chunks(
+    db: Session,
+    doc_id: str,
+    version: int,
+    upserts: dict[int, str],
+    deletes: set[int],
+    replace_all: bool = False,
+) -> None:
+    """
+    Write the content chunks that changed and record the version they bring the
+    document to (never moving it to an older one). With `replace_all`, every
+    other stored chunk is removed. Does not commit, so it can share a
+    transaction with the ops it covers.
+    """
+    stale = db.query(DocumentChunk).filter(DocumentChunk.document_id == doc_id)
+    if not replace_all:
+        stale = stale.filter(DocumentChunk.chunk_index.in_(deletes)) if deletes else None
+    if stale is not None:
+        stale.delete(synchronize_session=False)
+    if upserts:
+        statement = pg_insert(DocumentChunk).values(
+            [
+                {"document_id": doc_id, "chunk_index": index, "content": content}
+                for index, content in upserts.items()
+            ]
+        )
+        db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[DocumentChunk.document_id, DocumentChunk.chunk_index],
+                set_={"content": statement.excluded.content},
+            )
+        )
+    # The inline column is only read for documents without chunks
+    db.query(Document).filter(Document.id == doc_id).update(
+        {"content": None, "version": func.greatest(Document.version, version)},
+        synchronize_session=False,
+    )
+
+
+def create_snapshot(db: Session, doc_id: str, version: int, content: str) -> None:
+    """Record a document's content at `version`, without committing."""
+    db.add(DocumentSnapshot(document_id=doc_id, version=version, content=content))
+
+
+def get_latest_snapshot(
+    db: Session, doc_id: str, max_version: int | None = None
+) -> DocumentSnapshot | None:
+    """The newest snapshot of a document, optionally no newer than `max_version`."""
+    query = db.query(DocumentSnapshot).filter(DocumentSnapshot.document_id == doc_id)
+    if max_version is not None:
+        query = query.filter(DocumentSnapshot.version <= max_version)
+    return query.order_by(DocumentSnapshot.version.desc()).first()
@@ -1,5 +1,7 @@
 from .user import User
 from .document import Document
 from .operation import Operation
+from .snapshot import DocumentSnapshot
+from .chunk import DocumentChunk
 
 from .base import Base 
\ No newline at end of file
@@ -0,0 +1,14 @@
+from sqlalchemy import Column, ForeignKey, Integer, String, Text
+from sqlalchemy.orm import relationship
+from app.db.models.base import Base
+
+
+class DocumentChunk(Base):
+    __tablename__ = "document_chunks"
+
+    # Ordering key of the chunk within its document; indices are spaced apart (see app/utils/chunks.py)
+    document_id = Column(String, ForeignKey("documents.id"), primary_key=True)
+    chunk_index = Column(Integer, primary_key=True)
+    content = Column(Text, nullable=False)
+
+    document = relationship("Document")
@@ -1,10 +1,20 @@
-from sqlalchemy import String, Column, Integer, ForeignKey, Text, TIMESTAMP, text
+from sqlalchemy import String, Column, Index, Integer, ForeignKey, Text, TIMESTAMP, text
 from sqlalchemy.orm import relationship
 from app.db.models.base import Base
 
 
 class Operation(Base):
     __tablename__ = "operations"
+    # Replay, catch-up and history paging all seek by (document, version); unique,
+    # so a version sequenced twice (two processes owning a document) fails to write
+    __table_args__ = (
+        Index(
+            "ix_operations_document_id_applied_version",
+            "document_id",
+            "applied_version",
+            unique=True,
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     document_id = Column(String, ForeignKey("documents.id"), nullable=False, index=True)
@@ -14,6 +24,8 @@ class Operation(Base):
     insert_text = Column(Text, nullable=True)  # Text to insert
     delete_len = Column(Integer, nullable=True)  # Length of text to delete
     applied_version = Column(Integer, nullable=False)  # Document version after this operation
+    # Versions this row covers: more than 1 for a coalesced run of typing (see app/utils/oplog.py)
+    version_count = Column(Integer, nullable=False, default=1, server_default=text("1"))
     created_at = Column(
         TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False
     )
@@ -0,0 +1,18 @@
+from sqlalchemy import TIMESTAMP, Column, ForeignKey, Integer, String, Text, UniqueConstraint, text
+from sqlalchemy.orm import relationship
+from app.db.models.base import Base
+
+
+class DocumentSnapshot(Base):
+    __tablename__ = "document_snapshots"
+    __table_args__ = (UniqueConstraint("document_id", "version"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(String, ForeignKey("documents.id"), nullable=False, index=True)
+    version = Column(Integer, nullable=False)  # Document version this content corresponds to
+    content = Column(Text, nullable=False)
+    created_at = Column(
+        TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False
+    )
+
+    document = relationship("Document")
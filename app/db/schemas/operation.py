@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from pydantic import BaseModel
 
 class OperationIn(BaseModel):
@@ -24,17 +26,19 @@ class OperationOut(BaseModel):
     - insert_text: text to insert
     - delete_len: length of text to delete
     - base_version: document version before this operation
+    - applied_version: document version after this operation
     - created_at: timestamp when operation was created
     """
     id: int
     document_id: str
-    user_id: int
+    user_id: str
     position: int
     insert_text: str | None = None
     delete_len: int | None = None
     base_version: int
-    created_at: str  # ISO formatted datetime string
+    applied_version: int
+    created_at: datetime
     
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        from_attributes = True
\ No newline at end of file
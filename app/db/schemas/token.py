@@ -6,4 +6,5 @@ class Token(BaseModel):
     
 class TokenData(BaseModel):
     id: str | None = None
+    exp: float | None = None  # expiry, seconds since the epoch
     
\ No newline at end of file
@@ -1,5 +1,6 @@
 from sqlalchemy import create_engine
 from sqlalchemy.engine.url import URL
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
 
@@ -12,5 +13,30 @@ DATABASE_URL = URL.create(
     database=settings.database_name
 )
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
\ No newline at end of file
+# Sync engine: schema creation, user registration/login (bcrypt-bound, run in
+# the thread pool) and scripts.
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=settings.db_sync_pool_size,
+    max_overflow=settings.db_sync_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
+    pool_pre_ping=True,
+)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine (asyncpg) for the realtime and document hot paths. The crud
+# helpers are plain functions of a Session; run them with
+# `await db.run_sync(fn, *args)`, which executes on the event loop without
+# a thread.
+async_engine = create_async_engine(
+    DATABASE_URL.set(drivername="postgresql+asyncpg"),
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
+    pool_pre_ping=True,
+)
+AsyncSessionLocal = sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
@@ -1,9 +1,15 @@
 from fastapi import FastAPI, HTTPException
 from app.api.v1.routes import user
 from app.db import models
-from app.db.session import engine
+from app.db.session import async_engine, engine
 from app.db.session import SessionLocal
-from app.api.v1.routes import auth, websocket, document
+from app.api.v1.routes import auth, websocket, document, metrics, debug
+from app.utils.cluster import cluster
+from app.utils.document_state import document_states
+from app.utils.oplog import oplog
+from app.utils.profiler import profiler
+from app.utils.tracing import tracer
+from app.utils.websocket import manager
 
 app = FastAPI()
 
@@ -21,8 +27,27 @@ async def read_root():
     return {"message": "Hello, World!"}
 
 
+@app.on_event("startup")
+async def join_cluster():
+    await cluster.start()
+
+
+@app.on_event("shutdown")
+async def flush_documents():
+    """Persist queued ops and in-memory document content before the process exits."""
+    await document_states.flush_all()
+    await oplog.close()
+    await async_engine.dispose()
+    await cluster.stop()
+    await manager.close()
+    profiler.stop()
+    tracer.close()
+
+
 models.Base.metadata.create_all(bind=engine)
 app.include_router(user.router, prefix="/api/v1", tags=["users"])
 app.include_router(auth.router, prefix="/api/v1", tags=["auth"]) 
 app.include_router(websocket.router, tags=["websocket"])
-app.include_router(document.router, prefix="/api/v1", tags=["documents"])
\ No newline at end of file
+app.include_router(document.router, prefix="/api/v1", tags=["documents"])
+app.include_router(metrics.router, tags=["metrics"])
+app.include_router(debug.router, tags=["debug"])
\ No newline at end of file
@@ -0,0 +1,146 @@
+"""
+Per-op wire cost of the WebSocket codecs: decoding a client's op, then
+encoding its ack and the `op` frame broadcast to everyone else.
+
+"json (before)" is the original path, which re-serialized every incoming
+message to validate it and built the ack and broadcast separately. The
+"batch" rows send the same ops as `batch` messages of BATCH_SIZE ops, with
+one ack and one broadcast frame per batch. Round trips through each codec
+are checked before timing.
+
+    python -m app.scripts.bench_codec
+"""
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+
+from app.db.schemas.operation import OperationIn
+from app.utils.codec import OpFrames, binary_codec, json_codec, serialize_op
+from app.utils.simpleop import AppliedOp
+
+COUNT = 20_000
+BATCH_SIZE = 20
+DOC_ID = str(uuid.uuid4())
+
+
+def make_ops(count: int, seed: int = 0) -> list[tuple[OperationIn, AppliedOp]]:
+    rng = random.Random(seed)
+    users = [str(uuid.uuid4()) for _ in range(8)]
+    pairs = []
+    for version in range(1, count + 1):
+        inserting = rng.random() < 0.7
+        op_in = OperationIn(
+            position=rng.randrange(50_000),
+            insert_text=rng.choice("abcdefgh ") * rng.randint(1, 3) if inserting else None,
+            delete_len=0 if inserting else rng.randint(1, 5),
+            base_version=version - 1,
+        )
+        applied = AppliedOp(
+            position=op_in.position,
+            insert_text=op_in.insert_text,
+            delete_len=op_in.delete_len,
+            user_id=rng.choice(users),
+            base_version=op_in.base_version,
+            applied_version=version,
+            created_at=datetime.now(timezone.utc),
+            id=version,
+        )
+        pairs.append((op_in, applied))
+    return pairs
+
+
+def json_before(raw: str, applied: AppliedOp) -> tuple:
+    data = json.loads(raw)
+    json.dumps({"type": "data", "message": data})
+    OperationIn(**data)
+    message = {"type": "op", "op": serialize_op(DOC_ID, applied), "updated_version": applied.applied_version}
+    ack = json.dumps({"type": "ack", "op": message["op"], "updated_version": applied.applied_version})
+    return ack, json.dumps(message)
+
+
+def through(codec):
+    def run(raw, applied: AppliedOp) -> tuple:
+        text, data = (raw, None) if isinstance(raw, str) else (None, raw)
+        codec.decode(text, data)
+        ack = codec.encode_op("ack", DOC_ID, applied, applied.applied_version)
+        frames = OpFrames(DOC_ID, [applied], applied.applied_version)
+        return ack, frames.frame(codec)
+
+    return run
+
+
+def through_batches(codec):
+    def run(raw, applied_ops: list[AppliedOp]) -> tuple:
+        text, data = (raw, None) if isinstance(raw, str) else (None, raw)
+        codec.decode(text, data)
+        version = applied_ops[-1].applied_version
+        ack = codec.encode_batch("batch_ack", DOC_ID, applied_ops, version)
+        return ack, OpFrames(DOC_ID, applied_ops, version).frame(codec)
+
+    return run
+
+
+def json_batch(ops: list[OperationIn]) -> str:
+    return json.dumps({
+        "type": "batch",
+        "base_version": ops[0].base_version,
+        "ops": [op.model_dump(exclude={"base_version"}) for op in ops],
+    })
+
+
+def main():
+    pairs = make_ops(COUNT)
+    json_in = [op_in.model_dump_json() for op_in, _ in pairs]
+    binary_in = [binary_codec.encode_client_op(op_in) for op_in, _ in pairs]
+
+    for (op_in, applied), raw in zip(pairs, binary_in):
+        assert binary_codec.decode(None, raw)[1].model_dump() == op_in.model_dump()
+        frame = binary_codec.encode_op("op", DOC_ID, applied, applied.applied_version)
+        assert binary_codec.decode_op(frame) == (applied.applied_version, applied)
+    chunks = [pairs[i : i + BATCH_SIZE] for i in range(0, COUNT, BATCH_SIZE)]
+    batches = [[applied for _, applied in chunk] for chunk in chunks]
+    json_batches = [json_batch([op_in for op_in, _ in chunk]) for chunk in chunks]
+    binary_batches = [binary_codec.encode_client_batch([op_in for op_in, _ in chunk]) for chunk in chunks]
+    for chunk, text, data in zip(chunks, json_batches, binary_batches):
+        base = chunk[0][0].base_version
+        expected = [op_in.model_copy(update={"base_version": base}).model_dump() for op_in, _ in chunk]
+        assert [op.model_dump() for op in json_codec.decode(text, None)[1]] == expected
+        assert [op.model_dump() for op in binary_codec.decode(None, data)[1]] == expected
+    frame = binary_codec.encode_batch("batch", DOC_ID, batches[0], BATCH_SIZE)
+    assert OpFrames.from_binary(DOC_ID, frame).frame(json_codec) == json_codec.encode_batch(
+        "batch", DOC_ID, batches[0], BATCH_SIZE
+    )
+
+    applied_ops = [applied for _, applied in pairs[:100]]
+    catchup = binary_codec.encode_catchup(DOC_ID, applied_ops, 100)
+    assert binary_codec.decode_ops(catchup) == (100, applied_ops)
+    # A JSON client on another node sees the same frame as one on this node
+    remote = OpFrames.from_binary(DOC_ID, binary_codec.encode_op("op", DOC_ID, pairs[0][1], 1))
+    assert remote.frame(json_codec) == json_codec.encode_op("op", DOC_ID, pairs[0][1], 1)
+
+    applied = [applied for _, applied in pairs]
+    cases = [
+        ("json (before)", json_before, json_in, applied),
+        ("json", through(json_codec), json_in, applied),
+        ("binary", through(binary_codec), binary_in, applied),
+        ("json batch", through_batches(json_codec), json_batches, batches),
+        ("binary batch", through_batches(binary_codec), binary_batches, batches),
+    ]
+    print(f"{'codec':>14} {'us/op':>7} {'in bytes/op':>12} {'out bytes/op':>13}")
+    for name, run, incoming, outgoing in cases:
+        start = time.perf_counter()
+        for raw, ops in zip(incoming, outgoing):
+            ack, frame = run(raw, ops)
+        per_op = (time.perf_counter() - start) / COUNT * 1e6
+        in_bytes = sum(len(raw) for raw in incoming) / COUNT
+        out_bytes = sum(
+            len(frame.encode() if isinstance(frame, str) else frame)
+            for frame in (run(raw, ops)[1] for raw, ops in zip(incoming, outgoing))
+        ) / COUNT
+        print(f"{name:>14} {per_op:>7.1f} {in_bytes:>12.1f} {out_bytes:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Per-op cost of editing a document held as a Rope versus a plain str.
+
+Simulates typing: mostly single-char inserts with some backspaces, at a cursor
+that occasionally jumps to a random position. The str column should grow with
+document size while the rope column stays flat.
+
+    python -m app.scripts.bench_rope
+"""
+import random
+import time
+
+from app.utils.rope import Rope
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+OPS = 5_000
+# Copying a multi-megabyte string per op is slow; sample fewer ops there.
+STR_OPS_BUDGET = 2_000_000_000
+
+
+def make_ops(size: int, count: int, seed: int = 0):
+    rng = random.Random(seed)
+    ops = []
+    cursor = rng.randrange(size)
+    length = size
+    for _ in range(count):
+        if rng.random() < 0.02:
+            cursor = rng.randrange(length)
+        if rng.random() < 0.8 or cursor == 0:
+            ops.append((cursor, "x", 0))
+            cursor += 1
+            length += 1
+        else:
+            cursor -= 1
+            ops.append((cursor, None, 1))
+            length -= 1
+    return ops
+
+
+def bench_str(text: str, ops) -> float:
+    start = time.perf_counter()
+    for position, insert_text, delete_len in ops:
+        if insert_text:
+            text = text[:position] + insert_text + text[position:]
+        else:
+            text = text[:position] + text[position + delete_len :]
+    return (time.perf_counter() - start) / len(ops)
+
+
+def bench_rope(text: str, ops) -> float:
+    buffer = Rope(text)
+    start = time.perf_counter()
+    for position, insert_text, delete_len in ops:
+        if insert_text:
+            buffer.insert(position, insert_text)
+        else:
+            buffer.delete(position, delete_len)
+    return (time.perf_counter() - start) / len(ops)
+
+
+def bench_materialize(text: str, ops) -> float:
+    buffer = Rope(text)
+    for position, insert_text, delete_len in ops:
+        if insert_text:
+            buffer.insert(position, insert_text)
+        else:
+            buffer.delete(position, delete_len)
+    start = time.perf_counter()
+    str(buffer)
+    return time.perf_counter() - start
+
+
+def main():
+    print(f"{'doc size':>12} {'str us/op':>12} {'rope us/op':>12} {'rope str() ms':>14}")
+    for size in SIZES:
+        text = "".join(random.choice("abcdefgh ") for _ in range(size))
+        ops = make_ops(size, OPS)
+        str_ops = ops[: max(50, min(len(ops), STR_OPS_BUDGET // size // 1000))]
+        print(
+            f"{size:>12,} {bench_str(text, str_ops) * 1e6:>12.2f} "
+            f"{bench_rope(text, ops) * 1e6:>12.2f} "
+            f"{bench_materialize(text, ops) * 1e3:>14.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Transforming one incoming op against N concurrent ops: the SimpleOp-based
+`transform_incoming_operation` versus the packed-tuple `transform_packed`.
+Both are run on the same random histories and their results compared.
+
+The second table transforms a queue of ops from different clients, waiting
+on a busy document, against a long history, one op at a time versus
+`transform_packed_batch`.
+The third transforms single stale ops through `ComposedHistory` blocks
+(built on first use, then shared) versus stepping through every op.
+
+    python -m app.scripts.bench_transform
+"""
+import random
+import time
+from datetime import datetime, timezone
+
+from app.db.schemas.operation import OperationIn
+from app.utils.compose import BLOCK_SIZES, MAX_BLOCKS, ComposedHistory
+from app.utils.simpleop import AppliedOp
+from app.utils.transformation import (
+    pack_op,
+    transform_incoming_operation,
+    transform_packed,
+    transform_packed_batch,
+)
+
+HISTORY_SIZES = [10, 100, 1_000]
+STALE_HISTORIES = [1_000, 5_000]
+BACKLOGS = [(100, 1_000), (1_000, 1_000), (1_000, 10_000)]  # (pending, history)
+TARGET_SECONDS = 0.5
+
+
+def make_history(count: int, seed: int = 0) -> list[AppliedOp]:
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    ops = []
+    for version in range(1, count + 1):
+        inserting = rng.random() < 0.7
+        ops.append(
+            AppliedOp(
+                position=rng.randrange(5_000),
+                insert_text="x" * rng.randint(1, 5) if inserting else None,
+                delete_len=0 if inserting else rng.randint(1, 5),
+                user_id=f"user-{rng.randrange(8)}",
+                base_version=version - 1,
+                applied_version=version,
+                created_at=now,
+            )
+        )
+    return ops
+
+
+def make_incoming(count: int, seed: int = 1) -> list[OperationIn]:
+    rng = random.Random(seed)
+    return [
+        OperationIn(
+            position=rng.randrange(5_000),
+            insert_text="y" if rng.random() < 0.7 else None,
+            delete_len=rng.choice([0, 0, 1, 3]),
+            base_version=0,
+        )
+        for _ in range(count)
+    ]
+
+
+def timed(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    print(f"{'history':>8} {'SimpleOp us':>12} {'packed us':>10} {'speedup':>8}")
+    for size in HISTORY_SIZES:
+        history = make_history(size)
+        packed = [pack_op(op) for op in history]
+        incoming = make_incoming(50)
+
+        for op_in in incoming:
+            expected = transform_incoming_operation(op_in, history)
+            got = transform_packed(
+                op_in.position, op_in.delete_len, bool(op_in.insert_text), None, packed
+            )
+            assert (expected.position, expected.delete_len) == got, (op_in, expected, got)
+
+        def slow():
+            for op_in in incoming:
+                transform_incoming_operation(op_in, history)
+
+        def fast():
+            for op_in in incoming:
+                transform_packed(
+                    op_in.position, op_in.delete_len, bool(op_in.insert_text), None, packed
+                )
+
+        repeat = max(1, int(TARGET_SECONDS / max(timed(slow, 1), 1e-6)))
+        slow_us = timed(slow, repeat) / len(incoming) * 1e6
+        fast_us = timed(fast, repeat * 5) / len(incoming) * 1e6
+        print(f"{size:>8,} {slow_us:>12.1f} {fast_us:>10.1f} {slow_us / fast_us:>7.1f}x")
+
+    print()
+    print(f"{'pending':>8} {'history':>8} {'one-by-one ms':>14} {'batch ms':>9} {'speedup':>8}")
+    for pending, size in BACKLOGS:
+        packed = [pack_op(op) for op in make_history(size)]
+        incoming = make_incoming(pending)
+        positions = [op.position for op in incoming]
+        delete_lens = [op.delete_len for op in incoming]
+        has_insert = [bool(op.insert_text) for op in incoming]
+        user_ids = [None] * pending
+
+        expected = [
+            transform_packed(p, d, i, None, packed)
+            for p, d, i in zip(positions, delete_lens, has_insert)
+        ]
+        got = transform_packed_batch(positions, delete_lens, has_insert, user_ids, packed)
+        assert expected == list(zip(*got))
+
+        one_by_one = timed(
+            lambda: [
+                transform_packed(p, d, i, None, packed)
+                for p, d, i in zip(positions, delete_lens, has_insert)
+            ],
+            3,
+        )
+        batch = timed(
+            lambda: transform_packed_batch(positions, delete_lens, has_insert, user_ids, packed), 3
+        )
+        print(
+            f"{pending:>8,} {size:>8,} {one_by_one * 1e3:>14.1f} {batch * 1e3:>9.1f} "
+            f"{one_by_one / batch:>7.1f}x"
+        )
+
+    print()
+    print(f"{'history':>8} {'stepwise us':>12} {'composed us':>12} {'first use ms':>13} {'speedup':>8}")
+    full = [pack_op(op) for op in make_history(max(STALE_HISTORIES))]
+    for size in STALE_HISTORIES:
+        base = len(full) - size
+        packed = full[base:]
+        # Replaces always step through every op
+        incoming = [op for op in make_incoming(300) if not (op.insert_text and op.delete_len)]
+        composed = ComposedHistory(BLOCK_SIZES, MAX_BLOCKS)
+
+        def stepwise():
+            return [
+                transform_packed(op.position, op.delete_len, bool(op.insert_text), None, packed)
+                for op in incoming
+            ]
+
+        def through_blocks():
+            return [
+                composed.transform(
+                    op.position, op.delete_len, bool(op.insert_text), None, base, packed
+                )
+                for op in incoming
+            ]
+
+        first_use = timed(through_blocks, 1)
+        assert stepwise() == through_blocks()
+        step_us = timed(stepwise, 5) / len(incoming) * 1e6
+        composed_us = timed(through_blocks, 5) / len(incoming) * 1e6
+        print(
+            f"{size:>8,} {step_us:>12.1f} {composed_us:>12.1f} {first_use * 1e3:>13.1f} "
+            f"{step_us / composed_us:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Randomized checks of the data structures behind a live document, each
+against the plain Python it replaces.
+
+- Rope: random inserts, deletes and slices, compared with a `str`.
+- _PrefixSums: point updates, prefix sums and `count_upto`, compared with
+  summing the list.
+- ChunkLayout: random edits tracked chunk by chunk, with the Fenwick tree
+  checked against plain sums after every op and the flushed chunk rows
+  compared with the text.
+- Op log coalescing: random typing by a few users folded into rows the way
+  `OpLogWriter` does (`_Run.extend`), then split back with
+  `split_operation`; the parts must be the original ops.
+- BinaryCodec: server op, batch and catch-up frames and client op and batch
+  frames encoded and decoded again.
+
+    python -m app.scripts.fuzz_structures --trials 2000
+
+Exits non-zero if any check fails, printing the first failure of each.
+"""
+import argparse
+import random
+import sys
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from app.db.crud.document import split_operation
+from app.db.schemas.operation import OperationIn
+from app.utils.chunks import ChunkLayout, _PrefixSums
+from app.utils.codec import BinaryCodec
+from app.utils.oplog import _Run
+from app.utils.rope import LEAF_SIZE, Rope
+from app.utils.simpleop import AppliedOp
+
+USERS = ("a", "b", "c")
+ALPHABET = "xyzé\n"
+NOW = datetime.now(timezone.utc)
+
+
+def random_text(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(ALPHABET) for _ in range(length))
+
+
+def check_rope(rng: random.Random, trials: int) -> tuple[int, list]:
+    failures = []
+    for trial in range(trials):
+        text = random_text(rng, rng.choice((0, 10, LEAF_SIZE * 3)))
+        rope = Rope(text)
+        for step in range(rng.randint(1, 60)):
+            position = rng.randint(0, len(text))
+            if text and rng.random() < 0.4:
+                length = rng.randint(1, min(len(text) - position, LEAF_SIZE * 2) or 1)
+                rope.delete(position, length)
+                text = text[:position] + text[position + length :]
+            else:
+                inserted = random_text(rng, rng.choice((1, 3, LEAF_SIZE + 5)))
+                rope.insert(position, inserted)
+                text = text[:position] + inserted + text[position:]
+            start = rng.randint(0, len(text))
+            end = rng.randint(start, len(text))
+            if len(rope) != len(text) or rope.slice(start, end) != text[start:end]:
+                failures.append(f"trial {trial} step {step}: length or slice {start}:{end}")
+                break
+            if rng.random() < 0.2 and (str(rope) != text or "".join(rope.chunks()) != text):
+                failures.append(f"trial {trial} step {step}: content")
+                break
+    return trials, failures
+
+
+def check_prefix_sums(rng: random.Random, trials: int) -> tuple[int, list]:
+    failures = []
+    for trial in range(trials):
+        values = [rng.randint(0, 20) for _ in range(rng.randint(0, 40))]
+        sums = _PrefixSums(values)
+        for step in range(20):
+            if values and rng.random() < 0.7:
+                i = rng.randrange(len(values))
+                delta = rng.randint(-values[i], 20)
+                values[i] += delta
+                sums.add(i, delta)
+            running = [sum(values[:k]) for k in range(len(values) + 1)]
+            x = rng.randint(-2, running[-1] + 2)
+            if any(sums.prefix(k) != running[k] for k in range(len(values) + 1)):
+                failures.append(f"trial {trial} step {step}: prefix of {values}")
+                break
+            # Leading values summing to at most x; running[0] is the empty prefix
+            if sums.count_upto(x) != max(0, bisect_right(running, x) - 1):
+                failures.append(f"trial {trial} step {step}: count_upto({x}) of {values}")
+                break
+    return trials, failures
+
+
+def check_chunk_layout(rng: random.Random, trials: int) -> tuple[int, list]:
+    failures = []
+    for trial in range(trials):
+        size = rng.choice((4, 8, 16))
+        text = random_text(rng, rng.randint(0, 60))
+        layout = ChunkLayout.unstored(size, len(text))
+        stored: dict[int, str] = {}
+
+        def flush() -> bool:
+            changes = layout.take_changes(text)
+            if changes.replace_all:
+                stored.clear()
+            for index in changes.deletes:
+                stored.pop(index, None)
+            stored.update(changes.upserts)
+            return "".join(stored[index] for index in sorted(stored)) == text
+
+        if not flush():
+            failures.append(f"trial {trial}: first flush")
+            continue
+        for step in range(rng.randint(1, 80)):
+            position = rng.randint(0, len(text))
+            delete_len = min(rng.randint(0, 5), len(text) - position) if rng.random() < 0.5 else 0
+            inserted = "x" * rng.choice((0, 1, 3, 40))
+            text = text[:position] + inserted + text[position + delete_len :]
+            layout.apply(position, delete_len, len(inserted))
+            lengths = layout.lengths
+            if (
+                any(layout._sums.prefix(k) != sum(lengths[:k]) for k in range(len(lengths) + 1))
+                or sum(lengths) != len(text)
+                or not all(length > 0 for length in lengths)
+                or layout.indices != sorted(set(layout.indices))
+            ):
+                failures.append(f"trial {trial} step {step}: layout {list(zip(layout.indices, lengths))}")
+                break
+            if rng.random() < 0.3 and not flush():
+                failures.append(f"trial {trial} step {step}: stored chunks")
+                break
+        else:
+            if not flush():
+                failures.append(f"trial {trial}: last flush")
+    return trials, failures
+
+
+def random_typing(rng: random.Random, count: int) -> list[AppliedOp]:
+    """Ops as the server sequences them: mostly typing and backspacing, with cursor jumps."""
+    text, ops = "", []
+    cursors = {user: 0 for user in USERS}
+    created_at = NOW
+    user = rng.choice(USERS)
+    for version in range(1, count + 1):
+        if rng.random() < 0.1:
+            user = rng.choice(USERS)
+        cursor = min(cursors[user], len(text))
+        if rng.random() < 0.05:
+            cursor = rng.randint(0, len(text))
+        r = rng.random()
+        if r < 0.2 and cursor:
+            position, insert_text, delete_len = cursor - 1, None, 1
+            cursor -= 1
+        elif r < 0.25 and cursor < len(text):
+            position, insert_text, delete_len = cursor, None, 1
+        else:
+            inserted = rng.choice(ALPHABET) if r < 0.95 else random_text(rng, 4)
+            position, insert_text, delete_len = cursor, inserted, 0
+            cursor += len(inserted)
+        cursors[user] = cursor
+        text = text[:position] + (insert_text or "") + text[position + delete_len :]
+        created_at += timedelta(seconds=rng.choice((0.05, 0.1, 0.2, 2.0)))
+        ops.append(AppliedOp(
+            position=position, insert_text=insert_text, delete_len=delete_len, user_id=user,
+            base_version=version - rng.randint(1, 3), applied_version=version,
+            created_at=created_at,
+        ))
+    return ops
+
+
+def check_coalescing(rng: random.Random, trials: int) -> tuple[int, list]:
+    failures = []
+    for trial in range(trials):
+        ops = random_typing(rng, rng.randint(1, 120))
+        window = timedelta(seconds=rng.choice((0.1, 1.0)))
+        max_ops = rng.choice((2, 5, 256))
+        runs: list[_Run] = []
+        for op in ops:
+            if not (runs and runs[-1].extend(op, window, max_ops)):
+                runs.append(_Run.start("doc", op))
+        parts = []
+        for op_id, run in enumerate(runs):
+            if run.row["version_count"] > max_ops:
+                failures.append(f"trial {trial}: row of {run.row['version_count']} versions")
+            parts.extend(split_operation(SimpleNamespace(id=op_id, **run.row)))
+        got = [(p.position, p.insert_text, p.delete_len, p.applied_version, p.user_id) for p in parts]
+        expected = [
+            (op.position, op.insert_text, op.delete_len, op.applied_version, op.user_id)
+            for op in ops
+        ]
+        if got != expected:
+            first = next(
+                i for i in range(max(len(got), len(expected)))
+                if got[i:i + 1] != expected[i:i + 1]
+            )
+            failures.append(f"trial {trial}: version {first + 1} split back as {got[first:first + 1]}")
+    return trials, failures
+
+
+def random_applied(rng: random.Random, applied_version: int) -> AppliedOp:
+    return AppliedOp(
+        position=rng.randint(0, 10**6),
+        insert_text=rng.choice((None, "", "x", "héllo\n", random_text(rng, 300))),
+        delete_len=rng.randint(0, 5),
+        user_id=rng.choice(("a", "ünïcode", "3f2b8c1e-0000-4000-8000-000000000000")),
+        base_version=rng.randint(0, applied_version),
+        applied_version=applied_version,
+        created_at=NOW + timedelta(microseconds=rng.randint(0, 10**12)),
+        id=rng.choice((None, rng.randint(1, 10**12))),
+    )
+
+
+def check_codec(rng: random.Random, trials: int) -> tuple[int, list]:
+    codec, failures = BinaryCodec(), []
+    for trial in range(trials):
+        version = rng.randint(1, 10**9)
+        op = random_applied(rng, version)
+        kind = rng.choice(("op", "ack"))
+        if codec.decode_op(codec.encode_op(kind, "doc", op, version)) != (version, op):
+            failures.append(f"trial {trial}: {kind} {op}")
+            continue
+        count = rng.randint(0, min(20, version))
+        ops = [random_applied(rng, v) for v in range(version - count + 1, version + 1)]
+        frames = (
+            codec.encode_batch(rng.choice(("batch", "batch_ack")), "doc", ops, version),
+            codec.encode_catchup("doc", ops, version),
+        )
+        if any(codec.decode_ops(frame) != (version, ops) for frame in frames):
+            failures.append(f"trial {trial}: batch of {count}")
+            continue
+
+        sent = [
+            OperationIn(
+                position=rng.randint(0, 10**6),
+                insert_text=rng.choice((None, "x", "héllo\n", random_text(rng, 50))),
+                delete_len=rng.randint(0, 5),
+                base_version=version,
+            )
+            for _ in range(rng.randint(1, 10))
+        ]
+        fields = lambda op: (op.position, op.insert_text or None, op.delete_len, op.base_version)
+        kind, received = codec.decode(None, codec.encode_client_op(sent[0]))
+        if kind != "op" or fields(received) != fields(sent[0]):
+            failures.append(f"trial {trial}: client op {sent[0]}")
+            continue
+        kind, received = codec.decode(None, codec.encode_client_batch(sent))
+        if kind != "batch" or [fields(op) for op in received] != [fields(op) for op in sent]:
+            failures.append(f"trial {trial}: client batch of {len(sent)}")
+    return trials, failures
+
+
+CHECKS = {
+    "rope": check_rope,
+    "prefix_sums": check_prefix_sums,
+    "chunk_layout": check_chunk_layout,
+    "coalescing": check_coalescing,
+    "codec": check_codec,
+}
+
+
+def main(args: argparse.Namespace) -> int:
+    rng = random.Random(args.seed)
+    failed = 0
+    for name, check in CHECKS.items():
+        start = time.perf_counter()
+        trials, failures = check(rng, args.trials)
+        print(f"{name:>13}: {trials:,} trials, {len(failures)} failures "
+              f"({time.perf_counter() - start:.1f}s)")
+        if failures:
+            print(f"  {failures[0]}")
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--trials", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,280 @@
+"""
+Randomized checks of the OT engine, doubling as transform microbenchmarks.
+
+Engines: every incoming op is transformed against random histories of
+inserts, deletes and replaces by the reference `transform_incoming_operation`,
+`transform_packed`, `transform_packed_batch`, `ComposedHistory` and
+`transform_sequence`, which must all agree. Histories are built on short
+texts with few users, so ties and overlapping ranges are common.
+
+Convergence: a few sites each make one op on the same version of a text,
+and the server applies them in every possible arrival order (each op
+transformed against those already applied, as `DocumentStateManager.submit`
+does). Every order should end with the same text; the table counts the
+trials where they did not, per combination of op kinds (I insert, D delete,
+R replace), with the smallest counterexample found.
+
+    python -m app.scripts.fuzz_transform --trials 5000
+    python -m app.scripts.fuzz_transform --bench --json transform.json
+
+`--bench` adds throughput for each (incoming, applied) pair of op kinds and
+for single ops and backlogs against long histories. Exits non-zero if the
+engines disagree, or (with `--require-convergence`) if any order diverged.
+"""
+import argparse
+import itertools
+import json
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+from app.utils.compose import BLOCK_SIZES, MAX_BLOCKS, ComposedHistory
+from app.utils.helper import apply_operation
+from app.utils.simpleop import AppliedOp
+from app.utils.transformation import (
+    BATCH_VECTOR_MIN,
+    pack_op,
+    transform_incoming_operation,
+    transform_packed,
+    transform_packed_batch,
+    transform_sequence,
+)
+
+USERS = ("a", "b", "c", "d")
+ALPHABET = "xyz"
+NOW = datetime.now(timezone.utc)
+
+
+def kind(op: AppliedOp) -> str:
+    if op.insert_text and op.delete_len:
+        return "R"
+    return "D" if op.delete_len else "I"
+
+
+def random_op(
+    rng: random.Random, length: int, user_id: str, base_version: int, kinds: str = "IDR"
+) -> AppliedOp:
+    """An op that is valid on a text of `length` characters."""
+    op_kind = rng.choice(kinds if length else "I")
+    position = rng.randint(0, length - 1 if op_kind != "I" else length)
+    delete_len = 0 if op_kind == "I" else rng.randint(1, min(4, length - position))
+    insert_text = None if op_kind == "D" else rng.choice(ALPHABET) * rng.randint(1, 3)
+    return AppliedOp(
+        position=position,
+        insert_text=insert_text,
+        delete_len=delete_len,
+        user_id=user_id,
+        base_version=base_version,
+        applied_version=base_version + 1,
+        created_at=NOW,
+    )
+
+
+def random_history(rng: random.Random, count: int) -> tuple[list[AppliedOp], list[int]]:
+    """`count` sequenced ops on a short text, and the text's length at every version."""
+    lengths = [rng.randint(0, 12)]
+    history = []
+    for version in range(count):
+        op = random_op(rng, lengths[-1], rng.choice(USERS), version)
+        history.append(op)
+        lengths.append(lengths[-1] - op.delete_len + len(op.insert_text or ""))
+    return history, lengths
+
+
+def check_engines(rng: random.Random, trials: int) -> tuple[int, int, list]:
+    """Transform random stale ops with every engine; returns (checks, mismatches, examples)."""
+    checks = mismatches = 0
+    examples = []
+    for _ in range(trials):
+        history, lengths = random_history(rng, rng.choice((1, 5, 40, 300)))
+        packed = [pack_op(op) for op in history]
+        composed = ComposedHistory(BLOCK_SIZES, MAX_BLOCKS)
+        incoming = []
+        for _ in range(BATCH_VECTOR_MIN if len(history) >= 40 else 5):
+            base = rng.randint(0, len(history))
+            incoming.append(random_op(rng, lengths[base], rng.choice(USERS), base))
+
+        batch = transform_packed_batch(
+            [op.position for op in incoming],
+            [op.delete_len for op in incoming],
+            [bool(op.insert_text) for op in incoming],
+            [op.user_id for op in incoming],
+            packed,
+            [op.base_version for op in incoming],
+        )
+        for i, op in enumerate(incoming):
+            concurrent = packed[op.base_version :]
+            reference = transform_incoming_operation(op, history[op.base_version :])
+            results = {
+                "reference": (reference.position, reference.delete_len),
+                "packed": transform_packed(
+                    op.position, op.delete_len, bool(op.insert_text), op.user_id, concurrent
+                ),
+                "batch": (batch[0][i], batch[1][i]),
+                "composed": composed.transform(
+                    op.position, op.delete_len, bool(op.insert_text), op.user_id,
+                    op.base_version, concurrent,
+                ),
+                "sequence": transform_sequence([pack_op(op)], concurrent)[0],
+            }
+            checks += 1
+            if len(set(results.values())) > 1:
+                mismatches += 1
+                if len(examples) < 5:
+                    examples.append({"op": pack_op(op), "base_version": op.base_version,
+                                     "history": len(history), "results": results})
+    return checks, mismatches, examples
+
+
+def apply_in_order(text: str, ops: list[AppliedOp]) -> str:
+    """Sequence concurrent ops in the given order, as the server does."""
+    applied = []
+    for op in ops:
+        position, delete_len = transform_packed(
+            op.position, op.delete_len, bool(op.insert_text), op.user_id, applied
+        )
+        text = apply_operation(
+            text, AppliedOp(position, op.insert_text, delete_len, op.user_id, 0, 0, NOW)
+        )
+        applied.append((position, len(op.insert_text or ""), delete_len, op.user_id))
+    return text
+
+
+def check_convergence(rng: random.Random, trials: int, max_sites: int, kinds: str) -> dict:
+    """Per combination of op kinds: trials, divergent trials and the smallest counterexample."""
+    classes: dict[str, dict] = {}
+    for _ in range(trials):
+        text = "".join(rng.choice("abcdefghij") for _ in range(rng.randint(0, 10)))
+        sites = rng.randint(2, max_sites)
+        ops = [random_op(rng, len(text), user, 0, kinds) for user in USERS[:sites]]
+        name = "".join(sorted(kind(op) for op in ops))
+        stats = classes.setdefault(name, {"trials": 0, "divergent": 0, "example": None})
+        stats["trials"] += 1
+        outcomes = {apply_in_order(text, list(order)) for order in itertools.permutations(ops)}
+        if len(outcomes) > 1:
+            stats["divergent"] += 1
+            size = len(text) + len(ops)
+            if stats["example"] is None or size < stats["example"]["size"]:
+                stats["example"] = {
+                    "size": size,
+                    "text": text,
+                    "ops": [(op.user_id, op.position, op.insert_text, op.delete_len) for op in ops],
+                    "outcomes": sorted(outcomes),
+                }
+    return dict(sorted(classes.items()))
+
+
+def throughput(fn, count: int, seconds: float = 0.3) -> float:
+    """Calls of `fn` per second, where one call does `count` transforms."""
+    calls, start = 0, time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < seconds:
+        fn()
+        calls += 1
+    return calls * count / elapsed
+
+
+def bench(rng: random.Random) -> dict:
+    results: dict = {"pairs": {}, "histories": {}}
+    samples = 2000
+    print(f"{'pair':>6} {'reference ops/s':>16} {'packed ops/s':>13}")
+    for incoming_kind, applied_kind in itertools.product("IDR", repeat=2):
+        pairs = [
+            (random_op(rng, 20, "a", 0, incoming_kind), random_op(rng, 20, "b", 0, applied_kind))
+            for _ in range(samples)
+        ]
+        packed = [(op, [pack_op(applied)]) for op, applied in pairs]
+        reference = throughput(
+            lambda: [transform_incoming_operation(op, [applied]) for op, applied in pairs], samples
+        )
+        fast = throughput(
+            lambda: [
+                transform_packed(op.position, op.delete_len, bool(op.insert_text), op.user_id, history)
+                for op, history in packed
+            ],
+            samples,
+        )
+        name = f"{incoming_kind}/{applied_kind}"
+        results["pairs"][name] = {"reference": round(reference), "packed": round(fast)}
+        print(f"{name:>6} {reference:>16,.0f} {fast:>13,.0f}")
+
+    print()
+    # Single stale ops through each engine; "batch" is a backlog of 1000 pending ops
+    print(f"{'history':>8} {'packed op/s':>12} {'composed op/s':>14} {'batch op/s':>11} {'steps/s':>12}")
+    for size in (1_000, 10_000, 100_000):
+        history, lengths = random_history(rng, size)
+        packed = [pack_op(op) for op in history]
+        ops = [random_op(rng, lengths[0], "a", 0, "ID") for _ in range(1_000)]
+        composed = ComposedHistory(BLOCK_SIZES, max(MAX_BLOCKS, size // min(BLOCK_SIZES)))
+        composed.transform(0, 0, True, "a", 0, packed)  # build the blocks once
+
+        def one(engine):
+            return lambda: [engine(op) for op in ops[:5]]
+
+        step = throughput(
+            one(lambda op: transform_packed(op.position, op.delete_len, bool(op.insert_text), "a", packed)), 5
+        )
+        through_blocks = throughput(
+            one(lambda op: composed.transform(op.position, op.delete_len, bool(op.insert_text), "a", 0, packed)), 5
+        )
+        batch = throughput(
+            lambda: transform_packed_batch(
+                [op.position for op in ops], [op.delete_len for op in ops],
+                [bool(op.insert_text) for op in ops], ["a"] * len(ops), packed,
+            ),
+            len(ops),
+        )
+        results["histories"][size] = {
+            "packed": round(step, 1), "composed": round(through_blocks, 1), "batch": round(batch, 1),
+        }
+        print(f"{size:>8,} {step:>12,.1f} {through_blocks:>14,.1f} {batch:>11,.1f} {step * size:>12,.0f}")
+    return results
+
+
+def main(args: argparse.Namespace) -> int:
+    rng = random.Random(args.seed)
+    report: dict = {"seed": args.seed}
+
+    start = time.perf_counter()
+    checks, mismatches, examples = check_engines(rng, args.trials // 10 or 1)
+    print(f"engines: {checks:,} transforms, {mismatches} disagreements "
+          f"({time.perf_counter() - start:.1f}s)")
+    for example in examples:
+        print(f"  {example}")
+    report["engines"] = {"checks": checks, "mismatches": mismatches, "examples": examples}
+
+    start = time.perf_counter()
+    classes = check_convergence(rng, args.trials, args.sites, args.kinds)
+    divergent = sum(stats["divergent"] for stats in classes.values())
+    print(f"convergence: {args.trials:,} trials of 2-{args.sites} sites, {divergent} divergent "
+          f"({time.perf_counter() - start:.1f}s)")
+    print(f"{'kinds':>8} {'trials':>7} {'divergent':>10}  smallest counterexample")
+    for name, stats in classes.items():
+        example = stats["example"]
+        shown = f"{example['text']!r} {example['ops']} -> {example['outcomes']}" if example else ""
+        print(f"{name:>8} {stats['trials']:>7} {stats['divergent']:>10}  {shown}")
+    report["convergence"] = classes
+
+    if args.bench:
+        print()
+        report["bench"] = bench(rng)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+    if mismatches or (args.require_convergence and divergent):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--trials", type=int, default=5000)
+    parser.add_argument("--sites", type=int, default=3, choices=range(2, len(USERS) + 1),
+                        help="most concurrent ops per trial")
+    parser.add_argument("--kinds", default="IDR", help="op kinds to generate: I, D, R")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bench", action="store_true")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--require-convergence", action="store_true")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,109 @@
+"""
+Connection-storm load test against a running server.
+
+Registers a user, creates `--docs` documents and opens `--sockets`
+WebSockets spread across them all at once (each connect authenticates and,
+for the first socket on a document, loads it from the database). Once every
+socket is in, each one sends `--ops` single-character inserts, waiting for
+the ack of each before the next. Reports connect and ack latency
+percentiles, failures and throughput.
+
+    python -m app.scripts.load_sockets --base http://127.0.0.1:8000 --sockets 2000
+
+Raise the open-file limit (`ulimit -n`) on both ends for thousands of sockets.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import websockets
+
+from app.scripts.loadtest import describe, percentiles, provision
+
+
+class Client:
+    def __init__(self, url: str):
+        self.url = url
+        self.ws = None
+        self.version = 0
+        self.connect_time: float | None = None
+        self.ack_times: list[float] = []
+        self.error: str | None = None
+
+    async def connect(self) -> None:
+        start = time.perf_counter()
+        try:
+            self.ws = await websockets.connect(self.url, open_timeout=60, max_queue=None)
+            init = json.loads(await self.ws.recv())
+            if init.get("type") != "init":
+                raise RuntimeError(f"expected init, got {init.get('type')}")
+            self.version = init["version"]
+            self.connect_time = time.perf_counter() - start
+        except Exception as e:
+            self.error = f"connect: {e!r}"
+
+    async def type(self, ops: int) -> None:
+        try:
+            for _ in range(ops):
+                start = time.perf_counter()
+                await self.ws.send(json.dumps(
+                    {"position": 0, "insert_text": "x", "delete_len": 0, "base_version": self.version}
+                ))
+                while True:
+                    message = json.loads(await self.ws.recv())
+                    if message["type"] in ("ack", "op"):
+                        self.version = max(self.version, message["updated_version"])
+                    if message["type"] == "ack":
+                        break
+                    if message["type"] in ("error", "sync_needed"):
+                        self.version = message.get("version", self.version)
+                        raise RuntimeError(message.get("message", message["type"]))
+                self.ack_times.append(time.perf_counter() - start)
+        except Exception as e:
+            self.error = f"ops: {e!r}"
+
+    async def close(self) -> None:
+        if self.ws is not None:
+            await self.ws.close()
+
+
+async def main(args: argparse.Namespace) -> None:
+    (token,), doc_ids = await provision(args.base, 1, args.docs)
+    ws_base = args.base.replace("http", "ws", 1)
+    clients = [
+        Client(f"{ws_base}/ws/{doc_ids[i % len(doc_ids)]}?token={token}")
+        for i in range(args.sockets)
+    ]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client.connect() for client in clients))
+    connect_wall = time.perf_counter() - start
+    connected = [client for client in clients if client.error is None]
+    print(f"connected {len(connected)}/{len(clients)} sockets in {connect_wall:.2f}s")
+    print(f"  connect+init  {describe(percentiles([c.connect_time for c in connected]))}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client.type(args.ops) for client in connected))
+    ops_wall = time.perf_counter() - start
+    acks = [t for client in connected for t in client.ack_times]
+    print(f"acked {len(acks)}/{len(connected) * args.ops} ops in {ops_wall:.2f}s "
+          f"-> {len(acks) / ops_wall:.0f} ops/s")
+    print(f"  ack latency   {describe(percentiles(acks))}")
+
+    errors: dict[str, int] = {}
+    for client in clients:
+        if client.error is not None:
+            errors[client.error[:80]] = errors.get(client.error[:80], 0) + 1
+    for error, count in sorted(errors.items(), key=lambda item: -item[1]):
+        print(f"  {count} x {error}")
+    await asyncio.gather(*(client.close() for client in connected))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--base", default="http://127.0.0.1:8000")
+    parser.add_argument("--sockets", type=int, default=1000)
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--ops", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
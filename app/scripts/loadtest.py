@@ -0,0 +1,388 @@
+"""
+End-to-end editing load test against a running server.
+
+Registers `--users` users, creates `--docs` documents and connects
+`--clients` WebSockets to each. Every client keeps its own replica of the
+document, built only from the frames the server sends it, and makes `--ops`
+edits in the chosen typing `--pattern`, one op in flight at a time (as an
+editor does), optionally paced to `--rate` ops/s. Reports throughput, ack
+latency (send to own ack), broadcast latency (send to arrival at each other
+client on the document) and whether every replica converged on the
+server's content.
+
+    python -m app.scripts.loadtest --base http://127.0.0.1:8000 --docs 10 --clients 5 --ops 200
+
+Patterns: `typing` (runs of characters at a moving cursor, with backspaces
+and jumps), `random` (inserts and deletes anywhere), `paste` (typing with
+occasional large inserts) and `batch` (typing sent as `batch` messages of
+`--batch-size` ops). The same `--seed` replays the same edits.
+
+Exits non-zero if a document did not converge or a `--min-ops-per-sec` /
+`--max-ack-p99` / `--max-broadcast-p99` gate fails, so it can guard against
+performance regressions; `--json` also writes the results to a file.
+"""
+import argparse
+import asyncio
+import json
+import random
+import string
+import sys
+import time
+import uuid
+
+import httpx
+import websockets
+
+from app.db.schemas.operation import OperationIn
+from app.utils.codec import MSG_ACK, MSG_BATCH_ACK, MSG_CATCHUP, MSG_OP, binary_codec
+
+PATTERNS = ("typing", "random", "paste", "batch")
+LETTERS = string.ascii_lowercase + "     "
+
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def at(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1e3, 2)
+
+    return {"p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": round(ordered[-1] * 1e3, 2)}
+
+
+def describe(stats: dict) -> str:
+    if not stats:
+        return "-"
+    return "  ".join(f"{name} {value:.1f}" for name, value in stats.items()) + " ms"
+
+
+async def provision(base: str, users: int, docs: int) -> tuple[list[str], list[str]]:
+    """Register and log in `users` users; the first creates `docs` documents."""
+    async with httpx.AsyncClient(base_url=base, timeout=60) as http:
+
+        async def user() -> str:
+            email, password = f"load-{uuid.uuid4().hex[:12]}@example.com", "load-test-password"
+            response = await http.post("/api/v1/users/", json={"email": email, "password": password})
+            response.raise_for_status()
+            response = await http.post(
+                "/api/v1/auth/login", data={"username": email, "password": password}
+            )
+            response.raise_for_status()
+            return response.json()["access_token"]
+
+        tokens = await asyncio.gather(*(user() for _ in range(users)))
+        headers = {"Authorization": f"Bearer {tokens[0]}"}
+        doc_ids = []
+        for i in range(docs):
+            response = await http.post(
+                "/api/v1/docs/", json={"title": f"loadtest {i}", "content": ""}, headers=headers
+            )
+            response.raise_for_status()
+            doc_ids.append(response.json()["id"])
+    return list(tokens), doc_ids
+
+
+class Typist:
+    """Produces the next edit, as (position, insert_text, delete_len), for a text."""
+
+    def __init__(self, pattern: str, rng: random.Random):
+        self.pattern = pattern
+        self.rng = rng
+        self.cursor = 0
+
+    def edit(self, text: str) -> tuple[int, str | None, int]:
+        rng = self.rng
+        if self.pattern == "random":
+            if text and rng.random() < 0.4:
+                position = rng.randrange(len(text))
+                return position, None, min(len(text) - position, rng.randint(1, 5))
+            return rng.randint(0, len(text)), rng.choice(LETTERS) * rng.randint(1, 3), 0
+
+        self.cursor = min(self.cursor, len(text))
+        roll = rng.random()
+        if roll < 0.02:
+            self.cursor = rng.randint(0, len(text))
+        if self.pattern == "paste" and roll > 0.98:
+            insert = "".join(rng.choice(LETTERS) for _ in range(rng.randint(200, 2000)))
+            position, self.cursor = self.cursor, self.cursor + len(insert)
+            return position, insert, 0
+        if self.cursor > 0 and roll < 0.10:
+            self.cursor -= 1
+            return self.cursor, None, 1
+        insert = "\n" if roll > 0.97 else rng.choice(LETTERS)
+        position, self.cursor = self.cursor, self.cursor + 1
+        return position, insert, 0
+
+
+def apply(text: str, op: tuple[int, str | None, int]) -> str:
+    position, insert_text, delete_len = op
+    return text[:position] + (insert_text or "") + text[position + delete_len :]
+
+
+class Results:
+    def __init__(self):
+        self.ack_times: list[float] = []
+        self.sent: dict[tuple[str, int], float] = {}  # (doc, version) -> when its sender sent it
+        self.received: dict[tuple[str, int], list[float]] = {}  # ... -> arrivals at other clients
+        self.acked_ops = 0
+        self.resyncs = 0
+        self.errors: dict[str, int] = {}
+
+    def error(self, message: str) -> None:
+        self.errors[message[:80]] = self.errors.get(message[:80], 0) + 1
+
+    def broadcast_times(self) -> list[float]:
+        return [
+            arrival - self.sent[key]
+            for key, arrivals in self.received.items()
+            if key in self.sent
+            for arrival in arrivals
+        ]
+
+
+class Client:
+    def __init__(self, url: str, doc_id: str, codec: str, typist: Typist, results: Results):
+        self.url = url
+        self.doc_id = doc_id
+        self.binary = codec == "binary"
+        self.typist = typist
+        self.results = results
+        self.ws = None
+        self.text = ""
+        self.version = 0
+        self.unapplied: dict[int, tuple[int, str | None, int]] = {}
+        self.acked: asyncio.Event = asyncio.Event()
+        self.sent_at = 0.0
+        self.reader: asyncio.Task | None = None
+
+    async def connect(self) -> None:
+        url = self.url
+        for _ in range(3):  # follow cluster redirects
+            self.ws = await websockets.connect(url, open_timeout=60, max_queue=None, max_size=None)
+            init = json.loads(await self.ws.recv())
+            if init["type"] != "redirect":
+                break
+            await self.ws.close()
+            url = f"{init['url']}{'&' if '?' in init['url'] else '?'}{url.split('?', 1)[1]}"
+        if init["type"] != "init":
+            raise RuntimeError(f"expected init, got {init['type']}")
+        self.text, self.version = init["content"], init["version"]
+        self.reader = asyncio.create_task(self._read())
+
+    async def _read(self) -> None:
+        try:
+            async for frame in self.ws:
+                now = time.perf_counter()
+                if isinstance(frame, bytes):
+                    self._binary_frame(frame, now)
+                else:
+                    self._json_frame(json.loads(frame), now)
+        except websockets.ConnectionClosed:
+            pass
+
+    def _json_frame(self, message: dict, now: float) -> None:
+        kind = message["type"]
+        if kind in ("op", "ack"):
+            self._ops(kind == "ack", [message["op"]], message["updated_version"], now)
+        elif kind in ("batch", "batch_ack"):
+            self._ops(kind == "batch_ack", message["ops"], message["updated_version"], now)
+        elif kind == "catchup":
+            self._ops(False, message["ops"], message["version"], None)
+        elif kind == "sync_needed":
+            self.results.resyncs += 1
+            self.text, self.version = message["content"], message["version"]
+            self.unapplied = {v: op for v, op in self.unapplied.items() if v > self.version}
+            self._apply_ready()
+            self.acked.set()  # the op in flight was dropped
+        elif kind == "error":
+            self.results.error(message.get("message", "error"))
+            self.acked.set()
+
+    def _binary_frame(self, frame: bytes, now: float) -> None:
+        kind = frame[0]
+        if kind in (MSG_OP, MSG_ACK):
+            version, op = binary_codec.decode_op(frame)
+            ops = [op]
+        else:
+            version, ops = binary_codec.decode_ops(frame)
+        ops = [
+            {"position": op.position, "insert_text": op.insert_text, "delete_len": op.delete_len}
+            for op in ops
+        ]
+        own = kind in (MSG_ACK, MSG_BATCH_ACK)
+        self._ops(own, ops, version, None if kind == MSG_CATCHUP else now)
+
+    def _ops(self, own: bool, ops: list[dict], version: int, now: float | None) -> None:
+        """Queue ops ending at `version` for the replica, and time them."""
+        first = version - len(ops) + 1
+        for applied_version, op in enumerate(ops, first):
+            self.unapplied[applied_version] = (op["position"], op["insert_text"], op["delete_len"] or 0)
+            key = (self.doc_id, applied_version)
+            if own:
+                self.results.sent[key] = self.sent_at
+            elif now is not None:
+                self.results.received.setdefault(key, []).append(now)
+        if own:
+            self.results.ack_times.append(now - self.sent_at)
+            self.results.acked_ops += len(ops)
+            self.acked.set()
+        self._apply_ready()
+
+    def _apply_ready(self) -> None:
+        while self.version + 1 in self.unapplied:
+            self.version += 1
+            self.text = apply(self.text, self.unapplied.pop(self.version))
+
+    async def type(self, ops: int, rate: float, batch_size: int) -> None:
+        interval = 1 / rate if rate > 0 else 0.0
+        rng = self.typist.rng
+        sent = 0
+        while sent < ops:
+            if interval:
+                await asyncio.sleep(rng.uniform(0.5, 1.5) * interval)
+            count = min(batch_size if self.typist.pattern == "batch" else 1, ops - sent)
+            text, edits = self.text, []
+            for _ in range(count):
+                edit = self.typist.edit(text)
+                text = apply(text, edit)
+                edits.append(edit)
+            self.acked.clear()
+            self.sent_at = time.perf_counter()
+            await self.ws.send(self._encode(edits))
+            sent += count
+            try:
+                await asyncio.wait_for(self.acked.wait(), 30)
+            except asyncio.TimeoutError:
+                self.results.error("no ack within 30s")
+
+    def _encode(self, edits: list[tuple[int, str | None, int]]) -> str | bytes:
+        ops = [
+            OperationIn(position=p, insert_text=t, delete_len=d, base_version=self.version)
+            for p, t, d in edits
+        ]
+        if self.binary:
+            if len(ops) == 1:
+                return binary_codec.encode_client_op(ops[0])
+            return binary_codec.encode_client_batch(ops)
+        if len(ops) == 1:
+            return ops[0].model_dump_json()
+        return json.dumps({
+            "type": "batch",
+            "base_version": self.version,
+            "ops": [op.model_dump(exclude={"base_version"}) for op in ops],
+        })
+
+    async def close(self) -> None:
+        await self.ws.close()
+        if self.reader is not None:
+            await self.reader
+
+
+async def converge(base: str, token: str, clients: list[Client], timeout: float) -> tuple[int, int]:
+    """Wait for every replica to reach its document's final version; count documents that match it."""
+    by_doc: dict[str, list[Client]] = {}
+    for client in clients:
+        by_doc.setdefault(client.doc_id, []).append(client)
+    converged = 0
+    async with httpx.AsyncClient(base_url=base, timeout=60) as http:
+        for doc_id, replicas in by_doc.items():
+            response = await http.get(
+                f"/api/v1/docs/{doc_id}", headers={"Authorization": f"Bearer {token}"}
+            )
+            response.raise_for_status()
+            doc = response.json()
+            deadline = time.perf_counter() + timeout
+            while time.perf_counter() < deadline and any(
+                client.version < doc["version"] for client in replicas
+            ):
+                await asyncio.sleep(0.05)
+            if all(
+                client.version == doc["version"] and client.text == doc["content"]
+                for client in replicas
+            ):
+                converged += 1
+    return converged, len(by_doc)
+
+
+async def main(args: argparse.Namespace) -> int:
+    rng = random.Random(args.seed)
+    tokens, doc_ids = await provision(args.base, args.users, args.docs)
+    ws_base = args.base.replace("http", "ws", 1)
+    results = Results()
+    clients = []
+    for i in range(args.docs * args.clients):
+        doc_id = doc_ids[i % args.docs]
+        url = f"{ws_base}/ws/{doc_id}?token={tokens[i % len(tokens)]}&codec={args.codec}"
+        typist = Typist(args.pattern, random.Random(rng.random()))
+        clients.append(Client(url, doc_id, args.codec, typist, results))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client.connect() for client in clients))
+    print(f"connected {len(clients)} clients to {args.docs} documents in {time.perf_counter() - start:.2f}s")
+
+    cpu, start = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(client.type(args.ops, args.rate, args.batch_size) for client in clients))
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    converged, total = await converge(args.base, tokens[0], clients, args.converge_timeout)
+    await asyncio.gather(*(client.close() for client in clients))
+
+    report = {
+        "docs": args.docs,
+        "clients_per_doc": args.clients,
+        "pattern": args.pattern,
+        "codec": args.codec,
+        "ops": results.acked_ops,
+        "seconds": round(elapsed, 3),
+        "ops_per_sec": round(results.acked_ops / elapsed, 1),
+        "ack_ms": percentiles(results.ack_times),
+        "broadcast_ms": percentiles(results.broadcast_times()),
+        "resyncs": results.resyncs,
+        "errors": results.errors,
+        "converged_docs": converged,
+        "total_docs": total,
+        "client_cpu": round(cpu / elapsed, 2),
+    }
+    print(f"acked {report['ops']} ops in {elapsed:.2f}s -> {report['ops_per_sec']:.0f} ops/s")
+    print(f"  ack latency        {describe(report['ack_ms'])}")
+    print(f"  broadcast latency  {describe(report['broadcast_ms'])}")
+    print(f"  converged {converged}/{total} documents, {results.resyncs} resyncs")
+    for error, count in sorted(results.errors.items(), key=lambda item: -item[1]):
+        print(f"  {count} x {error}")
+    if report["client_cpu"] > 0.9:
+        print(f"  note: this client used {report['client_cpu']:.0%} of a core; it may be the bottleneck")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    if converged != total:
+        failures.append(f"{total - converged} documents did not converge")
+    if args.min_ops_per_sec and report["ops_per_sec"] < args.min_ops_per_sec:
+        failures.append(f"ops/s {report['ops_per_sec']} < {args.min_ops_per_sec}")
+    for name, limit in (("ack_ms", args.max_ack_p99), ("broadcast_ms", args.max_broadcast_p99)):
+        if limit and report[name].get("p99", 0) > limit:
+            failures.append(f"{name} p99 {report[name]['p99']} > {limit}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--base", default="http://127.0.0.1:8000")
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=5, help="clients per document")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--ops", type=int, default=200, help="ops per client")
+    parser.add_argument("--pattern", choices=PATTERNS, default="typing")
+    parser.add_argument("--batch-size", type=int, default=10, help="ops per message with --pattern batch")
+    parser.add_argument("--rate", type=float, default=0, help="ops/s per client; 0 = as fast as acks allow")
+    parser.add_argument("--codec", choices=("json", "binary"), default="json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--converge-timeout", type=float, default=10.0)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--min-ops-per-sec", type=float, default=0)
+    parser.add_argument("--max-ack-p99", type=float, default=0, help="ms")
+    parser.add_argument("--max-broadcast-p99", type=float, default=0, help="ms")
+    sys.exit(asyncio.run(main(parser.parse_args())))
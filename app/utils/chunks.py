@@ -0,0 +1,183 @@
+"""
+Layout of a document's stored content chunks, kept in step with its edits.
+
+Content is stored as ordered rows of about `chunk_size` characters
+(`document_chunks`). Chunk indices are spaced `GAP` apart, so a chunk that
+grows past twice the size is split into new rows between its neighbours
+without renumbering the rest; an edit therefore marks only the chunks it
+touches, and a flush rewrites just those. Only lengths are tracked here;
+the text of a changed chunk is sliced from the document when flushing.
+Running offsets are kept in a Fenwick tree, so finding the chunk an op
+lands in costs O(log n) rather than a pass over every chunk; only splits
+and removals, which come every chunk's worth of typing, rebuild it.
+"""
+from dataclasses import dataclass, field
+
+# Spacing of chunk indices; splits take indices from the gap after a chunk
+GAP = 1024
+
+
+@dataclass
+class ChunkChanges:
+    """Chunk rows to write (`index -> text`) and delete since the last flush."""
+    upserts: dict[int, str] = field(default_factory=dict)
+    deletes: set[int] = field(default_factory=set)
+    # Every stored chunk is replaced (first write, or indices were renumbered)
+    replace_all: bool = False
+
+    def __bool__(self) -> bool:
+        return bool(self.upserts or self.deletes or self.replace_all)
+
+
+class _PrefixSums:
+    """Fenwick tree over chunk lengths: O(log n) updates, prefix sums and offset lookups."""
+
+    def __init__(self, values: list[int]):
+        self.n = len(values)
+        self.tree = [0, *values]
+        for i in range(1, self.n + 1):
+            parent = i + (i & -i)
+            if parent <= self.n:
+                self.tree[parent] += self.tree[i]
+        self.top = 1 << (self.n.bit_length() - 1) if self.n else 0
+
+    def add(self, i: int, delta: int) -> None:
+        i += 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i: int) -> int:
+        """Sum of the first `i` values."""
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def count_upto(self, x: int) -> int:
+        """How many leading values sum to at most `x` (`bisect_right` on the running sums)."""
+        if x < 0:
+            return 0
+        k, step = 0, self.top
+        while step:
+            if k + step <= self.n and self.tree[k + step] <= x:
+                k += step
+                x -= self.tree[k]
+            step >>= 1
+        return k
+
+
+class ChunkLayout:
+    def __init__(self, chunk_size: int, chunks: list[tuple[int, int]] | None = None):
+        """`chunks`: the stored `(index, length)` pairs, in order."""
+        self.chunk_size = chunk_size
+        self.indices = [index for index, _ in chunks or ()]
+        self.lengths = [length for _, length in chunks or ()]
+        self._sums = _PrefixSums(self.lengths)
+        self.dirty: set[int] = set()
+        self.deleted: set[int] = set()
+        self.replace_all = False
+
+    @classmethod
+    def unstored(cls, chunk_size: int, length: int) -> "ChunkLayout":
+        """Layout for content that has no chunk rows yet; the first flush writes them all."""
+        layout = cls(chunk_size)
+        layout._renumber(layout._pieces(length))
+        return layout
+
+    def apply(self, position: int, delete_len: int, insert_len: int) -> None:
+        """Track an op applied to the content: delete at `position`, then insert there."""
+        if delete_len:
+            self._delete(position, delete_len)
+        if insert_len:
+            self._insert(position, insert_len)
+
+    def take_changes(self, content: str) -> ChunkChanges:
+        """What to write for `content` (the text this layout describes), marking it clean."""
+        changes = ChunkChanges(deletes=self.deleted, replace_all=self.replace_all)
+        start = 0
+        for index, length in zip(self.indices, self.lengths):
+            if self.replace_all or index in self.dirty:
+                changes.upserts[index] = content[start : start + length]
+            start += length
+        self.dirty, self.deleted, self.replace_all = set(), set(), False
+        return changes
+
+    def mark_unsaved(self) -> None:
+        """A write of changes failed; the next one replaces every stored chunk."""
+        self.replace_all = True
+
+    def _delete(self, position: int, count: int) -> None:
+        # The chunk the deletion starts in is the first one ending after `position`
+        i = self._sums.count_upto(position)
+        offset = position - self._sums.prefix(i)
+        first = i
+        while count > 0:
+            take = min(count, self.lengths[i] - offset)
+            self._resize(i, -take)
+            count -= take
+            offset = 0
+            i += 1
+        # Drop emptied chunks, then fold a shrunken chunk into the next one if they fit
+        removed = False
+        for j in range(i - 1, first - 1, -1):
+            if not self.lengths[j]:
+                self._remove(j)
+                removed = True
+        if first + 1 < len(self.lengths) and (
+            self.lengths[first] + self.lengths[first + 1] <= self.chunk_size
+        ):
+            self.lengths[first] += self.lengths[first + 1]
+            self.dirty.add(self.indices[first])
+            self._remove(first + 1)
+            removed = True
+        if removed:
+            self._sums = _PrefixSums(self.lengths)
+
+    def _insert(self, position: int, count: int) -> None:
+        if not self.lengths:
+            self._renumber([count])
+        else:
+            # Text at a boundary joins the chunk before it
+            i = min(self._sums.count_upto(position - 1), len(self.lengths) - 1)
+            self._resize(i, count)
+            if self.lengths[i] > 2 * self.chunk_size:
+                self._split(i)
+
+    def _resize(self, i: int, delta: int) -> None:
+        self.lengths[i] += delta
+        self._sums.add(i, delta)
+        self.dirty.add(self.indices[i])
+
+    def _split(self, i: int) -> None:
+        pieces = self._pieces(self.lengths[i])
+        start = self.indices[i]
+        end = self.indices[i + 1] if i + 1 < len(self.indices) else start + GAP * len(pieces)
+        step = (end - start) // len(pieces)
+        if step == 0:
+            # No room left in the gap
+            self.lengths[i : i + 1] = pieces
+            self._renumber(self.lengths)
+            return
+        new = [start + step * k for k in range(len(pieces))]
+        self.indices[i : i + 1] = new
+        self.lengths[i : i + 1] = pieces
+        self._sums = _PrefixSums(self.lengths)
+        self.dirty.update(new)
+
+    def _remove(self, i: int) -> None:
+        index = self.indices.pop(i)
+        del self.lengths[i]
+        self.dirty.discard(index)
+        self.deleted.add(index)
+
+    def _pieces(self, length: int) -> list[int]:
+        full, rest = divmod(length, self.chunk_size)
+        return [self.chunk_size] * full + ([rest] if rest else [])
+
+    def _renumber(self, lengths: list[int]) -> None:
+        self.lengths = list(lengths)
+        self._sums = _PrefixSums(self.lengths)
+        self.indices = [GAP * k for k in range(len(lengths))]
+        self.dirty, self.deleted, self.replace_all = set(), set(), True
@@ -0,0 +1,264 @@
+import asyncio
+import hashlib
+import time
+import uuid
+from bisect import bisect
+from typing import Iterable, List
+
+import redis.asyncio as aioredis
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from app.core.config import settings
+from app.db.session import engine
+from app.utils.document_state import document_states
+from app.utils.websocket import manager
+
+# Redis hash of node URL -> "<last heartbeat (unix time)> <process id>"
+MEMBERS_KEY = "cluster:nodes"
+# Redis key held by the process sequencing a document (value: its lease token)
+LEASE_KEY = "cluster:lease:{}"
+# Seconds between attempts to take a lease another process holds
+LEASE_POLL = 0.1
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hashing of document ids onto nodes, `replicas` points per node."""
+
+    def __init__(self, nodes: Iterable[str], replicas: int = 64):
+        self.nodes = tuple(sorted(set(nodes)))
+        points = sorted(
+            (_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas)
+        )
+        self._keys = [key for key, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, doc_id: str) -> str | None:
+        if not self._nodes:
+            return None
+        i = bisect(self._keys, _hash(doc_id)) % len(self._keys)
+        return self._nodes[i]
+
+
+class Cluster:
+    """
+    Which node owns (sequences and holds in memory) each document.
+
+    Nodes are identified by the base URL clients reach them at. Membership is
+    either the static `cluster_nodes` list, or, with the Redis bus, every node
+    that sent a heartbeat within `node_ttl` seconds. When membership changes,
+    documents this node no longer owns are handed off: flushed, then their
+    clients are redirected to the new owner.
+
+    With Redis, a process only sequences a document while it holds the
+    document's lease: taken before loading it, renewed with every heartbeat
+    while it is in memory or being handed off, and released once a handoff
+    has drained. The new owner waits for the lease, however long the old one
+    takes to drain; a process that finds its lease taken discards the
+    document. Without Redis, a node that gains a document waits
+    `handoff_grace` seconds after the change before loading it instead.
+
+    Every process holds a Postgres advisory lock on its `node_url` for as
+    long as it runs, so two processes (e.g. `uvicorn --workers`) can never
+    sequence documents as the same node; the second fails at startup.
+    """
+
+    def __init__(
+        self,
+        node_url: str,
+        static_nodes: List[str],
+        redis_url: str | None,
+        heartbeat_interval: float,
+        node_ttl: float,
+        handoff_grace: float,
+    ):
+        self.node_url = node_url
+        self.redis_url = redis_url
+        # Tells this process's heartbeats and leases apart from another using the same URL
+        self.process_id = uuid.uuid4().hex
+        self.token = f"{node_url} {self.process_id}"
+        self.heartbeat_interval = heartbeat_interval
+        self.node_ttl = node_ttl
+        self.handoff_grace = handoff_grace
+        self.redis = aioredis.from_url(redis_url) if node_url and redis_url else None
+        if self.redis is not None:
+            # Filled in by the first heartbeat; until then any document may be
+            # owned by another node, so every first load waits out the grace period.
+            self.ring = HashRing([])
+        else:
+            self.ring = HashRing([node_url, *static_nodes] if node_url else [])
+        self.previous_ring: HashRing | None = None
+        self.changed_at = 0.0
+        self.handoffs = 0
+        self.fenced = 0
+        self._handing_off: set[str] = set()
+        self._node_lock: Connection | None = None
+        self._heartbeat: asyncio.Task | None = None
+
+    def owner(self, doc_id: str) -> str | None:
+        """The URL of the node owning a document, or None if it is this one."""
+        owner = self.ring.owner(doc_id)
+        return None if owner in (None, self.node_url) else owner
+
+    async def claim(self, doc_id: str) -> None:
+        """Wait until this process may load and sequence a document it owns."""
+        if self.redis is None:
+            # No lease to wait for; give a previous owner time to notice and drain
+            if self.previous_ring is None:
+                return
+            remaining = self.changed_at + self.handoff_grace - time.monotonic()
+            if remaining > 0 and self.previous_ring.owner(doc_id) != self.node_url:
+                await asyncio.sleep(remaining)
+            return
+        key = LEASE_KEY.format(doc_id)
+        while not await self.redis.set(key, self.token, nx=True, px=self._lease_ms):
+            holder = await self.redis.get(key)
+            if holder is not None and holder.decode() == self.token:
+                return
+            await asyncio.sleep(LEASE_POLL)
+
+    async def start(self) -> None:
+        if self.redis_url and not self.node_url:
+            raise RuntimeError(
+                "pubsub_backend=redis needs node_url: without it every process sequences every document"
+            )
+        await asyncio.to_thread(self._lock_node)
+        if self.redis is not None:
+            await self._check_node_url()
+            await self._beat()
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self) -> None:
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+        if self.redis is not None:
+            await self.redis.hdel(MEMBERS_KEY, self.node_url)
+            # Called once everything is flushed, so the next owners can load at once
+            for doc_id in list(document_states.states):
+                await self._release(doc_id)
+            await self.redis.close()
+        if self._node_lock is not None:
+            self._node_lock.close()
+            self._node_lock = None
+
+    def _lock_node(self) -> None:
+        # Session-level advisory lock, held on a connection of its own until stop()
+        key = _hash(f"node:{self.node_url}") - 2**63
+        conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key}).scalar():
+            conn.close()
+            raise RuntimeError(
+                f"Another process is already running as node_url={self.node_url!r}; "
+                "give every worker process its own node_url"
+            )
+        self._node_lock = conn
+
+    async def _check_node_url(self) -> None:
+        seen = await self.redis.hget(MEMBERS_KEY, self.node_url)
+        if seen is None:
+            return
+        beat, _, process_id = seen.decode().partition(" ")
+        if process_id != self.process_id and time.time() - float(beat) <= self.node_ttl:
+            raise RuntimeError(
+                f"Another process is sending heartbeats as node_url={self.node_url!r}"
+            )
+
+    @property
+    def _lease_ms(self) -> int:
+        return int(self.node_ttl * 1000)
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self._beat()
+            except Exception as e:
+                print(f"Cluster heartbeat failed: {e}")
+
+    async def _beat(self) -> None:
+        now = time.time()
+        seen = await self.redis.hget(MEMBERS_KEY, self.node_url)
+        if seen is not None and seen.decode().partition(" ")[2] != self.process_id:
+            print(f"Another process is sending heartbeats as node_url={self.node_url!r}")
+        await self.redis.hset(MEMBERS_KEY, self.node_url, f"{now} {self.process_id}")
+        await self._renew_leases()
+        members = await self.redis.hgetall(MEMBERS_KEY)
+        live = [
+            node.decode()
+            for node, seen in members.items()
+            if now - float(seen.decode().partition(" ")[0]) <= self.node_ttl
+        ]
+        dead = [node for node in members if node.decode() not in live]
+        if dead:
+            await self.redis.hdel(MEMBERS_KEY, *dead)
+        if set(live) != set(self.ring.nodes):
+            self._set_members(live)
+
+    def _set_members(self, nodes: List[str]) -> None:
+        print(f"Cluster membership changed: {sorted(nodes)}")
+        self.previous_ring, self.ring = self.ring, HashRing(nodes)
+        self.changed_at = time.monotonic()
+        asyncio.create_task(self._hand_off_moved())
+
+    async def _renew_leases(self) -> None:
+        """Extend the leases of documents held here; discard those another process has taken."""
+        doc_ids = list({*document_states.states, *self._handing_off})
+        if not doc_ids:
+            return
+        keys = [LEASE_KEY.format(doc_id) for doc_id in doc_ids]
+        holders = await self.redis.mget(keys)
+        pipe = self.redis.pipeline(transaction=False)
+        for doc_id, key, holder in zip(doc_ids, keys, holders):
+            if holder is None:
+                # Lapsed (e.g. Redis was unreachable); take it back unless someone else did
+                pipe.set(key, self.token, nx=True, px=self._lease_ms)
+            elif holder.decode() == self.token:
+                pipe.pexpire(key, self._lease_ms)
+            else:
+                self.fenced += 1
+                print(f"Lease on document {doc_id} is held by {holder.decode()}; discarding it here")
+                document_states.discard(doc_id, "another process holds its lease")
+        await pipe.execute()
+
+    async def _release(self, doc_id: str) -> None:
+        key = LEASE_KEY.format(doc_id)
+        holder = await self.redis.get(key)
+        if holder is not None and holder.decode() == self.token:
+            await self.redis.delete(key)
+
+    async def _hand_off_moved(self) -> None:
+        for doc_id, state in list(document_states.states.items()):
+            owner = self.owner(doc_id)
+            if owner is None:
+                continue
+            self._handing_off.add(doc_id)
+            try:
+                await document_states.hand_off(state)
+                if self.redis is not None:
+                    # Everything is durable; the new owner may load it now
+                    await self._release(doc_id)
+            except Exception as e:
+                # The lease runs out on its own once it is no longer renewed
+                print(f"Error handing off document {doc_id}: {e}")
+            finally:
+                self._handing_off.discard(doc_id)
+            self.handoffs += 1
+            await manager.redirect(doc_id, redirect_url(owner, doc_id))
+
+
+def redirect_url(owner: str, doc_id: str) -> str:
+    return f"{owner}/ws/{doc_id}"
+
+
+cluster = Cluster(
+    settings.node_url,
+    [node.strip() for node in settings.cluster_nodes.split(",") if node.strip()],
+    settings.redis_url if settings.pubsub_backend == "redis" else None,
+    settings.cluster_heartbeat_interval,
+    settings.cluster_node_ttl,
+    settings.cluster_handoff_grace,
+)
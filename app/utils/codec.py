@@ -0,0 +1,311 @@
+import json
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Sequence, Tuple
+
+from app.db.schemas.operation import OperationIn
+from app.utils.simpleop import AppliedOp
+
+# Binary message types (first byte of every binary frame)
+MSG_OP = 1  # server: an op from another client; client: an op to apply
+MSG_ACK = 2  # server: your op, as applied
+MSG_CATCHUP = 3  # server: the ops you missed
+MSG_SYNC = 4  # client: send me the ops after my version
+MSG_BATCH = 5  # server: a batch of ops from another client; client: ops to apply as a unit
+MSG_BATCH_ACK = 6  # server: your batch, as applied
+MSG_INIT = 7  # server: the JSON `init` message, zlib-compressed (any codec, with init=compressed)
+
+# Server frames: type, version (`updated_version`, or the version after a catchup);
+# client sync and batch frames: type, version (`version` / `base_version`)
+_HEADER = struct.Struct("<Bq")
+# One op: id (-1 if not yet written), base_version, position, delete_len,
+# created_at (microseconds since the epoch), user id length, insert length
+# (-1 for no insert); followed by the UTF-8 user id and inserted text.
+_RECORD = struct.Struct("<qqqqqHi")
+_COUNT = struct.Struct("<I")
+# Client op: type, base_version, position, delete_len; followed by the UTF-8 inserted text
+_CLIENT_OP = struct.Struct("<Bqqq")
+# An op in a client batch: position, delete_len, insert length (-1 for no
+# insert); followed by the UTF-8 inserted text
+_CLIENT_BATCH_OP = struct.Struct("<qqi")
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def serialize_op(doc_id: str, op: AppliedOp) -> dict:
+    return {
+        "id": op.id,
+        "doc_id": doc_id,
+        "user_id": op.user_id,
+        "base_version": op.base_version,
+        "position": op.position,
+        "insert_text": op.insert_text,
+        "delete_len": op.delete_len,
+        "created_at": op.created_at.isoformat(),
+    }
+
+
+def encode_init(
+    content: str, version: int, codec: str, mode: str, chunk_chars: int, compress_level: int
+) -> List[str | bytes]:
+    """
+    The frames that give a new connection a document's content at `version`:
+    - "full": one JSON `init` frame with the content
+    - "chunked": an `init` header, then the content in `init_chunk` frames of
+      about `chunk_chars` characters
+    - "compressed": one binary frame, MSG_INIT followed by the "full" frame
+      compressed with zlib
+    """
+    if mode == "chunked":
+        starts = range(0, len(content), chunk_chars)
+        frames: List[str | bytes] = [json.dumps({
+            "type": "init",
+            "version": version,
+            "codec": codec,
+            "length": len(content),
+            "chunks": len(starts),
+        })]
+        frames.extend(
+            json.dumps({"type": "init_chunk", "index": index, "content": content[start : start + chunk_chars]})
+            for index, start in enumerate(starts)
+        )
+        return frames
+    frame = json.dumps({"type": "init", "content": content, "version": version, "codec": codec})
+    if mode == "compressed":
+        return [bytes([MSG_INIT]) + zlib.compress(frame.encode(), compress_level)]
+    return [frame]
+
+
+class JsonCodec:
+    """The original protocol: every message is a JSON text frame."""
+
+    name = "json"
+
+    def encode_op(self, kind: str, doc_id: str, op: AppliedOp, version: int) -> str:
+        return json.dumps({"type": kind, "op": serialize_op(doc_id, op), "updated_version": version})
+
+    def encode_batch(self, kind: str, doc_id: str, ops: Sequence[AppliedOp], version: int) -> str:
+        return json.dumps({
+            "type": kind,
+            "ops": [serialize_op(doc_id, op) for op in ops],
+            "updated_version": version,
+        })
+
+    def encode_catchup(self, doc_id: str, ops: Sequence[AppliedOp], version: int) -> str:
+        return json.dumps({
+            "type": "catchup",
+            "ops": [serialize_op(doc_id, op) for op in ops],
+            "version": version,
+        })
+
+    def decode(self, text: str | None, data: bytes | None) -> Tuple[str, Any]:
+        """
+        Parse a client message into ("op", OperationIn), ("batch", [OperationIn])
+        or ("sync", version).
+        """
+        if text is None:
+            raise ValueError("Expected a text frame")
+        message = json.loads(text)
+        kind = message.get("type")
+        if kind == "sync":
+            return "sync", int(message["version"])
+        if kind == "batch":
+            base_version = message["base_version"]
+            return "batch", [
+                OperationIn(**{**op, "base_version": base_version}) for op in message["ops"]
+            ]
+        return "op", OperationIn(**message)
+
+
+class BinaryCodec:
+    """
+    Compact protocol: ops, acks and catch-ups travel as binary frames laid out
+    with `struct` (little-endian, no keys, no document id, integer timestamps).
+    Control messages (init, sync_needed, error, redirect) stay JSON text frames.
+    """
+
+    name = "binary"
+
+    def encode_op(self, kind: str, doc_id: str, op: AppliedOp, version: int) -> bytes:
+        return _HEADER.pack(MSG_ACK if kind == "ack" else MSG_OP, version) + _pack_record(op)
+
+    def encode_batch(self, kind: str, doc_id: str, ops: Sequence[AppliedOp], version: int) -> bytes:
+        return self._encode_ops(MSG_BATCH_ACK if kind == "batch_ack" else MSG_BATCH, ops, version)
+
+    def encode_catchup(self, doc_id: str, ops: Sequence[AppliedOp], version: int) -> bytes:
+        return self._encode_ops(MSG_CATCHUP, ops, version)
+
+    @staticmethod
+    def _encode_ops(kind: int, ops: Sequence[AppliedOp], version: int) -> bytes:
+        parts = [_HEADER.pack(kind, version), _COUNT.pack(len(ops))]
+        parts.extend(_pack_record(op) for op in ops)
+        return b"".join(parts)
+
+    def decode(self, text: str | None, data: bytes | None) -> Tuple[str, Any]:
+        if data is None:
+            raise ValueError("Expected a binary frame")
+        kind = data[0]
+        if kind == MSG_SYNC:
+            return "sync", _HEADER.unpack_from(data)[1]
+        if kind == MSG_BATCH:
+            return "batch", self._decode_client_batch(data)
+        if kind != MSG_OP:
+            raise ValueError(f"Unknown message type {kind}")
+        _, base_version, position, delete_len = _CLIENT_OP.unpack_from(data)
+        insert_text = data[_CLIENT_OP.size :].decode() or None
+        # The layout already fixes every field's type
+        return "op", OperationIn.model_construct(
+            position=position,
+            insert_text=insert_text,
+            delete_len=delete_len,
+            base_version=base_version,
+        )
+
+    @staticmethod
+    def _decode_client_batch(data: bytes) -> List[OperationIn]:
+        base_version = _HEADER.unpack_from(data)[1]
+        (count,) = _COUNT.unpack_from(data, _HEADER.size)
+        offset = _HEADER.size + _COUNT.size
+        ops = []
+        for _ in range(count):
+            position, delete_len, insert_len = _CLIENT_BATCH_OP.unpack_from(data, offset)
+            offset += _CLIENT_BATCH_OP.size
+            insert_text = None
+            if insert_len >= 0:
+                insert_text = data[offset : offset + insert_len].decode() or None
+                offset += insert_len
+            ops.append(
+                OperationIn.model_construct(
+                    position=position,
+                    insert_text=insert_text,
+                    delete_len=delete_len,
+                    base_version=base_version,
+                )
+            )
+        if offset != len(data):
+            raise ValueError("Malformed batch")
+        return ops
+
+    def decode_op(self, data: bytes) -> Tuple[int, AppliedOp]:
+        """The (version, op) in an op or ack frame."""
+        version = _HEADER.unpack_from(data)[1]
+        return version, _unpack_record(data, _HEADER.size, version)[0]
+
+    def decode_ops(self, data: bytes) -> Tuple[int, List[AppliedOp]]:
+        """The (version, ops) in a catchup, batch or batch ack frame."""
+        version = _HEADER.unpack_from(data)[1]
+        (count,) = _COUNT.unpack_from(data, _HEADER.size)
+        offset = _HEADER.size + _COUNT.size
+        ops = []
+        # The ops are consecutive and end at `version`
+        for applied_version in range(version - count + 1, version + 1):
+            op, offset = _unpack_record(data, offset, applied_version)
+            ops.append(op)
+        return version, ops
+
+    @staticmethod
+    def encode_client_op(op: OperationIn) -> bytes:
+        """A client's op as it sends it (for clients written in Python, and benchmarks)."""
+        head = _CLIENT_OP.pack(MSG_OP, op.base_version, op.position, op.delete_len)
+        return head + (op.insert_text or "").encode()
+
+    @staticmethod
+    def encode_client_batch(ops: Sequence[OperationIn]) -> bytes:
+        """A client's batch; every op shares the first op's `base_version`."""
+        parts = [_HEADER.pack(MSG_BATCH, ops[0].base_version), _COUNT.pack(len(ops))]
+        for op in ops:
+            insert = op.insert_text.encode() if op.insert_text is not None else b""
+            insert_len = len(insert) if op.insert_text is not None else -1
+            parts.append(_CLIENT_BATCH_OP.pack(op.position, op.delete_len, insert_len) + insert)
+        return b"".join(parts)
+
+    @staticmethod
+    def encode_sync(version: int) -> bytes:
+        return _HEADER.pack(MSG_SYNC, version)
+
+
+def _pack_record(op: AppliedOp) -> bytes:
+    user_id = str(op.user_id).encode()
+    insert = op.insert_text.encode() if op.insert_text is not None else b""
+    head = _RECORD.pack(
+        op.id if op.id is not None else -1,
+        op.base_version,
+        op.position,
+        op.delete_len,
+        (op.created_at - _EPOCH) // _MICROSECOND,
+        len(user_id),
+        len(insert) if op.insert_text is not None else -1,
+    )
+    return head + user_id + insert
+
+
+def _unpack_record(data: bytes, offset: int, applied_version: int) -> Tuple[AppliedOp, int]:
+    op_id, base_version, position, delete_len, micros, user_len, insert_len = (
+        _RECORD.unpack_from(data, offset)
+    )
+    offset += _RECORD.size
+    user_id = data[offset : offset + user_len].decode()
+    offset += user_len
+    insert_text = None
+    if insert_len >= 0:
+        insert_text = data[offset : offset + insert_len].decode()
+        offset += insert_len
+    op = AppliedOp(
+        position=position,
+        insert_text=insert_text,
+        delete_len=delete_len,
+        user_id=user_id,
+        base_version=base_version,
+        applied_version=applied_version,
+        created_at=_EPOCH + micros * _MICROSECOND,
+        id=None if op_id < 0 else op_id,
+    )
+    return op, offset
+
+
+json_codec = JsonCodec()
+binary_codec = BinaryCodec()
+CODECS: Dict[str, JsonCodec | BinaryCodec] = {
+    codec.name: codec for codec in (json_codec, binary_codec)
+}
+
+
+class OpFrames:
+    """
+    Sequenced ops (one, or a client's batch) on their way to a document's
+    subscribers, encoded at most once per codec in use. Other nodes receive
+    the binary frame over the bus; the ops are only decoded there if one of
+    their clients speaks JSON.
+    """
+
+    def __init__(self, doc_id: str, ops: List[AppliedOp] | None, version: int):
+        self.doc_id = doc_id
+        self.ops = ops
+        self.version = version
+        self._encoded: Dict[str, str | bytes] = {}
+
+    @classmethod
+    def from_binary(cls, doc_id: str, data: bytes) -> "OpFrames":
+        frames = cls(doc_id, None, _HEADER.unpack_from(data)[1])
+        frames._encoded[binary_codec.name] = data
+        return frames
+
+    def frame(self, codec: JsonCodec | BinaryCodec) -> str | bytes:
+        encoded = self._encoded.get(codec.name)
+        if encoded is None:
+            if self.ops is None:
+                self.ops = self._decode(self._encoded[binary_codec.name])
+            if len(self.ops) == 1:
+                encoded = codec.encode_op("op", self.doc_id, self.ops[0], self.version)
+            else:
+                encoded = codec.encode_batch("batch", self.doc_id, self.ops, self.version)
+            self._encoded[codec.name] = encoded
+        return encoded
+
+    @staticmethod
+    def _decode(data: bytes) -> List[AppliedOp]:
+        if data[0] == MSG_OP:
+            return [binary_codec.decode_op(data)[1]]
+        return binary_codec.decode_ops(data)[1]
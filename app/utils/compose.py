@@ -0,0 +1,236 @@
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import islice
+from typing import Dict, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # composition is skipped and ops are transformed one by one
+    np = None
+
+from app.utils.transformation import PackedOp, transform_packed
+
+# Lower bound for positions; the first segment of every map starts here.
+_MIN_POSITION = -(2**62)
+
+# Block sizes for ComposedHistory; a 256-op block costs a few ms to build.
+BLOCK_SIZES = (32, 256)
+MAX_BLOCKS = 32
+
+
+class PositionMap:
+    """
+    Monotone map from positions before a run of ops to positions after it.
+
+    Stored as segments starting at `starts[k]`: inside segment k a position x
+    maps to `x + offsets[k]` when `slopes[k]` is 1, or to `offsets[k]` when it
+    is 0 (the position fell inside deleted text). `lows[k]` is where the
+    segment's first position maps to. Every op adds at most two segments and
+    updates the arrays in place; a lookup is one binary search.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.size = 1
+        self.starts = np.empty(capacity, dtype=np.int64)
+        self.slopes = np.empty(capacity, dtype=np.int64)
+        self.offsets = np.empty(capacity, dtype=np.int64)
+        self.lows = np.empty(capacity, dtype=np.int64)
+        self.starts[0], self.slopes[0], self.offsets[0], self.lows[0] = (
+            _MIN_POSITION, 1, 0, _MIN_POSITION
+        )
+        self._frozen: tuple[list, list, list] | None = None
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __call__(self, position: int) -> int:
+        if self._frozen is None:
+            # Maps are mostly queried once built; plain lists make lookups cheap.
+            self._frozen = (
+                self.starts[: self.size].tolist(),
+                self.slopes[: self.size].tolist(),
+                self.offsets[: self.size].tolist(),
+            )
+        starts, slopes, offsets = self._frozen
+        k = bisect_right(starts, position) - 1
+        return position * slopes[k] + offsets[k]
+
+    def shift(self, at: int, length: int, inclusive: bool) -> None:
+        """Positions mapping past `at` (or onto it, if `inclusive`) move right by `length`."""
+        self._frozen = None
+        k = self._split_at(at if inclusive else at + 1)
+        self.offsets[k : self.size] += length
+        self.lows[k : self.size] += length
+
+    def collapse(self, at: int, length: int) -> None:
+        """Positions mapping inside (at, at + length) move to `at`; later ones move left."""
+        self._frozen = None
+        k = self._split_at(at + 1)
+        end = self._split_at(at + length)
+        if end > k:
+            # Everything in between now maps to `at`: one constant segment
+            removed = end - k - 1
+            for array in (self.starts, self.slopes, self.offsets, self.lows):
+                array[k + 1 : self.size - removed] = array[end : self.size]
+            self.size -= removed
+            self.slopes[k] = 0
+            self.offsets[k] = self.lows[k] = at
+            end = k + 1
+        self.offsets[end : self.size] -= length
+        self.lows[end : self.size] -= length
+
+    def _split_at(self, image: int) -> int:
+        """
+        Index of the first segment whose positions all map to `image` or beyond,
+        splitting the segment that crosses `image` if needed.
+        """
+        k = int(np.searchsorted(self.lows[: self.size], image, side="left"))
+        if k and self.slopes[k - 1]:
+            split = image - int(self.offsets[k - 1])
+            if k == self.size or split < self.starts[k]:
+                self._insert(k, split, 1, int(self.offsets[k - 1]), image)
+        return k
+
+    def _insert(self, k: int, start: int, slope: int, offset: int, low: int) -> None:
+        if self.size == len(self.starts):
+            for name in ("starts", "slopes", "offsets", "lows"):
+                array = getattr(self, name)
+                setattr(self, name, np.concatenate([array, np.empty_like(array)]))
+        for array, value in (
+            (self.starts, start), (self.slopes, slope), (self.offsets, offset), (self.lows, low)
+        ):
+            array[k + 1 : self.size + 1] = array[k : self.size]
+            array[k] = value
+        self.size += 1
+
+
+class ComposedOps:
+    """
+    A run of consecutive ops folded into position maps, so an op is
+    transformed across the whole run with a lookup or two instead of one step
+    per op.
+
+    Follows `transform_packed` exactly:
+    - an insert goes through one map whose tie-breaks depend on its user id
+    - a delete maps its start and its end separately; this matches the
+      step-by-step result as long as part of the range survives, and
+      `transform` returns None for the ops it cannot answer exactly
+    Maps are built the first time an op needs them.
+    """
+
+    def __init__(self, ops: Sequence[PackedOp]):
+        self.ops = list(ops)
+        # transform_packed has no monotone equivalent for negative lengths
+        self.usable = all(a_ins >= 0 and a_del >= 0 for _, a_ins, a_del, _ in self.ops)
+        self._maps: Dict[Tuple[str, str], PositionMap] = {}
+
+    def transform(
+        self, position: int, delete_len: int, has_insert: bool, user_id: str | None
+    ) -> Tuple[int, int] | None:
+        """
+        Same result as `transform_packed` against `self.ops`, or None if this op
+        has to go through it (replaces, and deletes whose range was deleted).
+        """
+        if not self.usable or (has_insert and delete_len):
+            return None
+        if has_insert:
+            return self._map("insert", user_id or "")(position), delete_len
+        if delete_len <= 0:
+            return position, delete_len
+        start = self._map("start")(position)
+        end = self._map("end")(position + delete_len)
+        if end <= start:
+            return None
+        return start, end - start
+
+    def _map(self, kind: str, uid: str = "") -> PositionMap:
+        positions = self._maps.get((kind, uid))
+        if positions is None:
+            positions = PositionMap()
+            for a_pos, a_ins, a_del, a_uid in self.ops:
+                if a_del:
+                    positions.collapse(a_pos, a_del)
+                elif a_ins:
+                    # A delete's start moves past text inserted right at it, its
+                    # end does not; inserts tie-break on the smaller user id.
+                    if kind == "insert":
+                        inclusive = not uid < a_uid
+                    else:
+                        inclusive = kind == "start"
+                    positions.shift(a_pos, a_ins, inclusive)
+            self._maps[(kind, uid)] = positions
+        return positions
+
+
+class ComposedHistory:
+    """
+    A document's history composed in aligned blocks.
+
+    A block of size `n` (one of `block_sizes`) starting at version `v`, a
+    multiple of `n`, holds the ops applied after `v`. A stale op is walked
+    through its concurrent ops taking, at each version, the largest block
+    that starts there and fits, and stepping one op at a time where none does.
+    Blocks never change once their ops are applied, so they are shared by
+    every stale op on the document; the `max_blocks` most recently used are
+    kept.
+    """
+
+    def __init__(self, block_sizes: Sequence[int], max_blocks: int):
+        self.block_sizes = sorted(block_sizes, reverse=True)
+        self.max_blocks = max_blocks
+        self.blocks: OrderedDict[Tuple[int, int], ComposedOps] = OrderedDict()
+
+    def transform(
+        self,
+        position: int,
+        delete_len: int,
+        has_insert: bool,
+        user_id: str | None,
+        base_version: int,
+        concurrent_ops: Sequence[PackedOp],
+    ) -> Tuple[int, int]:
+        """
+        Same result as `transform_packed(position, delete_len, has_insert,
+        user_id, concurrent_ops)`, where `concurrent_ops` are the ops applied
+        after `base_version`.
+        """
+        smallest = self.block_sizes[-1]
+        count = len(concurrent_ops)
+        if np is None or (has_insert and delete_len) or count < 2 * smallest:
+            return transform_packed(position, delete_len, has_insert, user_id, concurrent_ops)
+
+        i = 0
+        while i < count:
+            version = base_version + i
+            size = next(
+                (n for n in self.block_sizes if version % n == 0 and count - i >= n), None
+            )
+            if size is None:
+                # Step to the next boundary of the smallest blocks
+                end = min(count, i + smallest - version % smallest)
+                result = None
+            else:
+                end = i + size
+                result = self._block(version, size, concurrent_ops, i).transform(
+                    position, delete_len, has_insert, user_id
+                )
+            if result is None:
+                result = transform_packed(
+                    position, delete_len, has_insert, user_id, islice(concurrent_ops, i, end)
+                )
+            position, delete_len = result
+            i = end
+        return position, delete_len
+
+    def _block(
+        self, version: int, size: int, concurrent_ops: Sequence[PackedOp], start: int
+    ) -> ComposedOps:
+        block = self.blocks.get((version, size))
+        if block is None:
+            block = ComposedOps(concurrent_ops[start : start + size])
+            self.blocks[(version, size)] = block
+            if len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last=False)
+        else:
+            self.blocks.move_to_end((version, size))
+        return block
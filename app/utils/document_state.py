@@ -0,0 +1,709 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Dict, List
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.crud.document import (
+    create_operations,
+    get_document,
+    get_document_chunks,
+    get_latest_snapshot,
+    get_operations_since,
+)
+from app.db.schemas.operation import OperationIn
+from app.db.session import AsyncSessionLocal
+from app.utils.compose import BLOCK_SIZES, MAX_BLOCKS, ComposedHistory
+from app.utils.helper import apply_operation_to_buffer
+from app.utils import metrics, tracing
+from app.utils.chunks import ChunkLayout
+from app.utils.codec import encode_init
+from app.utils.oplog import oplog, op_rows
+from app.utils.rope import Rope
+from app.utils.simpleop import AppliedOp
+from app.utils.transformation import (
+    BATCH_VECTOR_MIN,
+    PackedOp,
+    pack_op,
+    transform_packed,
+    transform_packed_batch,
+    transform_sequence,
+)
+from app.utils.websocket import manager
+
+# Rough per-op memory of the tail (AppliedOp, its packed tuple and timestamp)
+TAIL_OP_BYTES = 200
+
+
+class StaleBaseVersion(Exception):
+    """The ops between a client's version and the current one cannot be recovered."""
+
+
+class DocumentMoved(Exception):
+    """The document has been handed off to another node, which sequences its ops now."""
+
+
+class DocumentLost(Exception):
+    """The document's in-memory state was discarded (`DocumentStateManager.discard`)."""
+
+
+@dataclass
+class _Submission:
+    """An op waiting for its document's lock; resolves to `(applied op, durability future)`."""
+    op_in: OperationIn
+    user_id: str
+    future: asyncio.Future
+
+
+class DocumentState:
+    """
+    Authoritative in-process copy of a document being edited.
+
+    Ops for a document are sequenced under `lock`; Postgres only receives the
+    resulting op rows (through the write-behind `oplog`) and, periodically,
+    the content chunks it changed and checkpoint snapshots.
+    """
+
+    def __init__(
+        self,
+        doc_id: str,
+        content: str,
+        version: int,
+        tail_size: int,
+        chunks: ChunkLayout | None = None,
+    ):
+        self.doc_id = doc_id
+        self.buffer = Rope(content)
+        # How the content is split into stored chunks; without one, all are written on the first flush
+        self.chunks = chunks or ChunkLayout.unstored(settings.content_chunk_size, len(content))
+        self.version = version
+        self.tail: deque[AppliedOp] = deque(maxlen=tail_size)
+        # The same ops packed for the transform engine, kept in step with `tail`
+        self.packed_tail: deque[PackedOp] = deque(maxlen=tail_size)
+        # Composed blocks of history for ops based on old versions
+        self.composed = ComposedHistory(BLOCK_SIZES, MAX_BLOCKS)
+        self.lock = asyncio.Lock()
+        # Single ops waiting for the lock, sequenced together by the next holder
+        self.queued: List[_Submission] = []
+        self.flushed_version = version
+        self.snapshot_version = version
+        self.snapshot_at = time.monotonic()
+        self.refs = 0
+        self.moved = False
+        self.lost = False  # holds versions the op log failed to write
+        self.released_at = time.monotonic()
+        # Encoded init frames by (mode, codec), shared by every connect at `_init_version`
+        self._init_frames: Dict[tuple, List[str | bytes]] = {}
+        self._init_version = version
+
+    @property
+    def content(self) -> str:
+        """The current text; materialized from the buffer and cached until the next edit."""
+        return str(self.buffer)
+
+    @property
+    def dirty(self) -> bool:
+        return self.flushed_version != self.version
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held: one byte per character, the op tail and cached init frames."""
+        frames = sum(len(frame) for frames in self._init_frames.values() for frame in frames)
+        return len(self.buffer) + TAIL_OP_BYTES * len(self.tail) + frames
+
+    def init_frames(self, mode: str, codec: str) -> List[str | bytes]:
+        """
+        The frames bringing a new connection to the current version (see
+        `encode_init`), encoded once per version and shared by every connect.
+        """
+        if self._init_version != self.version:
+            self._init_frames.clear()
+            self._init_version = self.version
+        frames = self._init_frames.get((mode, codec))
+        if frames is not None:
+            metrics.INIT_FRAMES.labels("cached").inc()
+            return frames
+        content = self.content
+        # Never fill more than half a send queue, or the client would be resynced
+        chunk_chars = max(
+            settings.init_chunk_chars, -(-len(content) // max(1, settings.send_queue_size // 2))
+        )
+        frames = encode_init(
+            content, self.version, codec, mode, chunk_chars, settings.init_compress_level
+        )
+        self._init_frames[(mode, codec)] = frames
+        metrics.INIT_FRAMES.labels("built").inc()
+        return frames
+
+    def ops_since(self, base_version: int, packed: bool = False) -> List | None:
+        """
+        Ops applied after `base_version`, oldest first (as `PackedOp`s if `packed`).
+        Returns None when the tail no longer reaches back that far.
+        """
+        if base_version >= self.version:
+            return []
+        if not self.tail or self.tail[0].applied_version > base_version + 1:
+            return None
+        start = base_version + 1 - self.tail[0].applied_version
+        return list(islice(self.packed_tail if packed else self.tail, start, None))
+
+    def commit(self, op: AppliedOp) -> None:
+        """Apply an already-transformed op and advance the version."""
+        if op.delete_len or op.insert_text:
+            before = len(self.buffer)
+            apply_operation_to_buffer(self.buffer, op)
+            # The buffer clamps out-of-range ops; track what was actually changed
+            inserted = len(op.insert_text or "")
+            self.chunks.apply(
+                max(0, min(op.position, before)), before + inserted - len(self.buffer), inserted
+            )
+        self.version = op.applied_version
+        self.tail.append(op)
+        self.packed_tail.append(pack_op(op))
+
+
+class DocumentStateManager:
+    """
+    Resident document states, kept after their last connection leaves so a
+    reconnect to a hot document is served from memory. Idle documents (no
+    references and no connections) are evicted least recently used first
+    once there are more than `max_docs` of them or they hold more than
+    `max_bytes`, and after `idle_seconds` without a connection; dirty
+    content is flushed before a document is dropped.
+    """
+
+    def __init__(
+        self,
+        tail_size: int,
+        flush_interval: float,
+        snapshot_every_ops: int,
+        snapshot_every_seconds: float,
+        max_docs: int,
+        max_bytes: int,
+        idle_seconds: float,
+    ):
+        self.tail_size = tail_size
+        self.flush_interval = flush_interval
+        self.snapshot_every_ops = snapshot_every_ops
+        self.snapshot_every_seconds = snapshot_every_seconds
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds  # 0 = only evict over the limits
+        # Least recently acquired first
+        self.states: OrderedDict[str, DocumentState] = OrderedDict()
+        self._load_locks: Dict[str, asyncio.Lock] = {}
+        self._flusher: asyncio.Task | None = None
+        self._evicting = asyncio.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def peek(self, doc_id: str) -> DocumentState | None:
+        """Return the resident state for a document without loading it."""
+        return self.states.get(doc_id)
+
+    async def acquire(self, doc_id: str) -> DocumentState | None:
+        """Get (loading if needed) the state for a document and hold a reference to it."""
+        state = self.states.get(doc_id)
+        if state is None:
+            lock = self._load_locks.setdefault(doc_id, asyncio.Lock())
+            try:
+                async with lock:
+                    state = self.states.get(doc_id)
+                    if state is None:
+                        state = await self._run_db(self._load, doc_id)
+                        if state is None:
+                            return None
+                        self.states[doc_id] = state
+                        self.loads += 1
+                    else:
+                        self.hits += 1
+            finally:
+                self._load_locks.pop(doc_id, None)
+            self._ensure_flusher()
+        else:
+            self.hits += 1
+        self.states.move_to_end(doc_id)
+        state.refs += 1
+        if len(self.states) > self.max_docs:
+            await self.evict()
+        return state
+
+    async def release(self, state: DocumentState) -> None:
+        """Drop a reference; the last one out flushes the document, which stays cached."""
+        state.refs -= 1
+        if state.refs > 0:
+            return
+        state.released_at = time.monotonic()
+        try:
+            await self.flush(state)
+        except Exception as e:
+            print(f"Error flushing document {state.doc_id}: {e}")
+        await self.evict()
+
+    def _idle(self, state: DocumentState) -> bool:
+        return state.refs == 0 and not manager.active_connections.get(state.doc_id)
+
+    async def evict(self) -> None:
+        """Drop idle documents, least recently used first, until within the limits."""
+        if self._evicting.locked():
+            return  # Already running; it re-checks the limits as it goes
+        async with self._evicting:
+            now = time.monotonic()
+            total = sum(state.nbytes for state in self.states.values())
+            for state in list(self.states.values()):
+                over = len(self.states) > self.max_docs or total > self.max_bytes
+                expired = 0 < self.idle_seconds <= now - state.released_at
+                if not (over or expired) or not self._idle(state):
+                    continue
+                try:
+                    await self.flush(state)
+                except Exception as e:
+                    print(f"Error flushing document {state.doc_id}: {e}")
+                    continue
+                # Someone may have acquired the state while we were flushing.
+                if self._idle(state) and not state.dirty and self.states.get(state.doc_id) is state:
+                    del self.states[state.doc_id]
+                    total -= state.nbytes
+                    self.evictions += 1
+
+    def stats(self) -> dict:
+        states = list(self.states.values())
+        return {
+            "resident": len(states),
+            "active": sum(1 for state in states if state.refs),
+            "bytes": sum(state.nbytes for state in states),
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+    async def ops_since(self, state: DocumentState, version: int) -> List[AppliedOp] | None:
+        """
+        Ops a client at `version` is missing, from memory or the op log.
+        Returns None if they cannot be recovered.
+        """
+        async with state.lock:
+            return await self._ops_since(state, version)
+
+    async def _ops_since(
+        self, state: DocumentState, version: int, packed: bool = False
+    ) -> List | None:
+        # Caller holds state.lock
+        if version < 0 or version > state.version:
+            return None
+        ops = state.ops_since(version, packed)
+        if ops is None:
+            ops = await self._run_db(self._fetch_ops_since, state, version)
+            if ops is not None and packed:
+                ops = [pack_op(op) for op in ops]
+        return ops
+
+    async def submit(
+        self, state: DocumentState, op_in: OperationIn, user_id: str
+    ) -> AppliedOp:
+        """
+        Transform and apply an incoming op; returns the sequenced op once it is
+        as durable as `oplog.durability` requires.
+
+        Ops based on an older version are transformed against everything applied
+        since; raises StaleBaseVersion if that history cannot be recovered.
+        Ops that arrive while the document is busy wait in `state.queued`, and
+        whichever of them gets the lock first sequences them all together
+        (`_sequence_queued`).
+        """
+        submission = _Submission(op_in, user_id, asyncio.get_running_loop().create_future())
+        state.queued.append(submission)
+        waited = time.perf_counter()
+        try:
+            await state.lock.acquire()
+        except asyncio.CancelledError:
+            if submission in state.queued:
+                state.queued.remove(submission)
+            raise
+        try:
+            metrics.LOCK_WAIT.observe(time.perf_counter() - waited)
+            tracing.mark("lock")
+            if not submission.future.done():
+                await self._sequence_queued(state)
+        finally:
+            state.lock.release()
+        applied, written = await submission.future
+        if written is not None:
+            waited = time.perf_counter()
+            await written
+            metrics.DURABILITY_WAIT.observe(time.perf_counter() - waited)
+        tracing.mark("commit")
+        return applied
+
+    async def _sequence_queued(self, state: DocumentState) -> None:
+        """
+        Sequence every op waiting in `state.queued`, in arrival order; caller
+        holds state.lock. The ops come from different clients, so each one is
+        transformed against the history since its own base version (all in one
+        `transform_packed_batch` pass when there are many), then against the
+        ops of the group applied before it.
+        """
+        queued, state.queued = state.queued, []
+        try:
+            if state.moved:
+                raise DocumentMoved(state.doc_id)
+            if state.lost:
+                raise DocumentLost(state.doc_id)
+            await self._sequence(state, queued)
+        except Exception as e:
+            for submission in queued:
+                if not submission.future.done():
+                    submission.future.set_exception(e)
+        except BaseException:
+            for submission in queued:
+                submission.future.cancel()
+            raise
+
+    async def _sequence(self, state: DocumentState, queued: List["_Submission"]) -> None:
+        bases = [submission.op_in.base_version for submission in queued]
+        oldest = min(bases)
+        history = await self._ops_since(state, oldest, packed=True)
+        if history is None:
+            # Some bases are out of reach; find out which, one by one
+            histories = [await self._ops_since(state, base, packed=True) for base in bases]
+        else:
+            histories = [
+                history[base - oldest :] if base <= state.version else None for base in bases
+            ]
+        tracing.mark("concurrent")
+        group = []
+        for submission, concurrent_ops in zip(queued, histories):
+            if concurrent_ops is None:
+                submission.future.set_exception(
+                    StaleBaseVersion(
+                        f"Cannot transform from version {submission.op_in.base_version} "
+                        f"to {state.version}"
+                    )
+                )
+            else:
+                group.append((submission, concurrent_ops))
+                metrics.CONCURRENT_OPS.observe(len(concurrent_ops))
+        if not group:
+            return
+
+        started = time.perf_counter()
+        ops_in = [submission.op_in for submission, _ in group]
+        tie_ids = [getattr(op_in, "user_id", None) for op_in in ops_in]
+        if history is not None and len(group) >= BATCH_VECTOR_MIN:
+            positions, delete_lens = transform_packed_batch(
+                [op_in.position for op_in in ops_in],
+                [op_in.delete_len for op_in in ops_in],
+                [bool(op_in.insert_text) for op_in in ops_in],
+                tie_ids,
+                history,
+                [op_in.base_version - oldest for op_in in ops_in],
+            )
+            transformed = list(zip(positions, delete_lens))
+        else:
+            transformed = [
+                state.composed.transform(
+                    op_in.position,
+                    op_in.delete_len,
+                    bool(op_in.insert_text),
+                    tie_id,
+                    op_in.base_version,
+                    concurrent_ops,
+                )
+                for op_in, tie_id, (_, concurrent_ops) in zip(ops_in, tie_ids, group)
+            ]
+        created_at = datetime.now(timezone.utc)
+        applied: List[AppliedOp] = []
+        applied_packed: List[PackedOp] = []
+        for (submission, _), tie_id, (position, delete_len) in zip(group, tie_ids, transformed):
+            op_in = submission.op_in
+            if applied_packed:
+                # Applied after this op's base version too, so concurrent with it
+                position, delete_len = transform_packed(
+                    position, delete_len, bool(op_in.insert_text), tie_id, applied_packed
+                )
+            op = AppliedOp(
+                position=position,
+                insert_text=op_in.insert_text,
+                delete_len=delete_len,
+                user_id=submission.user_id,
+                base_version=op_in.base_version,
+                applied_version=state.version + 1 + len(applied),
+                created_at=created_at,
+            )
+            applied.append(op)
+            applied_packed.append(pack_op(op))
+        metrics.TRANSFORM_TIME.observe(time.perf_counter() - started)
+        tracing.mark("transform")
+
+        if oplog.durability == "commit":
+            # Only apply in memory once the op rows are written, all in one transaction
+            ids = await self._run_db(self._persist, state.doc_id, applied)
+            tracing.mark("commit")
+            for op, op_id in zip(applied, ids):
+                op.id = op_id
+                state.commit(op)
+            results = [(op, None) for op in applied]
+        else:
+            results = []
+            for op in applied:
+                state.commit(op)
+                # Queued under the lock so the log keeps the document's op order
+                results.append(
+                    (op, oplog.append(state.doc_id, op, wait=oplog.durability == "group"))
+                )
+        tracing.mark("apply")
+        if state.version - state.snapshot_version >= self.snapshot_every_ops:
+            self._snapshot(state)
+        for (submission, _), result in zip(group, results):
+            submission.future.set_result(result)
+
+    async def submit_batch(
+        self, state: DocumentState, ops_in: List[OperationIn], user_id: str
+    ) -> List[AppliedOp]:
+        """
+        Transform and apply a run of ops from one client as a unit: each op was
+        made on top of the ones before it, starting from the first op's base
+        version. They get consecutive versions and are written in one
+        transaction; returns them once that is as durable as
+        `oplog.durability` requires.
+        """
+        base_version = ops_in[0].base_version
+        waited = time.perf_counter()
+        async with state.lock:
+            metrics.LOCK_WAIT.observe(time.perf_counter() - waited)
+            tracing.mark("lock")
+            if state.moved:
+                raise DocumentMoved(state.doc_id)
+            if state.lost:
+                raise DocumentLost(state.doc_id)
+            concurrent_ops = await self._ops_since(state, base_version, packed=True)
+            tracing.mark("concurrent")
+            if concurrent_ops is None:
+                raise StaleBaseVersion(
+                    f"Cannot transform from version {base_version} to {state.version}"
+                )
+
+            started = time.perf_counter()
+            transformed = transform_sequence(
+                [
+                    (
+                        op_in.position,
+                        len(op_in.insert_text or ""),
+                        op_in.delete_len,
+                        getattr(op_in, "user_id", None) or "",
+                    )
+                    for op_in in ops_in
+                ],
+                concurrent_ops,
+            )
+            metrics.TRANSFORM_TIME.observe(time.perf_counter() - started)
+            metrics.CONCURRENT_OPS.observe(len(concurrent_ops))
+            tracing.mark("transform")
+            created_at = datetime.now(timezone.utc)
+            applied = [
+                AppliedOp(
+                    position=position,
+                    insert_text=op_in.insert_text,
+                    delete_len=delete_len,
+                    user_id=user_id,
+                    base_version=base_version,
+                    applied_version=state.version + 1 + i,
+                    created_at=created_at,
+                )
+                for i, (op_in, (position, delete_len)) in enumerate(zip(ops_in, transformed))
+            ]
+            if oplog.durability == "commit":
+                ids = await self._run_db(self._persist, state.doc_id, applied)
+                tracing.mark("commit")
+                for op, op_id in zip(applied, ids):
+                    op.id = op_id
+                    state.commit(op)
+                tracing.mark("apply")
+                if state.version - state.snapshot_version >= self.snapshot_every_ops:
+                    self._snapshot(state)
+                return applied
+
+            for op in applied:
+                state.commit(op)
+            tracing.mark("apply")
+            written = oplog.append_many(
+                state.doc_id, applied, wait=oplog.durability == "group"
+            )
+            if state.version - state.snapshot_version >= self.snapshot_every_ops:
+                self._snapshot(state)
+        if written is not None:
+            waited = time.perf_counter()
+            await written
+            metrics.DURABILITY_WAIT.observe(time.perf_counter() - waited)
+        tracing.mark("commit")
+        return applied
+
+    async def hand_off(self, state: DocumentState) -> None:
+        """
+        Stop sequencing a document here and make everything applied so far
+        durable, so the node taking it over loads the complete history.
+        Connections still holding the state get DocumentMoved for new ops.
+        """
+        async with state.lock:
+            state.moved = True
+        if self.states.get(state.doc_id) is state:
+            del self.states[state.doc_id]
+        await oplog.drain()
+        await self.flush(state)
+
+    def discard(self, doc_id: str, reason: str = "its ops could not be written") -> None:
+        """
+        Drop a document whose in-memory state must not reach Postgres: the op
+        log could not write its ops, or another process now sequences it. None
+        of it is flushed; its clients are disconnected and reload the stored
+        document on reconnect.
+        """
+        state = self.states.pop(doc_id, None)
+        if state is None:
+            return
+        state.lost = True
+        print(f"Discarding document {doc_id}: {reason}")
+        asyncio.create_task(
+            manager.reset(doc_id, f"Document reset ({reason}); reconnect to reload it")
+        )
+
+    async def flush(self, state: DocumentState) -> None:
+        """Write the content chunks a document's edits changed to Postgres."""
+        if not state.dirty or state.lost:
+            return
+        version = state.version
+        try:
+            await oplog.save_content(state.doc_id, state.chunks.take_changes(state.content), version)
+        except Exception:
+            state.chunks.mark_unsaved()
+            raise
+        state.flushed_version = max(state.flushed_version, version)
+
+    async def flush_all(self) -> None:
+        for state in list(self.states.values()):
+            if (
+                state.version > state.snapshot_version
+                and time.monotonic() - state.snapshot_at >= self.snapshot_every_seconds
+            ):
+                self._snapshot(state)
+            try:
+                await self.flush(state)
+            except Exception as e:
+                print(f"Error flushing document {state.doc_id}: {e}")
+
+    def _snapshot(self, state: DocumentState) -> None:
+        """Queue a checkpoint of the document's current content behind its ops."""
+        version = state.version
+        state.snapshot_version, state.snapshot_at = version, time.monotonic()
+        content = state.content
+        written = oplog.save_snapshot(
+            state.doc_id, content, state.chunks.take_changes(content), version
+        )
+
+        def done(future) -> None:
+            if future.exception() is not None:
+                state.chunks.mark_unsaved()
+                print(f"Error snapshotting document {state.doc_id}: {future.exception()}")
+            else:
+                state.flushed_version = max(state.flushed_version, version)
+
+        written.add_done_callback(done)
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while self.states:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_all()
+            await self.evict()
+
+    @staticmethod
+    async def _run_db(fn, *args):
+        """Run `fn(db, *args)` with a session on the async engine."""
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(fn, *args)
+
+    def _load(self, db: Session, doc_id: str) -> DocumentState | None:
+        doc = get_document(db, doc_id)
+        if not doc:
+            return None
+        version = doc.version or 0
+        stored = get_document_chunks(db, doc_id)
+        if stored:
+            content = "".join(text for _, text in stored)
+            chunks = ChunkLayout(
+                settings.content_chunk_size, [(index, len(text)) for index, text in stored]
+            )
+        else:
+            # Never edited: content is still inline; the first flush moves it into chunks
+            content, chunks = doc.content or "", None
+        snapshot = get_latest_snapshot(db, doc_id)
+        if snapshot is not None and snapshot.version > version:
+            content, version, chunks = snapshot.content, snapshot.version, None
+        state = DocumentState(doc_id, content, version, self.tail_size, chunks)
+        if snapshot is not None:
+            state.snapshot_version = snapshot.version
+        # The stored content may lag behind the op log; replay what it is missing.
+        for op in get_operations_since(db, doc_id, state.version):
+            state.commit(self._to_applied(op))
+        return state
+
+    def _fetch_ops_since(
+        self, db: Session, state: DocumentState, version: int
+    ) -> List[AppliedOp] | None:
+        stored = get_operations_since(db, state.doc_id, version)
+        # The newest ops may still be queued in the op log; take those from the tail.
+        tail = list(state.tail)
+        tail_start = tail[0].applied_version if tail else state.version + 1
+        ops = [self._to_applied(op) for op in stored if op.applied_version < tail_start]
+        ops.extend(tail)
+        # A gap means ops older than the tail are still queued for the log
+        if len(ops) != state.version - version:
+            return None
+        return ops
+
+    @staticmethod
+    def _persist(db: Session, doc_id: str, ops: List[AppliedOp]) -> List[int]:
+        """Write op rows in one transaction; returns their ids."""
+        started = time.perf_counter()
+        try:
+            ids = create_operations(db, op_rows(doc_id, ops))
+            db.commit()
+            metrics.COMMIT_TIME.labels("direct").observe(time.perf_counter() - started)
+            return ids
+        except Exception:
+            db.rollback()
+            raise
+
+    @staticmethod
+    def _to_applied(op) -> AppliedOp:
+        return AppliedOp(
+            position=op.position,
+            insert_text=op.insert_text,
+            delete_len=op.delete_len or 0,
+            user_id=op.user_id,
+            base_version=op.base_version,
+            applied_version=op.applied_version,
+            created_at=op.created_at,
+            id=op.id,
+        )
+
+
+document_states = DocumentStateManager(
+    settings.document_tail_size,
+    settings.document_flush_interval,
+    settings.snapshot_every_ops,
+    settings.snapshot_every_seconds,
+    settings.document_cache_max_docs,
+    settings.document_cache_max_bytes,
+    settings.document_cache_idle_seconds,
+)
+oplog.on_lost = document_states.discard
@@ -1,19 +1,18 @@
 from app.db.schemas.operation import OperationIn
+from app.utils.rope import Rope
 
 
 def apply_operation(content: str, operation: OperationIn):
-    new_content = content
     position = max(0, min(operation.position, len(content)))
-    if operation.insert_text is not None:
-        new_content = content[:position] + operation.insert_text + content[position:]
-        
-    if operation.delete_len or 0 and operation.delete_len > 0:
-        delete_end = min(position + operation.delete_len, len(content))
-        new_content = content[:position] + content[delete_end:]
-        
-    return new_content
-
-
-
+    delete_end = min(position + (operation.delete_len or 0), len(content))
+    # A delete and an insert at the same position form a replace
+    return content[:position] + (operation.insert_text or "") + content[delete_end:]
 
 
+def apply_operation_to_buffer(buffer: Rope, operation: OperationIn) -> None:
+    """Apply an operation to a Rope in place, with the same semantics as `apply_operation`."""
+    position = max(0, min(operation.position, len(buffer)))
+    if operation.delete_len:
+        buffer.delete(position, operation.delete_len)
+    if operation.insert_text:
+        buffer.insert(position, operation.insert_text)
@@ -0,0 +1,113 @@
+import difflib
+from collections import OrderedDict
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.crud.document import get_latest_snapshot, get_operations_between
+from app.utils.helper import apply_operation_to_buffer
+from app.utils.rope import Rope
+
+
+class HistoryCache:
+    """
+    Recently rebuilt `(doc_id, version) -> content`, least recently used
+    evicted first once the cached text exceeds `max_chars`. A past version
+    never changes, so entries need no invalidation, and a cached version is
+    also a closer starting point than the snapshot for rebuilding the ones
+    after it.
+    """
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self.chars = 0
+        self._entries: OrderedDict[tuple[str, int], str] = OrderedDict()
+        self._versions: dict[str, set[int]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, doc_id: str, version: int) -> str | None:
+        content = self._entries.get((doc_id, version))
+        if content is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end((doc_id, version))
+        self.hits += 1
+        return content
+
+    def nearest(self, doc_id: str, version: int) -> tuple[int, str] | None:
+        """The newest cached version of `doc_id` at or below `version`."""
+        below = [v for v in self._versions.get(doc_id, ()) if v <= version]
+        if not below:
+            return None
+        nearest = max(below)
+        self._entries.move_to_end((doc_id, nearest))
+        return nearest, self._entries[(doc_id, nearest)]
+
+    def put(self, doc_id: str, version: int, content: str) -> None:
+        if len(content) > self.max_chars or (doc_id, version) in self._entries:
+            return
+        self._entries[(doc_id, version)] = content
+        self._versions.setdefault(doc_id, set()).add(version)
+        self.chars += len(content)
+        while self.chars > self.max_chars:
+            (old_doc, old_version), old = self._entries.popitem(last=False)
+            self.chars -= len(old)
+            versions = self._versions[old_doc]
+            versions.discard(old_version)
+            if not versions:
+                del self._versions[old_doc]
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "chars": self.chars,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+history_cache = HistoryCache(settings.history_cache_chars)
+
+
+def rebuild_document(db: Session, doc_id: str, version: int) -> str | None:
+    """
+    Content of a document as it was at `version`, replaying only the ops after
+    the nearest snapshot (or cached rebuild) at or below it.
+
+    Returns None when the version cannot be rebuilt: no snapshot reaches back
+    that far, or some of the ops up to `version` are not (yet) in the log.
+    """
+    content = history_cache.get(doc_id, version)
+    if content is not None:
+        return content
+    snapshot = get_latest_snapshot(db, doc_id, max_version=version)
+    if snapshot is None:
+        return None
+    start, content = snapshot.version, snapshot.content
+    cached = history_cache.nearest(doc_id, version)
+    if cached is not None and cached[0] > start:
+        start, content = cached
+    ops = get_operations_between(db, doc_id, start, version)
+    if sum(op.version_count or 1 for op in ops) != version - start:
+        return None
+    buffer = Rope(content)
+    for op in ops:
+        apply_operation_to_buffer(buffer, op)
+    content = str(buffer)
+    history_cache.put(doc_id, version, content)
+    return content
+
+
+def diff_versions(old: str, new: str, old_version: int, new_version: int) -> str:
+    """Unified line diff between two versions of a document's content."""
+    lines = difflib.unified_diff(
+        old.splitlines(keepends=True),
+        new.splitlines(keepends=True),
+        fromfile=f"v{old_version}",
+        tofile=f"v{new_version}",
+    )
+    return "".join(
+        line if line.endswith("\n") else line + "\n\\ No newline at end of file\n"
+        for line in lines
+    )
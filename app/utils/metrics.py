@@ -0,0 +1,215 @@
+"""
+Process metrics in the Prometheus text format, served at `/metrics`.
+
+A small registry of counters, histograms and gauges with the same call
+shape as `prometheus_client` (`METRIC.labels(...).inc()`, `.observe(...)`).
+Hot-path instruments are defined here and updated in place; gauges that
+read state owned elsewhere (connections, pools, queues) take a `collect`
+callback that runs at scrape time, so they cost nothing between scrapes.
+"""
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Seconds; from sub-millisecond transforms to multi-second stalls
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._children: Dict[LabelValues, object] = {}
+        registry.append(self)
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _label_text(self, values: LabelValues, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(self.label_names, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class _Simple(Metric):
+    """
+    One number per label set. With `collect`, values are read at scrape time
+    from a callback returning `(label_values, value)` pairs instead.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        collect: Callable[[], Iterable[Tuple[LabelValues, float]]] | None = None,
+    ):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def _samples(self) -> Iterable[str]:
+        if self.collect is not None:
+            pairs = self.collect()
+        else:
+            pairs = ((values, child.value) for values, child in self._children.items())
+        for values, value in pairs:
+            yield f"{self.name}{self._label_text(values)} {_number(value)}"
+
+
+class Counter(_Simple):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(_Simple):
+    kind = "gauge"
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _Histogram:
+        return _Histogram(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self) -> Iterable[str]:
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = 'le="' + ("+Inf" if bound == float("inf") else _number(bound)) + '"'
+                yield f"{self.name}_bucket{self._label_text(values, le)} {cumulative}"
+            yield f"{self.name}_sum{self._label_text(values)} {_number(child.sum)}"
+            yield f"{self.name}_count{self._label_text(values)} {child.count}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+registry: List[Metric] = []
+
+
+def render() -> str:
+    """Every registered metric, in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Realtime hot path
+OPS_ACCEPTED = Counter("collab_ops_accepted_total", "Ops sequenced and applied.")
+OPS_REJECTED = Counter(
+    "collab_ops_rejected_total",
+    "Incoming messages that did not become ops, by reason (invalid, stale, moved, lost, error).",
+    ["reason"],
+)
+SYNC_NEEDED = Counter(
+    "collab_sync_needed_total",
+    "Clients sent the full content instead of ops, by cause (stale, catchup, slow_consumer).",
+    ["cause"],
+)
+LOCK_WAIT = Histogram("collab_lock_wait_seconds", "Time an op waited for its document's lock.")
+CONCURRENT_OPS = Histogram(
+    "collab_transform_concurrent_ops",
+    "Concurrent ops each incoming op (or batch) was transformed against.",
+    buckets=COUNT_BUCKETS,
+)
+TRANSFORM_TIME = Histogram("collab_transform_seconds", "Time spent transforming an op or batch.")
+COMMIT_TIME = Histogram(
+    "collab_commit_seconds",
+    "Database write and commit time, by path (oplog group commit, or direct for commit durability).",
+    ["path"],
+)
+DURABILITY_WAIT = Histogram(
+    "collab_durability_wait_seconds",
+    "Time from sequencing an op until it was durable enough to ack (group durability).",
+)
+BROADCAST_TIME = Histogram(
+    "collab_broadcast_seconds", "Time to encode, queue and publish an op's broadcast."
+)
+BROADCAST_RECIPIENTS = Histogram(
+    "collab_broadcast_recipients",
+    "Local connections each broadcast was queued for.",
+    buckets=COUNT_BUCKETS,
+)
+INIT_FRAMES = Counter(
+    "collab_init_frames_total",
+    "Init payloads sent to new connections, by whether they were encoded for it or reused.",
+    ["result"],
+)
@@ -0,0 +1,397 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.crud.document import (
+    create_operations,
+    create_snapshot,
+    save_document_chunks,
+)
+from app.db.session import AsyncSessionLocal
+from app.utils import metrics
+from app.utils.chunks import ChunkChanges
+from app.utils.simpleop import AppliedOp
+
+# How many times a failed batch is retried before rows are written one by one
+WRITE_ATTEMPTS = 3
+
+
+def op_rows(doc_id: str, ops: list[AppliedOp]) -> list[dict]:
+    """`create_operations` rows for a document's sequenced ops."""
+    return [
+        {
+            "document_id": doc_id,
+            "user_id": op.user_id,
+            "base_version": op.base_version,
+            "position": op.position,
+            "insert_text": op.insert_text,
+            "delete_len": op.delete_len,
+            "applied_version": op.applied_version,
+            "version_count": 1,
+            "created_at": op.created_at,
+        }
+        for op in ops
+    ]
+
+
+def _typing_kind(op: AppliedOp) -> str | None:
+    """The kind of run `op` can be part of: one character inserted, or one deleted (backspace)."""
+    if op.insert_text and len(op.insert_text) == 1 and not op.delete_len:
+        return "insert"
+    if not op.insert_text and op.delete_len == 1:
+        return "backspace"
+    return None
+
+
+@dataclass
+class _Run:
+    """
+    Ops that can go in one op row: a run of characters typed left to right,
+    or of backspaces, by one user. `row` holds the row as it stands.
+    """
+    row: dict
+    kind: str | None
+    ops: list[AppliedOp]
+
+    @classmethod
+    def start(cls, doc_id: str, op: AppliedOp) -> "_Run":
+        return cls(row=op_rows(doc_id, [op])[0], kind=_typing_kind(op), ops=[op])
+
+    def extend(self, op: AppliedOp, window: timedelta, max_ops: int) -> bool:
+        """Fold `op` into the row if it continues the run; False if it starts a new row."""
+        row = self.row
+        if (
+            self.kind is None
+            or _typing_kind(op) != self.kind
+            or op.user_id != row["user_id"]
+            or op.applied_version != row["applied_version"] + 1
+            or op.created_at - row["created_at"] > window
+            or row["version_count"] >= max_ops
+        ):
+            return False
+        if self.kind == "insert":
+            if op.position != row["position"] + len(row["insert_text"]):
+                return False
+            row["insert_text"] += op.insert_text
+        else:
+            if op.position != row["position"] - 1:
+                return False
+            row["position"] = op.position
+            row["delete_len"] += 1
+        row["applied_version"] = op.applied_version
+        row["version_count"] += 1
+        row["created_at"] = op.created_at
+        self.ops.append(op)
+        return True
+
+
+@dataclass
+class _Entry:
+    """
+    One queued write: op rows (always written in the same transaction), the
+    content chunks a document's edits changed (optionally with the full
+    content kept as a snapshot), or (with neither) a barrier that completes
+    once everything queued before it is durable.
+    """
+    doc_id: str | None = None
+    ops: list[AppliedOp] = field(default_factory=list)
+    chunks: ChunkChanges | None = None
+    content: str | None = None  # for the snapshot
+    version: int | None = None
+    snapshot: bool = False
+    future: asyncio.Future | None = None
+
+    def rows(self) -> list[dict]:
+        return op_rows(self.doc_id, self.ops)
+
+
+class OpLogWriter:
+    """
+    Write-behind log for accepted operations.
+
+    Ops from every connection and document are queued in sequence order and
+    written by a single background task: each round waits `flush_interval`
+    seconds for more work, then writes up to `max_batch` entries as one
+    multi-row INSERT in one transaction (group commit).
+
+    Consecutive typing is coalesced: a one-character insert right after the
+    previous one, or a backspace right before it, by the same user within
+    `coalesce_window` seconds of their last op, goes in that op's row instead
+    of a new one, up to `coalesce_max` versions per row. Rows are only ever
+    inserted, never updated:
+    - with "immediate" durability the open run of each document is held in
+      memory and queued as one entry once it closes (an op that does not
+      continue it, `coalesce_max`, `coalesce_window` without a keystroke, a
+      content save or a `drain`). Those ops were acknowledged already; a crash
+      loses up to `coalesce_window` of them instead of one flush interval.
+    - otherwise runs are only formed within one batch, so a row covers the
+      keystrokes that arrived within one group commit.
+    Ops are still sequenced, acknowledged and broadcast one version at a time,
+    and readers split coalesced rows back into one-version ops
+    (`split_operation`), so this saves rows, index entries and WAL per
+    keystroke but not the work of reading or transforming them. Every op in
+    a run gets the row's id.
+
+    `durability` decides when an op is acknowledged to its sender:
+    - "commit": after its own transaction (the writer is bypassed for op rows)
+    - "group": after the group commit that contains it
+    - "immediate": as soon as it is applied in memory; a crash can lose
+      acknowledged ops that were still queued
+    """
+
+    def __init__(
+        self,
+        durability: str,
+        flush_interval: float,
+        max_batch: int,
+        coalesce_window: float = 0,
+        coalesce_max: int = 1,
+    ):
+        self.durability = durability
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.coalesce_window = timedelta(seconds=coalesce_window)
+        self.coalesce_max = coalesce_max
+        self.batches_written = 0
+        self.ops_written = 0
+        self.rows_written = 0  # rows inserted; coalesced ops add none
+        self._open: dict[str, _Run] = {}  # document id -> its run held in memory
+        # Called with a document id once its ops could not be written
+        self.on_lost: Callable[[str], None] | None = None
+        self._pending: deque[_Entry] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def depth(self) -> int:
+        """Entries waiting to be written."""
+        return len(self._pending)
+
+    @property
+    def held(self) -> int:
+        """Ops held in open runs, not queued yet."""
+        return sum(len(run.ops) for run in self._open.values())
+
+    def append(self, doc_id: str, op: AppliedOp, wait: bool = True) -> asyncio.Future | None:
+        """
+        Queue an op row. With `wait`, returns a future that resolves to the row id
+        once it is committed; `op.id` is filled in either way.
+        """
+        if self.durability == "immediate" and self.coalesce_window and not wait:
+            self._hold(doc_id, op)
+            return None
+        self._close(doc_id)
+        return self._enqueue(_Entry(doc_id=doc_id, ops=[op]), wait)
+
+    def append_many(
+        self, doc_id: str, ops: list[AppliedOp], wait: bool = True
+    ) -> asyncio.Future | None:
+        """
+        Queue op rows that must be written together, in one transaction. With
+        `wait`, returns a future that resolves to the last row id once they are
+        committed.
+        """
+        self._close(doc_id)
+        return self._enqueue(_Entry(doc_id=doc_id, ops=list(ops)), wait)
+
+    def save_content(self, doc_id: str, chunks: ChunkChanges, version: int) -> asyncio.Future:
+        """
+        Queue the content chunks changed up to `version`. They are written in
+        the same transaction as, or after, every op queued before them, so
+        stored content never runs ahead of the op log; changes to one document
+        are written in the order they were queued.
+        """
+        self._close(doc_id)
+        return self._enqueue(_Entry(doc_id=doc_id, chunks=chunks, version=version), True)
+
+    def save_snapshot(
+        self, doc_id: str, content: str, chunks: ChunkChanges, version: int
+    ) -> asyncio.Future:
+        """Like `save_content`, but also keeps the full content as a checkpoint for replays."""
+        self._close(doc_id)
+        return self._enqueue(
+            _Entry(doc_id=doc_id, chunks=chunks, content=content, version=version, snapshot=True),
+            True,
+        )
+
+    async def drain(self) -> None:
+        """Wait until everything queued or held so far has been written."""
+        for doc_id in list(self._open):
+            self._close(doc_id)
+        if self._pending:
+            await self._enqueue(_Entry(), True)
+
+    async def close(self) -> None:
+        await self.drain()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _hold(self, doc_id: str, op: AppliedOp) -> None:
+        """Add `op` to the document's open run, or close that run and start one."""
+        run = self._open.get(doc_id)
+        if run is None or not run.extend(op, self.coalesce_window, self.coalesce_max):
+            self._close(doc_id)
+            run = _Run.start(doc_id, op)
+            if run.kind is None:
+                self._enqueue(_Entry(doc_id=doc_id, ops=[op]), False)
+                return
+            self._open[doc_id] = run
+            asyncio.get_running_loop().call_later(
+                self.coalesce_window.total_seconds(), self._expire, doc_id, run
+            )
+        if run.row["version_count"] >= self.coalesce_max:
+            self._close(doc_id)
+
+    def _expire(self, doc_id: str, run: _Run) -> None:
+        """Close `run` once `coalesce_window` has passed since its last op."""
+        if self._open.get(doc_id) is not run:
+            return
+        left = run.row["created_at"] + self.coalesce_window - datetime.now(timezone.utc)
+        if left.total_seconds() > 0:
+            asyncio.get_running_loop().call_later(left.total_seconds(), self._expire, doc_id, run)
+        else:
+            self._close(doc_id)
+
+    def _close(self, doc_id: str) -> None:
+        """Queue the document's open run, if any, as one entry."""
+        run = self._open.pop(doc_id, None)
+        if run is not None:
+            self._enqueue(_Entry(doc_id=doc_id, ops=run.ops), False)
+
+    def _enqueue(self, entry: _Entry, wait: bool) -> asyncio.Future | None:
+        if wait:
+            entry.future = asyncio.get_running_loop().create_future()
+        self._pending.append(entry)
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return entry.future
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            if self.flush_interval:
+                # Let more ops pile up so they share one commit
+                await asyncio.sleep(self.flush_interval)
+            while self._pending:
+                # Up to `max_batch` rows, never splitting an entry
+                batch, rows = [], 0
+                while self._pending and (
+                    not batch or rows + max(1, len(self._pending[0].ops)) <= self.max_batch
+                ):
+                    entry = self._pending.popleft()
+                    batch.append(entry)
+                    rows += max(1, len(entry.ops))
+                await self._write_batch(batch)
+            self._wakeup.clear()
+
+    async def _write_batch(self, batch: list[_Entry]) -> None:
+        for attempt in range(WRITE_ATTEMPTS):
+            try:
+                await self._write_async(batch)
+                self._complete(batch)
+                return
+            except Exception as e:
+                print(f"Op log batch of {len(batch)} failed (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(0.05 * 2**attempt)
+        # Isolate the rows that cannot be written so the rest of the batch is not lost
+        lost: dict[str, Exception] = {}
+        for entry in batch:
+            if entry.doc_id in lost:
+                # Written after a missing version, it would leave a gap in the log
+                self._fail(entry, lost[entry.doc_id])
+                continue
+            try:
+                await self._write_async([entry])
+                self._complete([entry])
+            except Exception as e:
+                print(f"Dropping op log entry for document {entry.doc_id}: {e}")
+                if entry.ops:
+                    lost[entry.doc_id] = e
+                    self._lose(entry.doc_id, e)
+                self._fail(entry, e)
+
+    def _lose(self, doc_id: str, error: Exception) -> None:
+        """
+        A document's ops could not be written: drop everything else queued for
+        it, and have its owner discard the versions the log will never have
+        before anyone is told the write failed.
+        """
+        for entry in [entry for entry in self._pending if entry.doc_id == doc_id]:
+            self._pending.remove(entry)
+            self._fail(entry, error)
+        self._open.pop(doc_id, None)
+        if self.on_lost is not None:
+            self.on_lost(doc_id)
+
+    @staticmethod
+    def _fail(entry: _Entry, error: Exception) -> None:
+        if entry.future is not None and not entry.future.done():
+            entry.future.set_exception(error)
+
+    async def _write_async(self, batch: list[_Entry]) -> None:
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            await db.run_sync(self._write, batch)
+        metrics.COMMIT_TIME.labels("oplog").observe(time.perf_counter() - started)
+
+    def _write(self, db: Session, batch: list[_Entry]) -> None:
+        runs: dict[str, _Run] = {}  # document id -> its last run in this batch
+        new_runs: list[_Run] = []
+        for entry in batch:
+            for op in entry.ops:
+                run = runs.get(entry.doc_id)
+                if run is None or not (
+                    self.coalesce_window
+                    and run.extend(op, self.coalesce_window, self.coalesce_max)
+                ):
+                    run = _Run.start(entry.doc_id, op)
+                    runs[entry.doc_id] = run
+                    new_runs.append(run)
+        try:
+            ids = create_operations(db, [run.row for run in new_runs])
+            for entry in batch:
+                if entry.snapshot:
+                    create_snapshot(db, entry.doc_id, entry.version, entry.content)
+                if entry.chunks is not None:
+                    # Each entry holds only the chunks changed since the one before
+                    save_document_chunks(
+                        db,
+                        entry.doc_id,
+                        entry.version,
+                        entry.chunks.upserts,
+                        entry.chunks.deletes,
+                        entry.chunks.replace_all,
+                    )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        self.rows_written += len(new_runs)
+        for run, op_id in zip(new_runs, ids):
+            for op in run.ops:
+                op.id = op_id
+
+    def _complete(self, batch: list[_Entry]) -> None:
+        self.batches_written += 1
+        for entry in batch:
+            self.ops_written += len(entry.ops)
+            if entry.future is not None and not entry.future.done():
+                entry.future.set_result(entry.ops[-1].id if entry.ops else None)
+
+
+oplog = OpLogWriter(
+    settings.oplog_durability,
+    settings.oplog_flush_interval,
+    settings.oplog_max_batch,
+    settings.oplog_coalesce_window,
+    settings.oplog_coalesce_max,
+)
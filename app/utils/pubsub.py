@@ -0,0 +1,145 @@
+import asyncio
+import uuid
+from abc import ABC, abstractmethod
+from typing import Callable, Dict
+
+import redis.asyncio as aioredis
+
+# Called with each frame published to a channel by another node
+Handler = Callable[[bytes], None]
+
+
+class PubSub(ABC):
+    """
+    Fan-out of encoded frames between nodes (processes) serving the same
+    documents.
+
+    A node delivers frames to its own connections itself; `publish` only has
+    to reach the other nodes subscribed to the channel. Frames published by
+    one node on one channel arrive everywhere in the order they were published.
+    """
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+        self.published = 0
+        self.received = 0
+
+    @abstractmethod
+    def publish(self, channel: str, frame: bytes) -> None:
+        ...
+
+    @abstractmethod
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        ...
+
+    @abstractmethod
+    async def unsubscribe(self, channel: str) -> None:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+class LocalPubSub(PubSub):
+    """
+    In-process bus: every instance is a node, and nodes in the same process
+    see each other's frames. With a single ConnectionManager there is nobody
+    to publish to, which is the single-worker deployment.
+    """
+
+    _channels: Dict[str, Dict[str, Handler]] = {}
+
+    def publish(self, channel: str, frame: bytes) -> None:
+        self.published += 1
+        for node_id, handler in list(self._channels.get(channel, {}).items()):
+            if node_id != self.node_id:
+                handler(frame)
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        def counted(frame: bytes) -> None:
+            self.received += 1
+            handler(frame)
+
+        self._channels.setdefault(channel, {})[self.node_id] = counted
+
+    async def unsubscribe(self, channel: str) -> None:
+        nodes = self._channels.get(channel, {})
+        nodes.pop(self.node_id, None)
+        if not nodes:
+            self._channels.pop(channel, None)
+
+
+class RedisPubSub(PubSub):
+    """
+    Redis pub/sub bus for several workers or hosts.
+
+    Frames are published by a single task in the order `publish` was called, and
+    prefixed with the node id so a node skips its own frames when they come back.
+    """
+
+    def __init__(self, url: str):
+        super().__init__()
+        self.redis = aioredis.from_url(url)
+        self._pubsub = self.redis.pubsub()
+        self._handlers: Dict[str, Handler] = {}
+        self._outgoing: asyncio.Queue[tuple[str, bytes]] = asyncio.Queue()
+        self._publisher: asyncio.Task | None = None
+        self._reader: asyncio.Task | None = None
+        self._prefix = f"{self.node_id}\n".encode()
+
+    def publish(self, channel: str, frame: bytes) -> None:
+        self._outgoing.put_nowait((channel, self._prefix + frame))
+        if self._publisher is None or self._publisher.done():
+            self._publisher = asyncio.create_task(self._publish_loop())
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        self._handlers[channel] = handler
+        await self._pubsub.subscribe(channel)
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self._read_loop())
+
+    async def unsubscribe(self, channel: str) -> None:
+        self._handlers.pop(channel, None)
+        await self._pubsub.unsubscribe(channel)
+
+    async def close(self) -> None:
+        for task in (self._publisher, self._reader):
+            if task is not None:
+                task.cancel()
+        await self._pubsub.close()
+        await self.redis.close()
+
+    async def _publish_loop(self) -> None:
+        while True:
+            channel, message = await self._outgoing.get()
+            try:
+                await self.redis.publish(channel, message)
+                self.published += 1
+            except Exception as e:
+                print(f"Error publishing to {channel}: {e}")
+
+    async def _read_loop(self) -> None:
+        while True:
+            try:
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0
+                )
+            except Exception as e:
+                print(f"Error reading from pub/sub: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if message is None:
+                continue
+            node_id, _, frame = message["data"].partition(b"\n")
+            if node_id.decode() == self.node_id:
+                continue
+            handler = self._handlers.get(message["channel"].decode())
+            if handler is not None:
+                self.received += 1
+                handler(frame)
+
+
+def create_pubsub(backend: str, redis_url: str) -> PubSub:
+    if backend == "redis":
+        return RedisPubSub(redis_url)
+    return LocalPubSub()
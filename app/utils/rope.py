@@ -0,0 +1,236 @@
+import random
+from typing import Iterator
+
+# Chunks are edited in place up to this size; larger texts are split across nodes.
+LEAF_SIZE = 512
+
+
+class _Node:
+    """Treap node holding one chunk of text; `size` covers the whole subtree."""
+
+    __slots__ = ("text", "size", "prio", "left", "right")
+
+    def __init__(self, text: str, prio: float | None = None):
+        self.text = text
+        self.size = len(text)
+        self.prio = random.random() if prio is None else prio
+        self.left: _Node | None = None
+        self.right: _Node | None = None
+
+
+def _size(node: _Node | None) -> int:
+    return node.size if node else 0
+
+
+def _update(node: _Node) -> None:
+    node.size = _size(node.left) + len(node.text) + _size(node.right)
+
+
+def _merge(a: _Node | None, b: _Node | None) -> _Node | None:
+    """Concatenate two treaps (every char of `a` precedes every char of `b`)."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.prio > b.prio:
+        a.right = _merge(a.right, b)
+        _update(a)
+        return a
+    b.left = _merge(a, b.left)
+    _update(b)
+    return b
+
+
+def _split(node: _Node | None, pos: int) -> tuple[_Node | None, _Node | None]:
+    """Split a treap so the left part holds exactly the first `pos` chars."""
+    if node is None:
+        return None, None
+    left_size = _size(node.left)
+    if pos <= left_size:
+        left, node.left = _split(node.left, pos)
+        _update(node)
+        return left, node
+    pos -= left_size
+    if pos >= len(node.text):
+        node.right, right = _split(node.right, pos - len(node.text))
+        _update(node)
+        return node, right
+    # The split point falls inside this node's chunk
+    tail = _Node(node.text[pos:])
+    node.text = node.text[:pos]
+    right = _merge(tail, node.right)
+    node.right = None
+    _update(node)
+    return node, right
+
+
+def _build(chunks: list[str]) -> _Node | None:
+    """Build a balanced treap from chunks in O(n)."""
+
+    def build(lo: int, hi: int) -> _Node | None:
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        node = _Node(chunks[mid])
+        node.left = build(lo, mid)
+        node.right = build(mid + 1, hi)
+        _update(node)
+        return node
+
+    root = build(0, len(chunks))
+    # Parents must outrank children: hand out sorted priorities in BFS order.
+    prios = sorted((random.random() for _ in chunks), reverse=True)
+    level = [root] if root else []
+    i = 0
+    while level:
+        next_level = []
+        for node in level:
+            node.prio = prios[i]
+            i += 1
+            next_level.extend(child for child in (node.left, node.right) if child)
+        level = next_level
+    return root
+
+
+def _chunk(text: str) -> list[str]:
+    return [text[i : i + LEAF_SIZE] for i in range(0, len(text), LEAF_SIZE)]
+
+
+class Rope:
+    """
+    Mutable text buffer with O(log n) insert and delete.
+
+    Text lives in chunks of at most a few hundred chars arranged as an implicit
+    treap. Small edits inside a chunk rewrite only that chunk; `str(rope)` joins
+    the chunks and is cached until the next edit.
+    """
+
+    def __init__(self, text: str = ""):
+        self._root = _build(_chunk(text))
+        self._nodes = len(text) // LEAF_SIZE + 1
+        self._text: str | None = text
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def __str__(self) -> str:
+        if self._text is None:
+            self._text = "".join(self.chunks())
+            # Many edits leave behind small chunks; rebuild once they dominate.
+            if self._nodes > 2 * (len(self._text) // LEAF_SIZE + 1):
+                self._root = _build(_chunk(self._text))
+                self._nodes = len(self._text) // LEAF_SIZE + 1
+        return self._text
+
+    def __repr__(self) -> str:
+        return f"Rope(len={len(self)})"
+
+    def chunks(self) -> Iterator[str]:
+        """Yield the chunks of text in order without materializing the whole string."""
+        stack: list[_Node] = []
+        node = self._root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            if node.text:
+                yield node.text
+            node = node.right
+
+    def slice(self, start: int, end: int) -> str:
+        """Return text[start:end], visiting only the chunks that overlap it."""
+        start, end = max(0, start), min(end, len(self))
+        if start >= end:
+            return ""
+        if self._text is not None:
+            return self._text[start:end]
+        parts: list[str] = []
+        self._collect(self._root, start, end, parts)
+        return "".join(parts)
+
+    def _collect(self, node: _Node | None, start: int, end: int, parts: list[str]) -> None:
+        if node is None or start >= end:
+            return
+        left_size = _size(node.left)
+        if start < left_size:
+            self._collect(node.left, start, min(end, left_size), parts)
+        text_end = left_size + len(node.text)
+        if start < text_end and end > left_size:
+            parts.append(node.text[max(0, start - left_size) : end - left_size])
+        if end > text_end:
+            self._collect(node.right, max(0, start - text_end), end - text_end, parts)
+
+    def insert(self, pos: int, text: str) -> None:
+        if not text:
+            return
+        pos = max(0, min(pos, len(self)))
+        self._text = None
+        if len(text) <= LEAF_SIZE and self._insert_in_place(pos, text):
+            return
+        left, right = _split(self._root, pos)
+        chunks = _chunk(text)
+        self._nodes += len(chunks) + 1
+        middle = None
+        for chunk in chunks:
+            middle = _merge(middle, _Node(chunk))
+        self._root = _merge(_merge(left, middle), right)
+
+    def delete(self, pos: int, length: int) -> None:
+        pos = max(0, min(pos, len(self)))
+        length = min(length, len(self) - pos)
+        if length <= 0:
+            return
+        self._text = None
+        if self._delete_in_place(pos, length):
+            return
+        left, rest = _split(self._root, pos)
+        _, right = _split(rest, length)
+        self._nodes += 1
+        self._root = _merge(left, right)
+
+    def _path_to(self, pos: int) -> tuple[list[_Node], int]:
+        """
+        Path from the root to the node whose chunk contains `pos` (a chunk ending
+        exactly at `pos` counts, so typing at a chunk's end stays in that chunk),
+        plus the offset of `pos` inside that chunk.
+        """
+        path: list[_Node] = []
+        node = self._root
+        while node is not None:
+            path.append(node)
+            left_size = _size(node.left)
+            if pos < left_size or (pos == left_size and pos > 0):
+                node = node.left
+                continue
+            pos -= left_size
+            if pos <= len(node.text):
+                return path, pos
+            pos -= len(node.text)
+            node = node.right
+        return path, -1
+
+    def _insert_in_place(self, pos: int, text: str) -> bool:
+        path, offset = self._path_to(pos)
+        if offset < 0:
+            return False
+        node = path[-1]
+        if len(node.text) + len(text) > LEAF_SIZE:
+            return False
+        node.text = node.text[:offset] + text + node.text[offset:]
+        for ancestor in path:
+            ancestor.size += len(text)
+        return True
+
+    def _delete_in_place(self, pos: int, length: int) -> bool:
+        path, offset = self._path_to(pos)
+        if offset < 0:
+            return False
+        node = path[-1]
+        # Only when the deleted range sits inside one chunk and leaves it non-empty
+        if offset + length > len(node.text) or length >= len(node.text):
+            return False
+        node.text = node.text[:offset] + node.text[offset + length :]
+        for ancestor in path:
+            ancestor.size -= length
+        return True
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from datetime import datetime
 from typing import Optional
 
 @dataclass
@@ -16,3 +17,19 @@ class SimpleOp:
     text: str | None = None
     length: int | None = None
     user_id: str | None = None
+
+
+@dataclass
+class AppliedOp:
+    """
+    An operation that has been sequenced by the server.
+    Mirrors the columns of `Operation` so it can be used anywhere an op row is expected.
+    """
+    position: int
+    insert_text: str | None
+    delete_len: int
+    user_id: str
+    base_version: int
+    applied_version: int
+    created_at: datetime
+    id: int | None = None
@@ -0,0 +1,152 @@
+"""
+Per-op traces of the realtime pipeline, for finding individual slow ops.
+
+The WebSocket loop starts a trace when a message arrives and each stage
+(parse, lock, concurrent, transform, apply, commit, ack, broadcast) calls
+`mark`, which charges the time since the previous mark to that stage. The
+trace is carried in a context variable, so `DocumentStateManager.submit` marks
+its stages without being passed anything; with tracing off `mark` is a
+no-op. A finished trace is written as one JSON line to `trace_file` if it
+was sampled (`trace_sample_rate`) or took at least `trace_slow_ms`; the
+lines are handed to a writer thread so the event loop never waits on the
+file.
+"""
+import json
+import queue
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import List, Tuple
+
+from app.core.config import settings
+
+
+class OpTrace:
+    __slots__ = ("doc_id", "user_id", "codec", "kind", "size", "sampled", "started", "last", "stages")
+
+    def __init__(self, doc_id: str, user_id: str, codec: str, size: int, sampled: bool):
+        self.doc_id = doc_id
+        self.user_id = str(user_id)
+        self.codec = codec
+        self.kind = None  # message kind, once parsed
+        self.size = size  # bytes of the received frame
+        self.sampled = sampled
+        self.started = self.last = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+
+    def mark(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+
+_current: ContextVar[OpTrace | None] = ContextVar("op_trace", default=None)
+
+
+def mark(stage: str) -> None:
+    """End `stage` of the op being traced in this task, if any."""
+    trace = _current.get()
+    if trace is not None:
+        trace.mark(stage)
+
+
+class Tracer:
+    def __init__(self, sample_rate: float, slow_ms: float, path: str):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms  # 0 = no slow-op log
+        self.path = path
+        self.traced = 0
+        self.written = 0
+        self.slow = 0
+        self._lines: queue.SimpleQueue = queue.SimpleQueue()  # None stops the writer
+        self._thread: threading.Thread | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow_ms > 0
+
+    def configure(
+        self, sample_rate: float | None = None, slow_ms: float | None = None
+    ) -> None:
+        """Change sampling at runtime; applies from the next message."""
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if slow_ms is not None:
+            self.slow_ms = slow_ms
+
+    def start(self, doc_id: str, user_id: str, codec: str, size: int) -> OpTrace | None:
+        """Begin tracing the message just received, if tracing is on."""
+        if not self.enabled:
+            return None
+        sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        trace = OpTrace(doc_id, user_id, codec, size, sampled)
+        _current.set(trace)
+        return trace
+
+    def finish(self, trace: OpTrace | None, outcome: str, version: int | None = None, ops: int = 0) -> None:
+        """Close the trace; write it if it was sampled or slow."""
+        if trace is None:
+            return
+        _current.set(None)
+        self.traced += 1
+        total_ms = (time.perf_counter() - trace.started) * 1000
+        slow = 0 < self.slow_ms <= total_ms
+        if not (slow or trace.sampled):
+            return
+        stages: dict = {}
+        for stage, seconds in trace.stages:
+            stages[stage] = round(stages.get(stage, 0.0) + seconds * 1000, 3)
+        record = {
+            "ts": time.time(),
+            "doc_id": trace.doc_id,
+            "user_id": trace.user_id,
+            "codec": trace.codec,
+            "kind": trace.kind,
+            "bytes": trace.size,
+            "ops": ops,
+            "version": version,
+            "outcome": outcome,
+            "slow": slow,
+            "total_ms": round(total_ms, 3),
+            "stages_ms": stages,
+        }
+        if slow:
+            self.slow += 1
+            slowest = max(stages, key=stages.get, default="-")
+            print(f"Slow op on {trace.doc_id}: {total_ms:.1f} ms ({slowest} {stages.get(slowest, 0)} ms)")
+        self._write(record)
+
+    def _write(self, record: dict) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, args=(self.path,), name="trace-writer", daemon=True
+            )
+            self._thread.start()
+        self._lines.put(json.dumps(record) + "\n")
+
+    def _run(self, path: str) -> None:
+        with open(path, "a", buffering=1) as f:
+            while (line := self._lines.get()) is not None:
+                f.write(line)
+                self.written += 1
+
+    def close(self) -> None:
+        """Write out the queued traces and stop the writer thread."""
+        if self._thread is not None:
+            self._lines.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "slow_ms": self.slow_ms,
+            "path": self.path,
+            "traced": self.traced,
+            "written": self.written,
+            "slow": self.slow,
+        }
+
+
+tracer = Tracer(settings.trace_sample_rate, settings.trace_slow_ms, settings.trace_file)
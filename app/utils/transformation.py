@@ -1,4 +1,10 @@
-from typing import List
+from typing import Iterable, List, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # the batch transform falls back to the scalar engine
+    np = None
+
 from app.db.schemas.operation import OperationIn, OperationOut
 from app.utils.simpleop import SimpleOp
 
@@ -150,3 +156,199 @@ def transform_incoming_operation(
         delete_len=delete_len or 0,
         base_version=incoming.base_version,
     )
+
+
+# Compact transform engine
+#
+# The functions above allocate a SimpleOp per concurrent op (and per incoming
+# insert/delete) on every step. The hot path instead works on plain tuples
+# packed once per op, and keeps the incoming op in local ints.
+
+PackedOp = Tuple[int, int, int, str]  # (position, insert_len, delete_len, user_id)
+
+
+def pack_op(op) -> PackedOp:
+    """Pack an applied op (Operation row, AppliedOp, ...) for `transform_packed`."""
+    return (op.position, len(op.insert_text or ""), op.delete_len or 0, str(op.user_id))
+
+
+def transform_packed(
+    position: int,
+    delete_len: int,
+    has_insert: bool,
+    user_id: str | None,
+    concurrent_ops: Iterable[PackedOp],
+) -> Tuple[int, int]:
+    """
+    Transform an incoming op against packed concurrent ops.
+    Returns the new (position, delete_len); gives exactly the same result as
+    `transform_incoming_operation`.
+    """
+    uid = user_id or ""
+    pos = position
+    for a_pos, a_ins, a_del, a_uid in concurrent_ops:
+        if delete_len > 0:
+            if a_del:
+                # delete against delete
+                if pos + delete_len <= a_pos:
+                    pass
+                elif pos >= a_pos + a_del:
+                    pos -= a_del
+                else:
+                    overlap = min(pos + delete_len, a_pos + a_del) - max(pos, a_pos)
+                    delete_len = max(delete_len - overlap, 0)
+                    if pos >= a_pos:
+                        pos -= min(pos - a_pos, a_del)
+            elif pos >= a_pos:
+                # delete against insert: shift past it...
+                pos += a_ins
+            elif pos + delete_len > a_pos:
+                # ...or swallow it when it lands inside the deleted range
+                delete_len += a_ins
+
+        if has_insert:
+            if a_del:
+                # insert against delete
+                if pos <= a_pos:
+                    pass
+                elif pos >= a_pos + a_del:
+                    pos -= a_del
+                else:
+                    pos = a_pos
+            elif pos > a_pos or (pos == a_pos and not uid < a_uid):
+                # insert against insert; ties go to the smaller user id
+                pos += a_ins
+    return pos, delete_len
+
+
+def transform_sequence(
+    ops: Sequence[PackedOp], concurrent_ops: Iterable[PackedOp]
+) -> List[Tuple[int, int]]:
+    """
+    Transform a run of ops, each made on top of the ones before it, against
+    concurrent ops; returns the new (position, delete_len) of every op.
+
+    The first op is transformed exactly as `transform_packed` would. Later
+    ops have already seen their predecessors but not the concurrent ops, so
+    those are moved past each op in turn before the next one is transformed
+    against them.
+    """
+    bridge = list(concurrent_ops)
+    results = []
+    for position, insert_len, delete_len, uid in ops:
+        op = (position, insert_len, delete_len, uid)
+        rebased = []
+        for concurrent in bridge:
+            a_pos, a_ins, a_del, a_uid = concurrent
+            a_pos, a_del = transform_packed(a_pos, a_del, a_ins > 0, a_uid, (op,))
+            rebased.append((a_pos, a_ins, a_del, a_uid))
+            position, delete_len = transform_packed(
+                position, delete_len, insert_len > 0, uid, (concurrent,)
+            )
+            op = (position, insert_len, delete_len, uid)
+        bridge = rebased
+        results.append((position, delete_len))
+    return results
+
+
+# Below this many incoming ops the per-step NumPy overhead outweighs the gain.
+BATCH_VECTOR_MIN = 200
+
+
+def transform_packed_batch(
+    positions: Sequence[int],
+    delete_lens: Sequence[int],
+    has_insert: Sequence[bool],
+    user_ids: Sequence[str | None],
+    concurrent_ops: Sequence[PackedOp],
+    starts: Sequence[int] | None = None,
+) -> Tuple[List[int], List[int]]:
+    """
+    Transform many incoming ops against one concurrent history at once.
+
+    Incoming op `i` is transformed against `concurrent_ops[starts[i]:]` (the
+    whole history if `starts` is None), so ops with different base versions
+    can share one pass. Returns the new positions and delete lengths; each
+    pair equals what `transform_packed` gives for that op alone.
+
+    The history is walked once and every step updates all incoming ops with
+    vectorized NumPy operations; without NumPy, or for small batches, each op
+    goes through `transform_packed`.
+
+    The incoming ops must be independent of each other (from different
+    clients, none made on top of another), as with the ops queued on a busy
+    document (`DocumentStateManager._sequence`); they still have to be moved
+    past each other afterwards. A client's own run of dependent ops goes
+    through `transform_sequence` instead.
+    """
+    count = len(positions)
+    if starts is None:
+        starts = [0] * count
+    if np is None or count < BATCH_VECTOR_MIN:
+        results = [
+            transform_packed(
+                positions[i], delete_lens[i], has_insert[i], user_ids[i],
+                concurrent_ops[starts[i]:],
+            )
+            for i in range(count)
+        ]
+        return [r[0] for r in results], [r[1] for r in results]
+
+    # Ties compare user ids as strings; compare their ranks instead.
+    keys = {uid or "" for uid in user_ids}
+    keys.update(op[3] for op in concurrent_ops)
+    rank = {key: i for i, key in enumerate(sorted(keys))}
+
+    # Sorted by start, the ops a history entry applies to are a prefix.
+    order = sorted(range(count), key=starts.__getitem__)
+    pos = np.array([positions[i] for i in order], dtype=np.int64)
+    dl = np.array([delete_lens[i] for i in order], dtype=np.int64)
+    ins = np.array([has_insert[i] for i in order], dtype=bool)
+    uid = np.array([rank[user_ids[i] or ""] for i in order], dtype=np.int64)
+    first = [starts[i] for i in order]
+
+    active = 0
+    for j, (a_pos, a_ins, a_del, a_uid) in enumerate(concurrent_ops):
+        while active < count and first[active] <= j:
+            active += 1
+        if active and (a_ins or a_del):
+            _transform_step(
+                pos[:active], dl[:active], ins[:active], uid[:active],
+                a_pos, a_ins, a_del, rank[a_uid],
+            )
+
+    new_positions, new_delete_lens = [0] * count, [0] * count
+    for row, i in enumerate(order):
+        new_positions[i] = int(pos[row])
+        new_delete_lens[i] = int(dl[row])
+    return new_positions, new_delete_lens
+
+
+def _transform_step(pos, dl, inserting, uid, a_pos, a_ins, a_del, a_uid) -> None:
+    """One `transform_packed` iteration applied in place to every row."""
+    deleting = dl > 0
+    if a_del:
+        # delete against delete
+        reaching = deleting & (pos + dl > a_pos)
+        after = pos >= a_pos + a_del
+        overlapping = reaching & ~after
+        if overlapping.any():
+            overlap = np.minimum(pos + dl, a_pos + a_del) - np.maximum(pos, a_pos)
+            np.maximum(dl - overlap, 0, out=dl, where=overlapping)
+            np.subtract(
+                pos, np.minimum(pos - a_pos, a_del), out=pos, where=overlapping & (pos >= a_pos)
+            )
+        np.subtract(pos, a_del, out=pos, where=reaching & after)
+
+        # insert against delete: shift left, or to the start of the deleted range
+        past = inserting & (pos > a_pos)
+        np.subtract(pos, np.minimum(pos - a_pos, a_del), out=pos, where=past)
+    else:
+        # delete against insert
+        before = pos < a_pos
+        np.add(dl, a_ins, out=dl, where=deleting & before & (pos + dl > a_pos))
+        np.add(pos, a_ins, out=pos, where=deleting & ~before)
+
+        # insert against insert; ties go to the smaller user id
+        shifted = inserting & ((pos > a_pos) | ((pos == a_pos) & (uid >= a_uid)))
+        np.add(pos, a_ins, out=pos, where=shifted)
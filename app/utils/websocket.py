@@ -1,47 +1,232 @@
+import asyncio
 import json
-from typing import Dict, List
+import time
+from typing import Callable, Dict, List
 
-from fastapi import WebSocket
-from sqlalchemy import JSON
+from fastapi import WebSocket, status
+
+from app.core.config import settings
+from app.utils import metrics
+from app.utils.codec import BinaryCodec, JsonCodec, OpFrames, binary_codec, json_codec
+from app.utils.pubsub import PubSub, create_pubsub
+
+
+class Connection:
+    """
+    A client socket on a document.
+
+    Outgoing frames go into a bounded queue drained by the connection's own
+    writer task, so a slow client never holds up the code sending to it.
+    """
+
+    def __init__(
+        self,
+        manager: "ConnectionManager",
+        websocket: WebSocket,
+        document_id: str,
+        codec: JsonCodec | BinaryCodec,
+    ):
+        self.manager = manager
+        self.websocket = websocket
+        self.document_id = document_id
+        # Wire encoding of ops for this client, negotiated at connect time
+        self.codec = codec
+        self.queue: asyncio.Queue[str | bytes] = asyncio.Queue(manager.max_queue)
+        # Builds the frame that replaces a backed-up queue under the "resync" policy
+        self.resync: Callable[[], str | bytes] | None = None
+        self.high_water = 0
+        self.closed = False
+        self._writer = asyncio.create_task(self._write_loop())
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def send(self, frame: str | bytes) -> bool:
+        """Queue an encoded frame; returns False if it was not queued."""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self._overflow()
+            return False
+        self.high_water = max(self.high_water, self.queue.qsize())
+        return True
+
+    async def drain(self) -> None:
+        """Wait until every queued frame has been written."""
+        if not self.closed:
+            await self.queue.join()
+
+    async def close(self, code: int = status.WS_1000_NORMAL_CLOSURE) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self._writer.cancel()
+        self._discard()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass  # Already gone
+
+    def _overflow(self) -> None:
+        self.manager.overflows += 1
+        if self.manager.slow_consumer_policy == "resync" and self.resync is not None:
+            # Everything queued is stale for a client this far behind; it starts
+            # over from the current content instead.
+            self.manager.dropped_frames += self._discard()
+            self.queue.put_nowait(self.resync())
+            self.manager.resyncs += 1
+            metrics.SYNC_NEEDED.labels("slow_consumer").inc()
+        else:
+            print(f"Disconnecting slow consumer on document {self.document_id}")
+            self.manager.slow_disconnects += 1
+            asyncio.create_task(self.close(status.WS_1013_TRY_AGAIN_LATER))
+
+    async def _write_loop(self) -> None:
+        while True:
+            frame = await self.queue.get()
+            try:
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+            except Exception as e:
+                print(f"Error sending message to {self.websocket}: {e}")
+                self.closed = True
+                return
+            finally:
+                self.queue.task_done()
+                if self.closed:
+                    self._discard()
+
+    def _discard(self) -> int:
+        """Drop every queued frame, releasing anyone waiting in `drain`."""
+        count = 0
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.queue.task_done()
+            count += 1
+        return count
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+    """
+    Connections on this node, grouped by document. Frames for a document are
+    delivered to local connections directly and published on `bus` for the
+    connections other nodes hold.
+    """
+
+    def __init__(self, max_queue: int, slow_consumer_policy: str, bus: PubSub):
+        self.max_queue = max_queue
+        self.slow_consumer_policy = slow_consumer_policy
+        self.bus = bus
+        self.active_connections: Dict[str, List[Connection]] = {}
+        self.overflows = 0
+        self.dropped_frames = 0
+        self.resyncs = 0
+        self.slow_disconnects = 0
 
-    async def connect(self, websocket: WebSocket, document_id: str):
+    async def connect(
+        self,
+        websocket: WebSocket,
+        document_id: str,
+        codec: JsonCodec | BinaryCodec = json_codec,
+    ) -> Connection:
         await websocket.accept()
+        connection = Connection(self, websocket, document_id, codec)
         conns = self.active_connections.setdefault(document_id, [])
-        conns.append(websocket)
+        conns.append(connection)
+        if len(conns) == 1:
+            await self.bus.subscribe(
+                self._channel(document_id),
+                lambda data: self._deliver(document_id, OpFrames.from_binary(document_id, data)),
+            )
+        return connection
 
-    async def disconnect(self, websocket: WebSocket, document_id: str):
-        conns = self.active_connections.get(document_id)
+    async def disconnect(self, connection: Connection):
+        await connection.close()
+        conns = self.active_connections.get(connection.document_id)
         if not conns:
-            del self.active_connections[document_id]
-            return
-        try:
-            conns.remove(websocket)
-        except ValueError:
-            print(f"WebSocket {websocket} not found in connections for document {document_id}")
             return
+        if connection in conns:
+            conns.remove(connection)
+        if not conns:
+            del self.active_connections[connection.document_id]
+            await self.bus.unsubscribe(self._channel(connection.document_id))
 
     async def broadcast(
-        self, document_id: str, message: dict, exclude: WebSocket | None = None
+        self, document_id: str, frames: OpFrames, exclude: Connection | None = None
     ):
-        # No active connections for this document
-        if document_id not in self.active_connections:
-            return
-        # Converting message dict to JSON string
-        text = json.dumps(message)
-        # Getting active connections for this document
-        conns = self.active_connections[document_id]
+        # Encoded once per codec, then queued for every subscriber here; other
+        # nodes get the compact binary frame and re-encode it for their clients.
+        started = time.perf_counter()
+        recipients = self._deliver(document_id, frames, exclude)
+        self.bus.publish(self._channel(document_id), frames.frame(binary_codec))
+        metrics.BROADCAST_TIME.observe(time.perf_counter() - started)
+        metrics.BROADCAST_RECIPIENTS.observe(recipients)
+
+    async def redirect(self, document_id: str, url: str) -> None:
+        """Send every local connection on a document to `url` and close it."""
+        await self._close_all(document_id, json.dumps({"type": "redirect", "url": url}))
+
+    async def reset(self, document_id: str, message: str) -> None:
+        """Tell every local connection on a document to reload it, and close it."""
+        await self._close_all(
+            document_id,
+            json.dumps({"type": "error", "message": message}),
+            status.WS_1011_INTERNAL_ERROR,
+        )
+
+    async def _close_all(
+        self, document_id: str, frame: str, code: int = status.WS_1000_NORMAL_CLOSURE
+    ) -> None:
+        conns = list(self.active_connections.get(document_id, ()))
         for connection in conns:
-            if connection != exclude:
-                try:
-                    await connection.send_text(text)
-                except Exception as e:
-                    print(f"Error sending message to {connection}: {e}")
-                    await self.disconnect(document_id, connection)
+            connection.send(frame)
+        await asyncio.gather(*(connection.drain() for connection in conns))
+        for connection in conns:
+            await connection.close(code)
+            await self.disconnect(connection)
+
+    async def close(self) -> None:
+        await self.bus.close()
+
+    def _deliver(
+        self, document_id: str, frames: OpFrames, exclude: Connection | None = None
+    ) -> int:
+        count = 0
+        for connection in list(self.active_connections.get(document_id, ())):
+            if connection is not exclude:
+                connection.send(frames.frame(connection.codec))
+                count += 1
+        return count
+
+    @staticmethod
+    def _channel(document_id: str) -> str:
+        return f"doc:{document_id}"
+
+    def queue_stats(self) -> dict:
+        """Outbound queue depths across all connections, plus slow-consumer counters."""
+        depths = [
+            connection.depth
+            for conns in self.active_connections.values()
+            for connection in conns
+        ]
+        return {
+            "connections": len(depths),
+            "queued_frames": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "overflows": self.overflows,
+            "dropped_frames": self.dropped_frames,
+            "resyncs": self.resyncs,
+            "slow_disconnects": self.slow_disconnects,
+        }
 
 
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager(
+    settings.send_queue_size,
+    settings.slow_consumer_policy,
+    create_pubsub(settings.pubsub_backend, settings.redis_url),
+)